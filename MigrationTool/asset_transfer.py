@@ -0,0 +1,546 @@
+"""
+Bounded-concurrency asset transfer engine
+
+Downloads and uploads run on separate thread pools so that N downloads and
+M uploads stay in flight across records and record types. Every remote host
+gets its own concurrency cap, and a record's completion callback (usually the
+Firestore update) only runs once all of that record's assets have finished.
+
+Also holds the asset helpers shared by the migration scripts: file type
+detection, the upload policy, the index of existing blobs, content-addressed
+storage and streaming uploads.
+"""
+
+import hashlib
+import posixpath
+import threading
+import time
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, ContextManager, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from metrics import metrics
+from rate_limit import storage_limiter
+
+# (record_name, updates, failures) -> None
+CompletionCallback = Callable[[str, Dict[str, str], Dict[str, Exception]], None]
+
+CONTENT_TYPES = {
+    "jpg": "image/jpeg",
+    "png": "image/png",
+    "usdz": "model/vnd.usdz+zip",
+    "gif": "image/gif"
+}
+
+
+def detect_extension(data: bytes) -> str:
+    """Detect file extension from magic bytes"""
+    if len(data) >= 4:
+        if data[:3] == b'\xff\xd8\xff':
+            return "jpg"
+        elif data[:4] == b'\x89PNG':
+            return "png"
+        elif data[:4] == b'PK\x03\x04':
+            return "usdz"
+        elif data[:4] == b'GIF8':
+            return "gif"
+    return "bin"
+
+
+# Resumable upload chunks must be a multiple of 256 KiB
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Enough leading bytes for detect_extension
+SNIFF_BYTES = 16
+
+
+# Migrated assets never change under a given path, so clients may cache them for a year
+DEFAULT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# acl:         public-read predefined ACL sent with the upload request itself
+# bucket:      the bucket grants public read (uniform bucket-level access); no object ACL
+# make-public: separate make_public() call after each upload, as before
+PUBLIC_MODES = ("acl", "bucket", "make-public")
+
+
+class UploadPolicy:
+    """How uploaded assets are published
+
+    Content type, cache-control and (in "acl" mode) the public-read ACL travel
+    in the upload request, so publishing an object costs no extra round trip.
+    The scripts configure the process-wide `upload_policy` from their flags.
+    """
+
+    def __init__(self, public_mode: str = "acl", cache_control: str = DEFAULT_CACHE_CONTROL):
+        self.public_mode = public_mode
+        self.cache_control = cache_control
+
+    def _prepare(self, blob, content_type: str, publish: bool = True) -> dict:
+        # Sent as object metadata in the upload request
+        blob.cache_control = self.cache_control
+        blob.content_type = content_type
+        kwargs = {"content_type": content_type}
+        if publish and self.public_mode == "acl":
+            kwargs["predefined_acl"] = "publicRead"
+        return kwargs
+
+    def upload(self, blob, data: bytes, content_type: Optional[str] = None) -> str:
+        """Upload bytes as a public object and return its public URL"""
+        content_type = content_type or CONTENT_TYPES.get(detect_extension(data), "application/octet-stream")
+        kwargs = self._prepare(blob, content_type)
+        # Retried with backoff when Storage throttles or fails transiently
+        with metrics.timer("storage_upload", len(data)):
+            storage_limiter.call(blob.upload_from_string, data, **kwargs)
+        if self.public_mode == "make-public":
+            self.make_public(blob)
+        return blob.public_url
+
+    def upload_file(self, blob, file_obj, content_type: str, publish: bool = True):
+        """Stream a file object into a public object (not retried: the stream can't be rewound)
+
+        With publish=False the object is left private, for staged uploads
+        that are copied elsewhere (and published there with publish_copy).
+        """
+        blob.upload_from_file(file_obj, **self._prepare(blob, content_type, publish))
+        if publish and self.public_mode == "make-public":
+            self.make_public(blob)
+
+    def publish_copy(self, blob):
+        """Make a server-side copy public; copies get the bucket's default object ACL"""
+        if self.public_mode != "bucket":
+            self.make_public(blob)
+
+    def make_public(self, blob):
+        with metrics.timer("storage_make_public"):
+            storage_limiter.call(blob.make_public)
+
+
+# Process-wide policy shared by every upload path
+upload_policy = UploadPolicy()
+
+
+class ExistingBlob(NamedTuple):
+    """Listing entry of an object already in Storage"""
+    name: str
+    size: int
+    md5_hash: Optional[str]
+    crc32c: Optional[str]
+
+
+class BlobIndex:
+    """Objects already under a Storage prefix, listed in bulk before transfers start
+
+    One paginated listing returning only names, sizes and hashes replaces a
+    metadata request per asset. Per-record blobs are looked up by path without
+    the extension, since that depends on the bytes. Read-only once built, so
+    it can be shared between threads.
+    """
+
+    def __init__(self, blobs: Iterable[ExistingBlob] = ()):
+        self._by_name: Dict[str, ExistingBlob] = {}
+        self._by_stem: Dict[str, ExistingBlob] = {}
+        for blob in blobs:
+            self._by_name[blob.name] = blob
+            self._by_stem[posixpath.splitext(blob.name)[0]] = blob
+
+    @classmethod
+    def list(cls, bucket, prefix: str = "migrated/", page_size: int = 1000) -> "BlobIndex":
+        with metrics.timer("storage_list") as call:
+            listing = bucket.list_blobs(prefix=prefix, page_size=page_size,
+                                        fields="items(name,size,md5Hash,crc32c),nextPageToken")
+            index = cls(ExistingBlob(blob.name, int(blob.size or 0), blob.md5_hash, blob.crc32c) for blob in listing)
+            call.items = len(index)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._by_name)
+
+    def get(self, name: str) -> Optional[ExistingBlob]:
+        return self._by_name.get(name)
+
+    def find(self, record_name: str, field_name: str, size: Optional[int]) -> Optional[ExistingBlob]:
+        """The blob migrated for this asset, if it exists with the expected size"""
+        blob = self._by_stem.get(f"migrated/{record_name}/{field_name}")
+        if blob is None or size is None or blob.size != size:
+            return None
+        return blob
+
+
+def content_blob_path(digest: str, ext: str) -> str:
+    """Storage path of a content-addressed asset"""
+    return f"migrated/content/{digest[:2]}/{digest}.{ext}"
+
+
+class ContentAddressedUploader:
+    """Stores each distinct asset once, keyed by the SHA-256 of its bytes
+
+    `put(blob_path, data)` uploads and returns the public URL. The digest →
+    URL index lives in the checkpoint store, so identical bytes shared by
+    several records (or seen in an earlier run) cost no further uploads.
+    """
+
+    def __init__(self, store, put: Callable[[str, bytes], str]):
+        self.store = store
+        self.put = put
+        self._lock = threading.Lock()
+        self.deduplicated = 0
+        self.deduplicated_bytes = 0
+
+    def __call__(self, record_name: str, field_name: str, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        public_url = self.store.content_url(digest)
+        if public_url:
+            with self._lock:
+                self.deduplicated += 1
+                self.deduplicated_bytes += len(data)
+            print(f"      ♻️ {record_name}/{field_name}: duplicate of {digest[:12]}")
+            return public_url
+
+        public_url = self.put(content_blob_path(digest, detect_extension(data)), data)
+        self.store.save_content(digest, len(data), public_url)
+        return public_url
+
+
+class HashingReader:
+    """Read-only file object over a response that hashes bytes as they pass through
+
+    The bytes already read for type sniffing are replayed first, so the
+    upload sees the complete stream.
+    """
+
+    def __init__(self, response, prefix: bytes = b""):
+        self._response = response
+        self._prefix = prefix
+        self._position = 0
+        self.sha256 = hashlib.sha256()
+
+    def readable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        if self._prefix:
+            if size is None or size < 0:
+                data = self._prefix + self._response.read()
+                self._prefix = b""
+            else:
+                data, self._prefix = self._prefix[:size], self._prefix[size:]
+                if len(data) < size:
+                    data += self._response.read(size - len(data))
+        else:
+            data = self._response.read() if size is None or size < 0 else self._response.read(size)
+        self.sha256.update(data)
+        self._position += len(data)
+        return data
+
+
+class StreamedAsset(NamedTuple):
+    """An asset that was piped straight into Storage"""
+    public_url: str
+    size: int
+
+
+class StreamingUploader:
+    """Pipes large downloads into chunked resumable Storage uploads
+
+    Peak memory per transfer is one chunk rather than the whole file, which
+    matters for USDZ models at high concurrency. Responses that declare a
+    length up to one chunk are simply read and returned as bytes, so small
+    images keep the single-request upload path.
+
+    In content-addressed mode the hash is only known once the stream ends, so
+    the object is staged under a temporary name and then copied server-side
+    to its content address (or dropped if that content already exists).
+    """
+
+    def __init__(self, bucket, open_url: Callable[[str], ContextManager], chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 content_store=None):
+        self.bucket = bucket
+        self.open_url = open_url
+        self.chunk_size = chunk_size
+        self.content_store = content_store
+        self._lock = threading.Lock()
+        self.streamed = 0
+        self.deduplicated = 0
+        self.deduplicated_bytes = 0
+
+    def __call__(self, record_name: str, field_name: str, url: str) -> Union[bytes, StreamedAsset]:
+        start = time.perf_counter()
+        with self.open_url(url) as response:
+            if response.length is not None and response.length <= self.chunk_size:
+                data = response.read()
+                metrics.observe("asset_download", time.perf_counter() - start, len(data))
+                return data
+
+            prefix = response.read(SNIFF_BYTES)
+            ext = detect_extension(prefix)
+            reader = HashingReader(response, prefix)
+            if self.content_store is not None:
+                blob_path = f"migrated/content/staging/{uuid.uuid4().hex}.{ext}"
+            else:
+                blob_path = f"migrated/{record_name}/{field_name}.{ext}"
+
+            blob = self.bucket.blob(blob_path, chunk_size=self.chunk_size)
+            # Download and upload overlap, so the pipe is timed as one stage
+            with metrics.timer("asset_stream") as call:
+                # A staged blob is deleted once copied, so only the copy is published
+                upload_policy.upload_file(blob, reader, CONTENT_TYPES.get(ext, "application/octet-stream"),
+                                          publish=self.content_store is None)
+                call.bytes = reader.tell()
+
+        size = reader.tell()
+        with self._lock:
+            self.streamed += 1
+        if self.content_store is not None:
+            blob = self._promote(blob, reader.sha256.hexdigest(), ext, size)
+            if blob is None:
+                return StreamedAsset(self.content_store.content_url(reader.sha256.hexdigest()), size)
+            upload_policy.publish_copy(blob)
+
+        print(f"      ✅ {record_name}/{field_name}: streamed {size} bytes → {blob.name}")
+        if self.content_store is not None:
+            self.content_store.save_content(reader.sha256.hexdigest(), size, blob.public_url)
+        return StreamedAsset(blob.public_url, size)
+
+    def _promote(self, staged, digest: str, ext: str, size: int):
+        """Move a staged upload to its content address; None if that content already exists"""
+        try:
+            if self.content_store.content_url(digest):
+                with self._lock:
+                    self.deduplicated += 1
+                    self.deduplicated_bytes += size
+                print(f"      ♻️ streamed duplicate of {digest[:12]}")
+                return None
+            with metrics.timer("storage_copy", size):
+                return storage_limiter.call(self.bucket.copy_blob, staged, self.bucket, content_blob_path(digest, ext))
+        finally:
+            staged.delete()
+
+
+class HostLimiter:
+    """Caps the number of concurrent requests per remote host"""
+
+    def __init__(self, per_host: int):
+        self.per_host = per_host
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+
+    def _semaphore(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host)
+                self._semaphores[host] = semaphore
+            return semaphore
+
+    @contextmanager
+    def limit(self, url: str):
+        """Hold one of the host's slots for the duration of the block"""
+        semaphore = self._semaphore(urllib.parse.urlparse(url).netloc)
+        with semaphore:
+            yield
+
+
+class _RecordTransfer:
+    """Tracks the outstanding assets of a single record"""
+
+    def __init__(self, record_name: str, pending: int, on_complete: CompletionCallback):
+        self.record_name = record_name
+        self.pending = pending
+        self.on_complete = on_complete
+        self.updates: Dict[str, str] = {}
+        self.failures: Dict[str, Exception] = {}
+        self.lock = threading.Lock()
+
+
+class TransferEngine:
+    """Moves assets from a source to a destination with bounded concurrency
+
+    `download(url)` returns the asset bytes and `upload(record_name, field_name,
+    data)` stores them and returns the new public URL. If `stream` is given it
+    replaces `download`: it may either return the bytes (handed to `upload` as
+    usual) or pipe the asset into Storage itself and return a StreamedAsset.
+    All callables are called from worker threads and must be thread-safe.
+
+    With a `derivatives` renderer, resized copies of each downloaded image are
+    rendered while the original uploads, then uploaded through `upload` as
+    field `<field>_<name>` and included in the record's updates.
+    """
+
+    def __init__(
+        self,
+        download: Callable[[str], bytes],
+        upload: Callable[[str, str, bytes], str],
+        download_workers: int = 8,
+        upload_workers: int = 8,
+        per_host_limit: int = 6,
+        max_queued_assets: int = 0,
+        stream: Optional[Callable[[str, str, str], Union[bytes, StreamedAsset]]] = None,
+        derivatives=None
+    ):
+        self.download = download
+        self.upload = upload
+        self.stream = stream
+        self.derivatives = derivatives
+        self.host_limiter = HostLimiter(per_host_limit)
+        self._download_pool = ThreadPoolExecutor(download_workers, thread_name_prefix="download")
+        self._upload_pool = ThreadPoolExecutor(upload_workers, thread_name_prefix="upload")
+
+        # Bounds both the work queued up front and the downloaded bytes
+        # waiting for an upload slot, so memory stays flat on large catalogs.
+        queue_size = max_queued_assets or 2 * (download_workers + upload_workers)
+        self._queued = threading.BoundedSemaphore(queue_size)
+
+        self._outstanding = 0
+        self._idle = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self.submitted_assets = 0
+        self.uploaded_assets = 0
+        self.failed_assets = 0
+        self.uploaded_bytes = 0
+        self.uploaded_derivatives = 0
+
+    def __enter__(self) -> "TransferEngine":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def submit_record(self, record_name: str, assets: List[Tuple[str, str]], on_complete: CompletionCallback,
+                      resolved: Optional[Dict[str, str]] = None):
+        """Queue all (field_name, url) assets of a record
+
+        Blocks while the transfer queue is full. `on_complete` is called once
+        with the uploaded URLs and the per-field failures after the last asset
+        of the record has finished. `resolved` holds fields whose public URL
+        is already known; they are passed through in the updates.
+        """
+        if not assets:
+            if resolved:
+                try:
+                    on_complete(record_name, dict(resolved), {})
+                except Exception as e:
+                    print(f"      ❌ Failed to finish {record_name}: {e}")
+            return
+
+        transfer = _RecordTransfer(record_name, len(assets), on_complete)
+        transfer.updates.update(resolved or {})
+        with self._idle:
+            self._outstanding += 1
+
+        for field_name, url in assets:
+            self._queued.acquire()
+            with self._stats_lock:
+                self.submitted_assets += 1
+            self._download_pool.submit(self._download, transfer, field_name, url)
+
+    def join(self):
+        """Wait until every submitted record has completed"""
+        with self._idle:
+            while self._outstanding:
+                self._idle.wait()
+
+    def close(self):
+        self.join()
+        self._download_pool.shutdown()
+        self._upload_pool.shutdown()
+        if self.derivatives:
+            self.derivatives.close()
+
+    def _download(self, transfer: _RecordTransfer, field_name: str, url: str):
+        try:
+            with self.host_limiter.limit(url):
+                if self.stream:
+                    data = self.stream(transfer.record_name, field_name, url)
+                else:
+                    data = self.download(url)
+        except Exception as e:
+            self._finish_asset(transfer, field_name, error=e)
+            return
+
+        if isinstance(data, StreamedAsset):
+            with self._stats_lock:
+                self.uploaded_bytes += data.size
+            self._finish_asset(transfer, field_name, public_url=data.public_url)
+            return
+        try:
+            rendering = self._render(transfer, field_name, data)
+            self._upload_pool.submit(self._upload, transfer, field_name, data, rendering)
+        except Exception as e:
+            self._finish_asset(transfer, field_name, error=e)
+
+    def _render(self, transfer: _RecordTransfer, field_name: str, data: bytes):
+        """Start rendering derivatives in other processes while the original uploads
+
+        A broken render pool (e.g. a worker killed for memory) only costs the
+        derivatives: the original is still uploaded.
+        """
+        if not self.derivatives:
+            return None
+        try:
+            return self.derivatives.submit(data)
+        except Exception as e:
+            self.derivatives.record_failure()
+            print(f"      ⚠️ Could not render derivatives of {transfer.record_name}/{field_name}: {e}")
+            return None
+
+    def _upload(self, transfer: _RecordTransfer, field_name: str, data: bytes, rendering=None):
+        try:
+            public_url = self.upload(transfer.record_name, field_name, data)
+        except Exception as e:
+            self._finish_asset(transfer, field_name, error=e)
+            return
+        with self._stats_lock:
+            self.uploaded_bytes += len(data)
+        extra = self._upload_derivatives(transfer, field_name, rendering) if rendering else None
+        self._finish_asset(transfer, field_name, public_url=public_url, extra=extra)
+
+    def _upload_derivatives(self, transfer: _RecordTransfer, field_name: str, rendering) -> Dict[str, str]:
+        """Upload the rendered derivatives of a field; a failure only loses that derivative"""
+        updates = {}
+        for name, (_, body) in self.derivatives.result(rendering).items():
+            derivative_field = f"{field_name}_{name}"
+            try:
+                updates[derivative_field] = self.upload(transfer.record_name, derivative_field, body)
+            except Exception as e:
+                print(f"      ⚠️ Failed {transfer.record_name}/{derivative_field}: {e}")
+                continue
+            with self._stats_lock:
+                self.uploaded_derivatives += 1
+                self.uploaded_bytes += len(body)
+        return updates
+
+    def _finish_asset(self, transfer: _RecordTransfer, field_name: str, public_url: str = "", error: Exception = None,
+                      extra: Optional[Dict[str, str]] = None):
+        self._queued.release()
+
+        with self._stats_lock:
+            if error is None:
+                self.uploaded_assets += 1
+            else:
+                self.failed_assets += 1
+        if error is not None:
+            print(f"      ❌ Failed {transfer.record_name}/{field_name}: {error}")
+
+        with transfer.lock:
+            if error is None:
+                transfer.updates[field_name] = public_url
+                transfer.updates.update(extra or {})
+            else:
+                transfer.failures[field_name] = error
+            transfer.pending -= 1
+            done = transfer.pending == 0
+
+        if done:
+            try:
+                transfer.on_complete(transfer.record_name, transfer.updates, transfer.failures)
+            except Exception as e:
+                print(f"      ❌ Failed to finish {transfer.record_name}: {e}")
+            finally:
+                with self._idle:
+                    self._outstanding -= 1
+                    self._idle.notify_all()
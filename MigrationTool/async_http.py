@@ -0,0 +1,225 @@
+"""
+Keep-alive HTTP/1.1 connection pool for asyncio
+
+The asyncio counterpart of http_pool.ConnectionPool, built on
+asyncio.open_connection so thousands of requests can be in flight on one
+thread: each one is a coroutine waiting on a socket rather than a thread
+blocked in http.client. Idle connections are kept per host, open connections
+per host are capped, and HTTP error statuses raise urllib.error.HTTPError so
+rate_limit.classify() and the callers' error handling work unchanged.
+
+Like http_pool's socket timeout, `timeout` bounds each connect, write and
+read rather than the whole request, so a large download that keeps making
+progress is never cut off.
+
+A pool belongs to the event loop it is first used on.
+"""
+
+import asyncio
+import email.parser
+import http.client
+import io
+import ssl
+import urllib.error
+import urllib.parse
+from typing import Dict, List, Optional, Tuple
+
+from http_pool import MAX_REDIRECTS, REDIRECT_CODES, PoolStats
+
+MAX_LINE = 65536
+READ_SIZE = 65536
+
+_HostKey = Tuple[str, str, int]
+
+
+class _Connection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, timeout: float):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+
+    async def readline(self) -> bytes:
+        line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        if len(line) > MAX_LINE:
+            raise http.client.LineTooLong("header line")
+        return line
+
+    async def readexactly(self, size: int) -> bytes:
+        # Piecewise, so the timeout applies per read and not to the whole body
+        chunks = []
+        while size:
+            chunk = await asyncio.wait_for(self.reader.readexactly(min(size, READ_SIZE)), self.timeout)
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    async def read_to_eof(self) -> bytes:
+        chunks = []
+        while True:
+            chunk = await asyncio.wait_for(self.reader.read(READ_SIZE), self.timeout)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+    async def send(self, data: bytes):
+        self.writer.write(data)
+        await asyncio.wait_for(self.writer.drain(), self.timeout)
+
+    def close(self):
+        self.writer.close()
+
+
+class Response:
+    """Status, headers and body of a finished request"""
+
+    def __init__(self, status: int, reason: str, headers, body: bytes):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+
+async def _read_response(conn: _Connection, method: str) -> Tuple[Response, bool]:
+    """Read one response; returns it and whether the connection may be reused"""
+    status_line = await conn.readline()
+    if not status_line:
+        raise http.client.RemoteDisconnected("Remote end closed connection without response")
+    try:
+        version, status, reason = (status_line.decode("iso-8859-1").rstrip("\r\n").split(" ", 2) + [""])[:3]
+        status = int(status)
+    except ValueError:
+        raise http.client.BadStatusLine(status_line.decode("iso-8859-1", "replace")) from None
+
+    header_lines = []
+    while True:
+        line = await conn.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        header_lines.append(line)
+    headers = email.parser.BytesParser(_class=http.client.HTTPMessage).parsebytes(b"".join(header_lines))
+
+    keep_alive = version == "HTTP/1.1" and headers.get("Connection", "").lower() != "close"
+    if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+        return Response(status, reason, headers, b""), keep_alive
+
+    if headers.get("Transfer-Encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int((await conn.readline()).split(b";", 1)[0], 16)
+            if size == 0:
+                # Trailers end with an empty line
+                while (await conn.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            chunks.append(await conn.readexactly(size))
+            await conn.readexactly(2)
+        body = b"".join(chunks)
+    elif headers.get("Content-Length") is not None:
+        body = await conn.readexactly(int(headers["Content-Length"]))
+    else:
+        # Delimited by the server closing the connection
+        body = await conn.read_to_eof()
+        keep_alive = False
+    return Response(status, reason, headers, body), keep_alive
+
+
+class AsyncConnectionPool:
+    """Pool of persistent HTTP(S) connections keyed by host, for use from one event loop"""
+
+    def __init__(self, max_per_host: int = 100, timeout: float = 30):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.stats = PoolStats()
+        self._ssl_context = ssl.create_default_context()
+        self._idle: Dict[_HostKey, List[_Connection]] = {}
+        self._slots: Dict[_HostKey, asyncio.Semaphore] = {}
+
+    def _host_key(self, parsed: urllib.parse.ParseResult) -> _HostKey:
+        default_port = 443 if parsed.scheme == "https" else 80
+        return (parsed.scheme, parsed.hostname or "", parsed.port or default_port)
+
+    def _slot(self, key: _HostKey) -> asyncio.Semaphore:
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = asyncio.Semaphore(self.max_per_host)
+        return slot
+
+    async def _connect(self, key: _HostKey) -> _Connection:
+        scheme, host, port = key
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(
+            host, port, ssl=self._ssl_context if scheme == "https" else None, limit=MAX_LINE), self.timeout)
+        return _Connection(reader, writer, self.timeout)
+
+    async def _exchange(self, key: _HostKey, request: bytes, method: str) -> Response:
+        idle = self._idle.get(key)
+        conn = idle.pop() if idle else None
+        reused = conn is not None
+        if conn is None:
+            conn = await self._connect(key)
+        try:
+            await conn.send(request)
+            response, keep_alive = await _read_response(conn, method)
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError,
+                asyncio.IncompleteReadError):
+            conn.close()
+            if not reused:
+                raise
+            # The idle connection had been dropped by the server; retry once on a fresh one
+            return await self._exchange(key, request, method)
+        except BaseException:
+            # Includes cancellation: a half-read connection can't be reused
+            conn.close()
+            raise
+        self.stats.record(reused)
+        if keep_alive:
+            self._idle.setdefault(key, []).append(conn)
+        else:
+            conn.close()
+        return response
+
+    async def _send(self, method: str, url: str, body: Optional[bytes], headers: Dict[str, str]) -> Response:
+        parsed = urllib.parse.urlparse(url)
+        key = self._host_key(parsed)
+        target = parsed.path or "/"
+        if parsed.query:
+            target += f"?{parsed.query}"
+        default_port = 443 if parsed.scheme == "https" else 80
+        host = parsed.hostname if key[2] == default_port else f"{parsed.hostname}:{key[2]}"
+
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {host}", "Accept-Encoding: identity"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        if body is not None or method in ("POST", "PUT"):
+            lines.append(f"Content-Length: {len(body or b'')}")
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode("iso-8859-1") + (body or b"")
+
+        async with self._slot(key):
+            return await self._exchange(key, request, method)
+
+    async def request(self, method: str, url: str, body: Optional[bytes] = None,
+                      headers: Optional[Dict[str, str]] = None) -> bytes:
+        """Send a request and return the full response body
+
+        Redirects are followed, and HTTP error statuses raise
+        urllib.error.HTTPError just like http_pool.ConnectionPool.request.
+        """
+        headers = dict(headers or {})
+        for _ in range(MAX_REDIRECTS + 1):
+            response = await self._send(method, url, body, headers)
+            location = response.headers.get("Location")
+            if response.status in REDIRECT_CODES and location:
+                url = urllib.parse.urljoin(url, location)
+                if response.status == 303:
+                    method, body = "GET", None
+                continue
+            if response.status >= 400:
+                raise urllib.error.HTTPError(url, response.status, response.reason,
+                                             response.headers, io.BytesIO(response.body))
+            return response.body
+        raise urllib.error.URLError(f"Too many redirects for {url}")
+
+    def close(self):
+        """Close every idle connection"""
+        for idle in self._idle.values():
+            for conn in idle:
+                conn.close()
+        self._idle.clear()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: serial versus --workers decoding of a Dashboard export
+
+Writes a synthetic export shaped like cloudkit-production.ckdb and measures
+the CPU side of import_to_firebase.py on it:
+
+- json.load, and json_stream.iter_records (the serial import's decoding),
+- json_stream.iter_raw_batches alone, the parent's share of --workers mode,
+- serial: iter_records + conversion in one process,
+- parallel: the parent slices batches, spawned workers decode and convert.
+
+The parallel path only pays off if the parent's slicing is clearly cheaper
+than the serial path's decoding plus conversion. Firestore writes and asset
+uploads are left out; they only widen the gap.
+
+Usage:
+python3 benchmarks/bench_json_stream.py --records 200000 --workers 4
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import json_stream  # noqa: E402
+from bench_converters import stub_asset, synthetic_records  # noqa: E402
+from record_schema import SchemaConverters  # noqa: E402
+
+_converters = None
+
+
+def convert_chunk(chunk: str) -> int:
+    """Worker task: decode and convert one batch, like import_to_firebase._import_chunk"""
+    global _converters
+    if _converters is None:
+        _converters = SchemaConverters.load()
+    records = json.loads(chunk)
+    for record in records:
+        _converters.convert(record, stub_asset)
+    return len(records)
+
+
+def run_serial(path: Path) -> int:
+    converters = SchemaConverters.load()
+    count = 0
+    for record in json_stream.iter_records(path):
+        converters.convert(record, stub_asset)
+        count += 1
+    return count
+
+
+def run_parallel(path: Path, workers: int, batch_size: int) -> int:
+    count = 0
+    pending = set()
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # Warm the pool up so process start-up isn't billed to the parse
+        list(pool.map(int, range(workers)))
+        for chunk in json_stream.iter_raw_batches(path, batch_size):
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                count += sum(future.result() for future in done)
+            pending.add(pool.submit(convert_chunk, chunk))
+        count += sum(future.result() for future in pending)
+    return count
+
+
+def measure(label: str, fn, records: int) -> float:
+    start = time.perf_counter()
+    count = fn()
+    seconds = time.perf_counter() - start
+    assert count in (records, None), f"{label}: {count} records, expected {records}"
+    print(f"{label:<24} {seconds:>8.2f} s {records / seconds:>12,.0f} records/s")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark serial and parallel export decoding")
+    parser.add_argument("--records", type=int, default=200000, help="Records in the synthetic export")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes of the parallel path")
+    parser.add_argument("--batch-size", type=int, default=500, help="Records per worker task (--chunk-size)")
+    args = parser.parse_args()
+
+    records = synthetic_records(SchemaConverters.load().schema, args.records)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "export.json"
+        with open(path, "w") as f:
+            json.dump({"records": records}, f)
+        del records
+        print(f"{path.stat().st_size / 1e6:.0f} MB, {args.records} records, {args.workers} workers, "
+              f"{os.cpu_count()} CPUs\n")
+        if (os.cpu_count() or 1) < 2:
+            print("⚠️ One CPU: the workers share it with the parent, so the parallel path can't win here\n")
+
+        def load():
+            with open(path) as f:
+                return len(json.load(f)["records"])
+
+        measure("json.load", load, args.records)
+        measure("iter_records", lambda: sum(1 for _ in json_stream.iter_records(path)), args.records)
+        scan = measure("iter_raw_batches", lambda: sum(
+            chunk.count('"recordName"') for chunk in json_stream.iter_raw_batches(path, args.batch_size)),
+            args.records)
+        serial = measure("serial decode+convert", lambda: run_serial(path), args.records)
+        parallel = measure("parallel decode+convert", lambda: run_parallel(path, args.workers, args.batch_size),
+                           args.records)
+        print(f"\nparallel speedup {serial / parallel:.2f}x (ceiling {serial / scan:.2f}x: the parent's slicing)")
+
+
+if __name__ == "__main__":
+    main()
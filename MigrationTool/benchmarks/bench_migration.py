@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark: migration throughput against local stand-ins
+
+Serves a synthetic catalog shaped like cloudkit-production.ckdb from a local
+CloudKit Web Services fake and runs cloudkit_to_firebase.py,
+migrate_assets.py and import_to_firebase.py against it, with in-process
+Firestore and Storage fakes (see fakes.py). Every combination of data size
+and latency is run and reported as records/s and assets/s.
+
+Each run happens in a fresh interpreter so the process-wide pools, limiters
+and metrics of one run don't carry over into the next. import_to_firebase.py
+reads a Dashboard-style export of the same catalog and runs with a single
+worker: spawned worker processes would import the real google-cloud clients
+instead of the fakes.
+
+Usage:
+python3 benchmarks/bench_migration.py --sizes 100,1000 --latency-ms 0,20 --throttle 0.05
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR))
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+from fakes import FakeCloudKitServer, generate_catalog, install_fake_google  # noqa: E402
+
+SCRIPTS = ("cloudkit_to_firebase", "migrate_assets", "import_to_firebase")
+
+
+def write_key(path: Path):
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    path.write_bytes(key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    ))
+
+
+def write_export(catalog: dict, export_dir: Path, server_url: str):
+    """One Dashboard export file per record type, asset URLs pointing at the fake server"""
+    export_dir.mkdir()
+    for record_type, records in catalog.items():
+        exported = []
+        for record in records:
+            fields = {}
+            for field_name, field in record["fields"].items():
+                if field["type"] == "ASSET":
+                    value = dict(field["value"], downloadURL=server_url + field["value"]["downloadURL"])
+                    field = {"type": "ASSET", "value": value}
+                fields[field_name] = field
+            exported.append(dict(record, fields=fields))
+        with open(export_dir / f"{record_type}.json", "w") as f:
+            json.dump({"records": exported}, f)
+
+
+def script_args(script: str, work_dir: Path, public_mode: str) -> list:
+    if script == "import_to_firebase":
+        return ["--data-dir", str(work_dir / "export"), "--service-account", str(work_dir / "sa.json"),
+                "--public-mode", public_mode]
+    return [
+        "--public-mode", public_mode,
+        "--key-id", "benchmark",
+        "--key-file", str(work_dir / "key.pem"),
+        "--service-account", str(work_dir / "sa.json"),
+        "--checkpoint", str(work_dir / f"{script}.checkpoint.sqlite"),
+    ]
+
+
+def run_child(script: str, server_url: str, latency: float, argv: list):
+    """Entry point of the benchmark subprocess: run one script against the fakes"""
+    backend = install_fake_google(latency)
+
+    import cloudkit_client
+    from metrics import metrics
+
+    cloudkit_client.CLOUDKIT_API_HOST = server_url
+    module = __import__(script)
+    sys.argv = [f"{script}.py", "--progress-interval", "0", *argv]
+
+    real_stdout = sys.stdout
+    sys.stdout = open("/dev/null", "w")
+    start = time.perf_counter()
+    try:
+        module.main()
+    finally:
+        seconds = time.perf_counter() - start
+        sys.stdout.close()
+        sys.stdout = real_stdout
+
+    records = sum(stats["records"] for stats in metrics.snapshot()["record_types"].values())
+    print(json.dumps({
+        "seconds": seconds,
+        "records": records,
+        "assets": sum(bucket.uploads for bucket in backend.buckets.values()),
+        "storage_calls": sum(bucket.calls for bucket in backend.buckets.values()),
+        "documents": backend.db.writes,
+    }))
+
+
+def run_script(script: str, server: FakeCloudKitServer, latency: float, work_dir: Path, public_mode: str) -> dict:
+    command = [
+        sys.executable, __file__, "--child", script,
+        "--server-url", server.url, "--storage-latency", str(latency),
+        "--", *script_args(script, work_dir, public_mode),
+    ]
+    result = subprocess.run(command, capture_output=True, text=True, cwd=work_dir)
+    if result.returncode != 0:
+        raise RuntimeError(f"{script} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the migration scripts against local fakes")
+    parser.add_argument("--sizes", default="100,1000", help="Comma-separated records per record type")
+    parser.add_argument("--latency-ms", default="0,20", help="Comma-separated per-call latencies of every fake service")
+    parser.add_argument("--asset-kb", type=int, default=64, help="Size of each synthetic asset")
+    parser.add_argument("--throttle", type=float, default=0.0, help="Fraction of CloudKit requests answered THROTTLED")
+    parser.add_argument("--public-mode", default="acl", help="--public-mode passed to every script")
+    parser.add_argument("--scripts", default=",".join(SCRIPTS), help="Comma-separated scripts to run")
+    parser.add_argument("--child", choices=SCRIPTS, help=argparse.SUPPRESS)
+    parser.add_argument("--server-url", help=argparse.SUPPRESS)
+    parser.add_argument("--storage-latency", type=float, default=0.0, help=argparse.SUPPRESS)
+    parser.add_argument("script_args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.server_url, args.storage_latency, args.script_args[1:])
+        return
+
+    from record_schema import SchemaConverters
+
+    schema = SchemaConverters.load().schema
+    sizes = [int(size) for size in args.sizes.split(",")]
+    latencies = [float(ms) / 1000 for ms in args.latency_ms.split(",")]
+    scripts = args.scripts.split(",")
+    asset_size = args.asset_kb * 1024
+
+    print(f"{'script':<22} {'records/type':>12} {'latency':>8} {'records':>8} {'assets':>7} "
+          f"{'seconds':>8} {'records/s':>10} {'assets/s':>9} {'storage calls':>13} {'throttled':>9}")
+    for size in sizes:
+        catalog = generate_catalog(schema, size, asset_size)
+        for latency in latencies:
+            with tempfile.TemporaryDirectory() as tmp, \
+                    FakeCloudKitServer(catalog, latency, args.throttle, asset_size=asset_size) as server:
+                work_dir = Path(tmp)
+                write_key(work_dir / "key.pem")
+                (work_dir / "sa.json").write_text(json.dumps({"type": "service_account", "project_id": "benchmark"}))
+                write_export(catalog, work_dir / "export", server.url)
+
+                for script in scripts:
+                    throttled = server.throttled
+                    result = run_script(script, server, latency, work_dir, args.public_mode)
+                    seconds = result["seconds"]
+                    print(f"{script:<22} {size:>12} {latency * 1000:>6.0f}ms {result['records']:>8} "
+                          f"{result['assets']:>7} {seconds:>8.2f} {result['records'] / seconds:>10,.0f} "
+                          f"{result['assets'] / seconds:>9,.0f} {result['storage_calls']:>13} "
+                          f"{server.throttled - throttled:>9}")
+
+
+if __name__ == "__main__":
+    main()
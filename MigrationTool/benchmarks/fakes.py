@@ -0,0 +1,443 @@
+"""
+Local stand-ins for CloudKit Web Services, Firestore and Cloud Storage
+
+FakeCloudKitServer is a real HTTP server on localhost that answers
+/records/query (with continuation markers, desiredKeys and the ___modTime
+filter) and /records/lookup, serves asset downloads, and can inject latency
+and THROTTLED responses. The Firestore and Storage fakes are in-process
+objects with the subset of the google-cloud API the scripts use; they are
+registered under the google.* module names by install_fake_google().
+
+generate_catalog() builds synthetic records for every record type of
+cloudkit-production.ckdb.
+"""
+
+import base64
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+import types
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+# Deterministic field values per wire type, shared with bench_converters.py;
+# generate_catalog() replaces ASSET values with ones the server can serve
+SAMPLE_VALUES = {
+    "STRING": lambda i: f"value-{i}",
+    "INT64": lambda i: i,
+    "DOUBLE": lambda i: i * 1.5,
+    "TIMESTAMP": lambda i: 1700000000000 + i,
+    "REFERENCE": lambda i: {"recordName": f"ref-{i}", "action": "NONE"},
+    "ASSET": lambda i: {"downloadURL": f"https://cvws.icloud-content.com/{i}", "fileChecksum": f"c{i}"},
+    "INT64_LIST": lambda i: [i, i + 1],
+}
+
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+
+def asset_bytes(record_name: str, field_name: str, size: int) -> bytes:
+    """Deterministic asset body that type-sniffs as PNG"""
+    seed = hashlib.sha256(f"{record_name}/{field_name}".encode()).digest()
+    body = PNG_MAGIC + seed * (size // len(seed) + 1)
+    return body[:max(size, len(PNG_MAGIC))]
+
+
+def generate_catalog(schema: Dict[str, Dict[str, str]], records_per_type: int,
+                     asset_size: int = 64 * 1024) -> Dict[str, List[dict]]:
+    """Synthetic CloudKit records for each record type of the schema"""
+    catalog = {}
+    for record_type, fields in schema.items():
+        records = []
+        for i in range(records_per_type):
+            record_name = f"{record_type}-{i:06d}"
+            record_fields = {}
+            for field_name, value_type in fields.items():
+                if value_type == "ASSET":
+                    checksum = hashlib.sha1(f"{record_name}/{field_name}".encode()).hexdigest()
+                    value = {"fileChecksum": checksum, "size": asset_size,
+                             "downloadURL": f"/assets/{record_name}/{field_name}"}
+                else:
+                    value = SAMPLE_VALUES.get(value_type, SAMPLE_VALUES["STRING"])(i)
+                record_fields[field_name] = {"type": value_type, "value": value}
+            records.append({
+                "recordName": record_name,
+                "recordType": record_type,
+                "recordChangeTag": f"tag-{i}",
+                "modified": {"timestamp": 1700000000000 + i},
+                "fields": record_fields,
+            })
+        catalog[record_type] = records
+    return catalog
+
+
+class _Server(ThreadingHTTPServer):
+    # A deep accept backlog, so hundreds of concurrent connects from the async client aren't dropped
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class FakeCloudKitServer:
+    """Local CloudKit Web Services stand-in serving a synthetic catalog
+
+    `latency` (seconds) is added to every API request and asset download;
+    `throttle_rate` is the fraction of API requests answered with a 503
+    THROTTLED error carrying `retry_after`.
+    """
+
+    def __init__(self, catalog: Dict[str, List[dict]], latency: float = 0.0, throttle_rate: float = 0.0,
+                 retry_after: float = 0.05, asset_size: int = 64 * 1024):
+        self.catalog = catalog
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.asset_size = asset_size
+        self._by_name = {record["recordName"]: record for records in catalog.values() for record in records}
+        self._random = random.Random(0)
+        self._lock = threading.Lock()
+        self.api_requests = 0
+        self.throttled = 0
+        self.asset_downloads = 0
+
+        self._server = _Server(("127.0.0.1", 0), self._handler_class())
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-cloudkit", daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "FakeCloudKitServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _public_record(self, record: dict, desired_keys: Optional[List[str]]) -> dict:
+        fields = {}
+        for field_name, field in record["fields"].items():
+            if desired_keys is not None and field_name not in desired_keys:
+                continue
+            if field["type"] == "ASSET":
+                value = dict(field["value"], downloadURL=self.url + field["value"]["downloadURL"])
+                field = {"type": "ASSET", "value": value}
+            fields[field_name] = field
+        return dict(record, fields=fields)
+
+    def query(self, request: dict) -> dict:
+        query = request.get("query", {})
+        records = self.catalog.get(query.get("recordType"), [])
+        for condition in query.get("filterBy", []):
+            if condition.get("fieldName") == "___modTime":
+                since = condition["fieldValue"]["value"]
+                records = [record for record in records if record["modified"]["timestamp"] > since]
+        offset = int(request.get("continuationMarker") or 0)
+        limit = request.get("resultsLimit", 200)
+        page = records[offset:offset + limit]
+        result = {"records": [self._public_record(record, request.get("desiredKeys")) for record in page]}
+        if offset + limit < len(records):
+            result["continuationMarker"] = str(offset + limit)
+        return result
+
+    def lookup(self, request: dict) -> dict:
+        results = []
+        for entry in request.get("records", []):
+            record = self._by_name.get(entry.get("recordName"))
+            if record is None:
+                results.append({"recordName": entry.get("recordName"), "serverErrorCode": "NOT_FOUND"})
+            else:
+                results.append(self._public_record(record, request.get("desiredKeys")))
+        return {"records": results}
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body leave in one segment, so delayed ACKs don't stall keep-alive requests
+            wbufsize = 64 * 1024
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str = "application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                time.sleep(fake.latency)
+                with fake._lock:
+                    fake.api_requests += 1
+                    throttle = fake._random.random() < fake.throttle_rate
+                    fake.throttled += throttle
+                if throttle:
+                    error = {"serverErrorCode": "THROTTLED", "reason": "injected", "retryAfter": fake.retry_after}
+                    self._send(503, json.dumps(error).encode())
+                elif self.path.endswith("/records/query"):
+                    self._send(200, json.dumps(fake.query(request)).encode())
+                elif self.path.endswith("/records/lookup"):
+                    self._send(200, json.dumps(fake.lookup(request)).encode())
+                else:
+                    self._send(404, b'{"serverErrorCode": "NOT_FOUND"}')
+
+            def do_GET(self):
+                parts = urllib.parse.urlparse(self.path).path.split("/")
+                if len(parts) != 4 or parts[1] != "assets":
+                    self._send(404, b"")
+                    return
+                time.sleep(fake.latency)
+                with fake._lock:
+                    fake.asset_downloads += 1
+                self._send(200, asset_bytes(parts[2], parts[3], fake.asset_size), "application/octet-stream")
+
+        return Handler
+
+
+class FakeBlob:
+    def __init__(self, bucket: "FakeBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def size(self) -> Optional[int]:
+        data = self.bucket.objects.get(self.name)
+        return len(data) if data is not None else None
+
+    @property
+    def md5_hash(self) -> Optional[str]:
+        data = self.bucket.objects.get(self.name)
+        return base64.b64encode(hashlib.md5(data).digest()).decode() if data is not None else None
+
+    crc32c = None
+
+    @property
+    def public_url(self) -> str:
+        return f"https://storage.example/{self.bucket.name}/{self.name}"
+
+    def upload_from_string(self, data: bytes, content_type: Optional[str] = None,
+                           predefined_acl: Optional[str] = None, **kwargs):
+        self.bucket.call()
+        self.bucket.store(self.name, data, predefined_acl == "publicRead")
+
+    def upload_from_file(self, file_obj, content_type: Optional[str] = None,
+                         predefined_acl: Optional[str] = None, **kwargs):
+        chunks = []
+        while True:
+            chunk = file_obj.read(256 * 1024)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            self.bucket.call()
+        self.bucket.store(self.name, b"".join(chunks), predefined_acl == "publicRead")
+
+    def make_public(self):
+        self.bucket.call()
+        with self.bucket.lock:
+            self.bucket.public_calls += 1
+            self.bucket.public.add(self.name)
+
+    def delete(self):
+        self.bucket.call()
+        with self.bucket.lock:
+            self.bucket.objects.pop(self.name, None)
+            self.bucket.public.discard(self.name)
+
+
+class FakeBucket:
+    """In-process Storage bucket; every API call sleeps for `latency` seconds"""
+
+    def __init__(self, name: str, latency: float = 0.0):
+        self.name = name
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.objects: Dict[str, bytes] = {}
+        # Objects with a public-read ACL
+        self.public = set()
+        self.calls = 0
+        self.uploads = 0
+        self.public_calls = 0
+
+    def call(self):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+
+    def store(self, name: str, data: bytes, public: bool = False):
+        with self.lock:
+            self.objects[name] = data
+            self.uploads += 1
+            if public:
+                self.public.add(name)
+
+    def blob(self, name: str, chunk_size: Optional[int] = None, **kwargs) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def list_blobs(self, prefix: str = "", page_size: int = 1000, **kwargs) -> List[FakeBlob]:
+        with self.lock:
+            names = sorted(name for name in self.objects if name.startswith(prefix))
+        for _ in range(0, len(names), page_size):
+            self.call()
+        return [FakeBlob(self, name) for name in names]
+
+    def copy_blob(self, blob: FakeBlob, destination_bucket: "FakeBucket", new_name: str) -> FakeBlob:
+        self.call()
+        with self.lock:
+            destination_bucket.objects[new_name] = self.objects[blob.name]
+        return FakeBlob(destination_bucket, new_name)
+
+
+class _FakeDocument:
+    def __init__(self, db: "FakeFirestore", path: str):
+        self.db = db
+        self.path = path
+
+    def update(self, data: dict):
+        self.db.call()
+        with self.db.lock:
+            self.db.documents.setdefault(self.path, {}).update(data)
+            self.db.writes += 1
+
+
+class _FakeSnapshot:
+    def __init__(self, path: str, data: Optional[dict]):
+        self.id = path.rsplit("/", 1)[1]
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self) -> Optional[dict]:
+        return dict(self._data) if self.exists else None
+
+
+class _FakeCollection:
+    def __init__(self, db: "FakeFirestore", name: str, fields: Optional[List[str]] = None):
+        self.db = db
+        self.name = name
+        self.fields = fields
+
+    def document(self, document_id: str) -> _FakeDocument:
+        return _FakeDocument(self.db, f"{self.name}/{document_id}")
+
+    def select(self, fields: List[str]) -> "_FakeCollection":
+        return _FakeCollection(self.db, self.name, list(fields))
+
+    def stream(self):
+        prefix = f"{self.name}/"
+        with self.db.lock:
+            documents = [(path, data) for path, data in self.db.documents.items() if path.startswith(prefix)]
+        for _ in range(0, len(documents) + 1, 300):
+            self.db.call()
+        for path, data in documents:
+            if self.fields is not None:
+                data = {field: data[field] for field in self.fields if field in data}
+            yield _FakeSnapshot(path, data)
+
+
+class _FakeBatch:
+    def __init__(self, db: "FakeFirestore"):
+        self.db = db
+        self.writes = []
+
+    def set(self, document: _FakeDocument, data: dict, merge: bool = False):
+        self.writes.append((document.path, data, merge))
+
+    def commit(self):
+        self.db.call()
+        with self.db.lock:
+            for path, data, merge in self.writes:
+                if merge:
+                    self.db.documents.setdefault(path, {}).update(data)
+                else:
+                    self.db.documents[path] = data
+            self.db.writes += len(self.writes)
+
+
+class FakeFirestore:
+    """In-process Firestore; every commit or update sleeps for `latency` seconds"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.documents: Dict[str, dict] = {}
+        self.calls = 0
+        self.writes = 0
+
+    def call(self):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+
+    def batch(self) -> _FakeBatch:
+        return _FakeBatch(self)
+
+    def get_all(self, documents: List[_FakeDocument]):
+        self.call()
+        with self.lock:
+            found = [(document.path, self.documents.get(document.path)) for document in documents]
+        for path, data in found:
+            yield _FakeSnapshot(path, data)
+
+    def collection(self, name: str) -> _FakeCollection:
+        return _FakeCollection(self, name)
+
+
+class FakeGoogle:
+    """The fake Firestore and Storage shared by every client the scripts create"""
+
+    def __init__(self, latency: float = 0.0):
+        self.db = FakeFirestore(latency)
+        self.buckets: Dict[str, FakeBucket] = {}
+        self.latency = latency
+
+    def bucket(self, name: str) -> FakeBucket:
+        if name not in self.buckets:
+            self.buckets[name] = FakeBucket(name, self.latency)
+        return self.buckets[name]
+
+
+def install_fake_google(latency: float = 0.0) -> FakeGoogle:
+    """Register google.cloud.firestore/storage and google.oauth2 fakes in sys.modules
+
+    Must run before the scripts are imported. Returns the shared backend so
+    the harness can inspect what was written.
+    """
+    backend = FakeGoogle(latency)
+
+    class Credentials:
+        project_id = "benchmark"
+
+        @classmethod
+        def from_service_account_file(cls, path: str) -> "Credentials":
+            return cls()
+
+    firestore = types.ModuleType("google.cloud.firestore")
+    firestore.Client = lambda **kwargs: backend.db
+    storage = types.ModuleType("google.cloud.storage")
+    storage.Client = lambda **kwargs: types.SimpleNamespace(bucket=backend.bucket)
+    service_account = types.ModuleType("google.oauth2.service_account")
+    service_account.Credentials = Credentials
+
+    google = types.ModuleType("google")
+    cloud = types.ModuleType("google.cloud")
+    oauth2 = types.ModuleType("google.oauth2")
+    google.cloud, google.oauth2 = cloud, oauth2
+    cloud.firestore, cloud.storage = firestore, storage
+    oauth2.service_account = service_account
+    sys.modules.update({
+        "google": google,
+        "google.cloud": cloud,
+        "google.cloud.firestore": firestore,
+        "google.cloud.storage": storage,
+        "google.oauth2": oauth2,
+        "google.oauth2.service_account": service_account,
+    })
+    return backend
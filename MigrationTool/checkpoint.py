@@ -0,0 +1,319 @@
+"""
+Local checkpoint store for resumable and incremental migration runs
+
+A small SQLite database records, per record type, the CloudKit
+continuationMarker from which a run can safely resume, plus every document
+and (recordName, field) asset that has been committed together with the
+record's change tag (___etag), modification time (___modTime) and the asset's
+fileChecksum. With --resume, the scripts restart from the saved marker and
+skip work whose etag has not changed.
+
+The documents and assets tables double as the sync manifest for
+--incremental runs, which keep them between runs and only transfer records
+that changed since the last successful sync of their record type.
+
+The content index (SHA-256 and CloudKit fileChecksum → public URL) describes
+what already exists in Storage, so it survives reset().
+"""
+
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS markers (
+    record_type TEXT PRIMARY KEY,
+    continuation_marker TEXT,
+    complete INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS documents (
+    collection TEXT NOT NULL,
+    record_name TEXT NOT NULL,
+    etag TEXT,
+    mod_time INTEGER,
+    PRIMARY KEY (collection, record_name)
+);
+CREATE TABLE IF NOT EXISTS assets (
+    record_name TEXT NOT NULL,
+    field_name TEXT NOT NULL,
+    etag TEXT,
+    mod_time INTEGER,
+    checksum TEXT,
+    public_url TEXT,
+    PRIMARY KEY (record_name, field_name)
+);
+CREATE TABLE IF NOT EXISTS syncs (
+    record_type TEXT PRIMARY KEY,
+    synced_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    public_url TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS checksums (
+    file_checksum TEXT PRIMARY KEY,
+    public_url TEXT NOT NULL
+);
+"""
+
+
+def record_version(record: dict) -> Tuple[Optional[str], Optional[int]]:
+    """Return the (___etag, ___modTime) of a CloudKit Web Services record
+
+    The web services API exposes these system fields as `recordChangeTag`
+    and `modified.timestamp`.
+    """
+    return record.get("recordChangeTag"), record.get("modified", {}).get("timestamp")
+
+
+def asset_checksum(record: dict, field_name: str) -> Optional[str]:
+    """Return CloudKit's fileChecksum for an asset field, if present"""
+    value = record.get("fields", {}).get(field_name, {}).get("value")
+    return value.get("fileChecksum") if isinstance(value, dict) else None
+
+
+def asset_size(record: dict, field_name: str) -> Optional[int]:
+    """Return CloudKit's size in bytes for an asset field, if present"""
+    value = record.get("fields", {}).get(field_name, {}).get("value")
+    size = value.get("size") if isinstance(value, dict) else None
+    return int(size) if size is not None else None
+
+
+def parse_since(value: str) -> int:
+    """Parse a --since value (ISO8601 or ms since epoch) into ms since epoch"""
+    if value.isdigit():
+        return int(value)
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+class CheckpointStore:
+    """Thread-safe SQLite journal of committed migration work"""
+
+    def __init__(self, path: str = ":memory:", read_only: bool = False):
+        self.path = path
+        self._lock = threading.Lock()
+        if read_only:
+            # For planning against a real checkpoint: any write raises
+            self._conn = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True,
+                                         check_same_thread=False)
+            return
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self._lock:
+            self._conn.execute(sql, params)
+            self._conn.commit()
+
+    def _fetchone(self, sql: str, params: tuple = ()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    def reset(self, keep_manifest: bool = False):
+        """Forget previous progress; used when a run starts without --resume
+
+        With keep_manifest, only the pagination state is cleared so an
+        incremental run can still compare records against the last sync.
+        """
+        with self._lock:
+            if keep_manifest:
+                self._conn.execute("DELETE FROM markers")
+            else:
+                self._conn.executescript(
+                    "DELETE FROM markers; DELETE FROM documents; DELETE FROM assets; DELETE FROM syncs;"
+                )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # Continuation markers
+
+    def marker(self, record_type: str) -> Optional[str]:
+        row = self._fetchone("SELECT continuation_marker FROM markers WHERE record_type = ?", (record_type,))
+        return row[0] if row else None
+
+    def save_marker(self, record_type: str, continuation_marker: Optional[str]):
+        self._execute(
+            "INSERT INTO markers (record_type, continuation_marker) VALUES (?, ?) "
+            "ON CONFLICT(record_type) DO UPDATE SET continuation_marker = excluded.continuation_marker",
+            (record_type, continuation_marker)
+        )
+
+    def is_complete(self, record_type: str) -> bool:
+        row = self._fetchone("SELECT complete FROM markers WHERE record_type = ?", (record_type,))
+        return bool(row and row[0])
+
+    def mark_complete(self, record_type: str):
+        self._execute(
+            "INSERT INTO markers (record_type, complete) VALUES (?, 1) "
+            "ON CONFLICT(record_type) DO UPDATE SET complete = 1",
+            (record_type,)
+        )
+
+    # Sync history
+
+    def last_sync(self, record_type: str) -> Optional[int]:
+        """Start time (ms since epoch) of the last run that fully synced this record type"""
+        row = self._fetchone("SELECT synced_at FROM syncs WHERE record_type = ?", (record_type,))
+        return row[0] if row else None
+
+    def save_sync(self, record_type: str, synced_at: int):
+        self._execute("INSERT OR REPLACE INTO syncs (record_type, synced_at) VALUES (?, ?)", (record_type, synced_at))
+
+    # Documents
+
+    def document_done(self, collection: str, record: dict) -> bool:
+        """True if this version of the record was already written"""
+        etag, _ = record_version(record)
+        row = self._fetchone(
+            "SELECT etag FROM documents WHERE collection = ? AND record_name = ?",
+            (collection, record.get("recordName", ""))
+        )
+        return row is not None and row[0] == etag
+
+    def mark_document(self, collection: str, record: dict):
+        etag, mod_time = record_version(record)
+        self._execute(
+            "INSERT OR REPLACE INTO documents (collection, record_name, etag, mod_time) VALUES (?, ?, ?, ?)",
+            (collection, record.get("recordName", ""), etag, mod_time)
+        )
+
+    # Assets
+
+    def migrated_asset(self, record: dict, field_name: str) -> Optional[str]:
+        """Return the public URL of an asset that was migrated and has not changed since
+
+        The asset's fileChecksum is compared when both sides have one, so a
+        record edit that leaves the file alone does not trigger a transfer.
+        Otherwise the record's etag decides.
+        """
+        etag, _ = record_version(record)
+        row = self._fetchone(
+            "SELECT etag, checksum, public_url FROM assets WHERE record_name = ? AND field_name = ?",
+            (record.get("recordName", ""), field_name)
+        )
+        if row is None:
+            return None
+        saved_etag, saved_checksum, public_url = row
+        checksum = asset_checksum(record, field_name)
+        unchanged = checksum == saved_checksum if checksum and saved_checksum else etag == saved_etag
+        return public_url if unchanged else None
+
+    def mark_asset(self, record: dict, field_name: str, public_url: str):
+        etag, mod_time = record_version(record)
+        self._execute(
+            "INSERT OR REPLACE INTO assets (record_name, field_name, etag, mod_time, checksum, public_url) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (record.get("recordName", ""), field_name, etag, mod_time, asset_checksum(record, field_name), public_url)
+        )
+
+    # Content index
+
+    def content_url(self, digest: str) -> Optional[str]:
+        """Public URL of the blob stored for these bytes, if any"""
+        row = self._fetchone("SELECT public_url FROM blobs WHERE sha256 = ?", (digest,))
+        return row[0] if row else None
+
+    def save_content(self, digest: str, size: int, public_url: str):
+        self._execute("INSERT OR REPLACE INTO blobs (sha256, size, public_url) VALUES (?, ?, ?)",
+                      (digest, size, public_url))
+
+    def checksum_url(self, file_checksum: Optional[str]) -> Optional[str]:
+        """Public URL of a content-addressed blob with this CloudKit fileChecksum"""
+        if not file_checksum:
+            return None
+        row = self._fetchone("SELECT public_url FROM checksums WHERE file_checksum = ?", (file_checksum,))
+        return row[0] if row else None
+
+    def save_checksum(self, file_checksum: Optional[str], public_url: str):
+        if file_checksum:
+            self._execute("INSERT OR REPLACE INTO checksums (file_checksum, public_url) VALUES (?, ?)",
+                          (file_checksum, public_url))
+
+
+class _Page:
+    def __init__(self, next_marker: Optional[str]):
+        self.next_marker = next_marker
+        self.outstanding = 0
+        self.ended = False
+        self.failed = False
+
+
+class PageCheckpointer:
+    """Advances a record type's saved marker once earlier pages are fully committed
+
+    Writes and transfers finish out of order across pages, so the marker for
+    page N+1 is only saved after every item of pages 0..N has been committed.
+    A failed item pins the marker so that a resumed run retries it.
+    """
+
+    def __init__(self, store: CheckpointStore, record_type: str):
+        self.store = store
+        self.record_type = record_type
+        self._lock = threading.Lock()
+        self._pages: "OrderedDict[int, _Page]" = OrderedDict()
+        self._next_seq = 0
+        self._blocked = False
+
+    def begin_page(self, next_marker: Optional[str]) -> int:
+        """Start tracking a page; `next_marker` is the marker that resumes after it"""
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._pages[seq] = _Page(next_marker)
+            return seq
+
+    def track(self, seq: int) -> Callable[[bool], None]:
+        """Register one pending item of the page and return its completion callback"""
+        with self._lock:
+            self._pages[seq].outstanding += 1
+        return lambda ok: self._item_done(seq, ok)
+
+    def end_page(self, seq: int):
+        """No more items will be tracked for this page"""
+        with self._lock:
+            self._pages[seq].ended = True
+        self._advance()
+
+    @property
+    def finished(self) -> bool:
+        """True once every tracked page is committed without failures"""
+        with self._lock:
+            return not self._pages and not self._blocked
+
+    def _item_done(self, seq: int, ok: bool):
+        with self._lock:
+            page = self._pages[seq]
+            page.outstanding -= 1
+            if not ok:
+                page.failed = True
+        self._advance()
+
+    def _advance(self):
+        with self._lock:
+            marker = None
+            advanced = False
+            while self._pages and not self._blocked:
+                seq, page = next(iter(self._pages.items()))
+                if page.failed:
+                    self._blocked = True
+                    break
+                if not page.ended or page.outstanding:
+                    break
+                del self._pages[seq]
+                marker, advanced = page.next_marker, True
+            # Saved under the lock so markers can never be written out of order
+            if advanced:
+                self.store.save_marker(self.record_type, marker)
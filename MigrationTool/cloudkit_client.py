@@ -0,0 +1,453 @@
+"""
+CloudKit Web Services API client shared by the migration scripts
+
+Uses server-to-server authentication: every request is signed with the
+container's EC private key (see the setup notes in cloudkit_to_firebase.py).
+
+CloudKitClient is the blocking client the migration scripts use from their
+thread pools. AsyncCloudKitClient speaks the same protocol from coroutines
+on one event loop (async_http), so thousands of queries, lookups and asset
+downloads can be in flight without a thread each; its `*_sync` wrappers run
+a coroutine on a shared background loop for scripts that are not async
+themselves, from any thread.
+
+Both clients share their configuration, signing, limiter registry,
+request encoding, response handling and pagination state (_ClientBase,
+_api_call, _PageCursor); only the I/O differs.
+"""
+
+import asyncio
+import json
+import threading
+import urllib.error
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional, List, Iterator, Tuple, Dict, AsyncIterator
+
+from async_http import AsyncConnectionPool
+from http_pool import ConnectionPool, shared_pool
+from metrics import metrics
+from rate_limit import THROTTLE_STATUSES, AsyncRateLimiter, RateLimiter, Throttled
+from request_signing import RequestSigner, load_private_key
+
+CLOUDKIT_API_VERSION = "1"
+
+# Overridable so the benchmarks can point the client at a local stand-in
+CLOUDKIT_API_HOST = "https://api.apple-cloudkit.com"
+
+# Maximum page size accepted by /records/query
+QUERY_RESULTS_LIMIT = 200
+
+# Maximum number of records per /records/lookup request
+LOOKUP_BATCH_LIMIT = 200
+
+# Request rate ceiling per endpoint; the AIMD window adapts below it
+CLOUDKIT_REQUESTS_PER_SECOND = 40
+
+# serverErrorCode values that mean "slow down and retry"
+THROTTLE_ERROR_CODES = ("THROTTLED", "TRY_AGAIN_LATER", "ZONE_BUSY")
+
+
+def _server_error(error_body: str) -> Tuple[Optional[str], Optional[float]]:
+    """Return the (serverErrorCode, retryAfter) of a CloudKit error response"""
+    try:
+        error = json.loads(error_body)
+    except ValueError:
+        return None, None
+    if not isinstance(error, dict):
+        return None, None
+    return error.get("serverErrorCode"), error.get("retryAfter")
+
+
+def _raise_api_error(e: urllib.error.HTTPError):
+    """Re-raise a CloudKit HTTP error, as Throttled if it asks us to slow down"""
+    error_body = e.read().decode('utf-8')
+    server_error_code, retry_after = _server_error(error_body)
+    if e.code in THROTTLE_STATUSES or server_error_code in THROTTLE_ERROR_CODES:
+        raise Throttled(f"CloudKit {e.code} {server_error_code}", retry_after) from e
+    print(f"   ❌ CloudKit API Error: {e.code}")
+    print(f"      {error_body}")
+    raise e
+
+
+def _query_body(record_type: str, continuation_marker: Optional[str], modified_since: Optional[int],
+                desired_keys: Optional[List[str]], results_limit: int = QUERY_RESULTS_LIMIT) -> dict:
+    data = {
+        "query": {
+            "recordType": record_type
+        },
+        "resultsLimit": results_limit
+    }
+
+    if modified_since is not None:
+        data["query"]["filterBy"] = [{
+            "fieldName": "___modTime",
+            "comparator": "GREATER_THAN",
+            "fieldValue": {"value": modified_since, "type": "TIMESTAMP"}
+        }]
+
+    if desired_keys is not None:
+        data["desiredKeys"] = desired_keys
+
+    if continuation_marker:
+        data["continuationMarker"] = continuation_marker
+    return data
+
+
+def _lookup_bodies(record_names: List[str], desired_keys: Optional[List[str]]) -> Iterator[dict]:
+    for start in range(0, len(record_names), LOOKUP_BATCH_LIMIT):
+        data = {
+            "records": [{"recordName": name} for name in record_names[start:start + LOOKUP_BATCH_LIMIT]]
+        }
+        if desired_keys is not None:
+            data["desiredKeys"] = desired_keys
+        yield data
+
+
+def _encode(endpoint: str, base_url: str, data: dict) -> Tuple[str, str, bytes, str]:
+    """(url, signed path, body, metrics stage) of a request"""
+    url = f"{base_url}{endpoint}"
+    # Serialized once: the signature covers exactly the bytes that are sent
+    body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    return url, urllib.parse.urlparse(url).path, body, f"cloudkit_{endpoint.rsplit('/', 1)[-1]}"
+
+
+@contextmanager
+def _api_call(stage: str):
+    """Time one CloudKit request under `stage`; HTTP errors are raised via _raise_api_error"""
+    try:
+        with metrics.timer(stage) as call:
+            yield call
+    except urllib.error.HTTPError as e:
+        _raise_api_error(e)
+
+
+def _decode(response: bytes) -> dict:
+    return json.loads(response.decode('utf-8'))
+
+
+class _PageCursor:
+    """Pagination state of one query, shared by both clients' iter_pages"""
+
+    def __init__(self, record_type: str, continuation_marker: Optional[str], modified_since: Optional[int],
+                 desired_keys: Optional[List[str]], results_limit: int):
+        self.record_type = record_type
+        self.marker = continuation_marker
+        self.modified_since = modified_since
+        self.desired_keys = desired_keys
+        self.results_limit = results_limit
+
+    def query_args(self) -> tuple:
+        """Positional arguments of query_records for the page at the cursor"""
+        return self.record_type, self.marker, self.modified_since, self.desired_keys, self.results_limit
+
+    def fall_back(self, e: urllib.error.HTTPError) -> bool:
+        """True, with the filter dropped, if CloudKit rejected the ___modTime filter"""
+        if self.modified_since is None or e.code != 400:
+            return False
+        print(f"   ⚠️ {self.record_type}: ___modTime filter rejected, falling back to a full scan")
+        self.modified_since = None
+        return True
+
+    def advance(self, result: dict) -> List[dict]:
+        """Move past a fetched page and return its records; `marker` is then None on the last page"""
+        self.marker = result.get("continuationMarker")
+        return result.get("records", [])
+
+
+class _ClientBase:
+    """Configuration, signing and per-endpoint rate limiters of a CloudKit client"""
+
+    limiter_class = RateLimiter
+
+    def __init__(self, container: str, key_id: str, key_file: str, environment: str, max_concurrency: int):
+        self.container = container
+        self.key_id = key_id
+        self.environment = environment
+        self.max_concurrency = max_concurrency
+        self.base_url = f"{CLOUDKIT_API_HOST}/database/{CLOUDKIT_API_VERSION}/{container}/{environment}/public"
+
+        # Parsed once per key file and shared by every client in the process
+        self.private_key = load_private_key(key_file)
+        self.signer = RequestSigner(key_id, self.private_key)
+
+        # One rate limiter per endpoint (/records/query, /records/lookup, ...)
+        self.limiters: Dict[str, RateLimiter] = {}
+        self._limiters_lock = threading.Lock()
+
+    def _limiter(self, endpoint: str) -> RateLimiter:
+        with self._limiters_lock:
+            limiter = self.limiters.get(endpoint)
+            if limiter is None:
+                limiter = self.limiter_class(f"cloudkit{endpoint}", rate=CLOUDKIT_REQUESTS_PER_SECOND,
+                                             max_concurrency=self.max_concurrency)
+                self.limiters[endpoint] = limiter
+            return limiter
+
+    def _headers(self, path: str, body: bytes) -> Dict[str, str]:
+        # Signed per attempt so a retried request carries a current date
+        return self.signer.headers(path, body)
+
+
+class CloudKitClient(_ClientBase):
+    """CloudKit Web Services API client with server-to-server auth"""
+
+    def __init__(self, container: str, key_id: str, key_file: str, environment: str = "production",
+                 pool: ConnectionPool = shared_pool, max_concurrency: int = 16):
+        super().__init__(container, key_id, key_file, environment, max_concurrency)
+        self.pool = pool
+
+    def _make_request(self, endpoint: str, data: dict) -> dict:
+        """Make authenticated request to CloudKit API, retrying when throttled"""
+        url, path, body, stage = _encode(endpoint, self.base_url, data)
+        return self._limiter(endpoint).call(self._post, url, path, body, stage)
+
+    def _post(self, url: str, path: str, body: bytes, stage: str) -> dict:
+        with _api_call(stage) as call:
+            response = self.pool.request('POST', url, body=body, headers=self._headers(path, body))
+            call.bytes = len(response)
+        return _decode(response)
+
+    def query_records(self, record_type: str, continuation_marker: Optional[str] = None,
+                      modified_since: Optional[int] = None, desired_keys: Optional[List[str]] = None,
+                      results_limit: int = QUERY_RESULTS_LIMIT) -> dict:
+        """Query one page of records of a given type
+
+        `modified_since` (ms since epoch) limits the query to records whose
+        ___modTime is later; the field must be marked QUERYABLE in the schema.
+        `desired_keys` limits the returned fields (system fields such as
+        recordChangeTag and modified are always included). `results_limit` is
+        the page size, at most QUERY_RESULTS_LIMIT.
+        """
+        return self._make_request("/records/query", _query_body(record_type, continuation_marker, modified_since,
+                                                                desired_keys, results_limit))
+
+    def lookup_records(self, record_names: List[str], desired_keys: Optional[List[str]] = None) -> List[dict]:
+        """Fetch records by name, LOOKUP_BATCH_LIMIT names per request
+
+        Results come back in the order of `record_names`. A name that could
+        not be fetched yields an entry with a `serverErrorCode` (e.g.
+        NOT_FOUND) instead of fields.
+        """
+        records = []
+        for data in _lookup_bodies(record_names, desired_keys):
+            records.extend(self._make_request("/records/lookup", data).get("records", []))
+        return records
+
+    def iter_pages(self, record_type: str, continuation_marker: Optional[str] = None,
+                   modified_since: Optional[int] = None,
+                   desired_keys: Optional[List[str]] = None,
+                   results_limit: int = QUERY_RESULTS_LIMIT) -> Iterator[Tuple[List[dict], Optional[str]]]:
+        """Yield (records, next_marker) for each page as it arrives
+
+        The next continuationMarker page is fetched in the background while
+        the caller works through the current one, so processing overlaps with
+        network latency and only about two pages are held in memory. Passing
+        a saved marker resumes the query from that page.
+
+        If CloudKit rejects the `modified_since` filter (___modTime is not
+        QUERYABLE), the query falls back to a full scan. `desired_keys`
+        projects every page onto those fields, and `results_limit` sets the
+        page size.
+        """
+        cursor = _PageCursor(record_type, continuation_marker, modified_since, desired_keys, results_limit)
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"prefetch-{record_type}") as prefetch:
+            pending = prefetch.submit(self.query_records, *cursor.query_args())
+            try:
+                while pending is not None:
+                    try:
+                        result = pending.result()
+                    except urllib.error.HTTPError as e:
+                        if not cursor.fall_back(e):
+                            raise
+                        result = self.query_records(*cursor.query_args())
+                    records = cursor.advance(result)
+                    pending = prefetch.submit(self.query_records, *cursor.query_args()) if cursor.marker else None
+
+                    yield records, cursor.marker
+            finally:
+                # Abandoned iteration: don't leave a queued page fetch behind
+                if pending is not None:
+                    pending.cancel()
+
+    def probe_count(self, record_type: str, max_pages: int = 5,
+                    modified_since: Optional[int] = None) -> Tuple[int, bool]:
+        """Count a record type's records without fetching fields, reading at most `max_pages` pages
+
+        Returns (count, complete); an incomplete count is a lower bound.
+        CloudKit has no count query, so this is only meant for ranking.
+        """
+        count = 0
+        for pages, (records, next_marker) in enumerate(
+                self.iter_pages(record_type, modified_since=modified_since, desired_keys=[]), 1):
+            count += len(records)
+            if next_marker and pages >= max_pages:
+                return count, False
+        return count, True
+
+    def iter_records(self, record_type: str, desired_keys: Optional[List[str]] = None) -> Iterator[dict]:
+        """Yield records of a type page by page as they arrive"""
+        for records, _ in self.iter_pages(record_type, desired_keys=desired_keys):
+            yield from records
+
+    def fetch_all_records(self, record_type: str, desired_keys: Optional[List[str]] = None) -> List[dict]:
+        """Fetch all records of a type, handling pagination"""
+        return list(self.iter_records(record_type, desired_keys))
+
+
+class AsyncCloudKitClient(_ClientBase):
+    """CloudKit Web Services API client for asyncio, with server-to-server auth
+
+    Signing, request bodies, throttling and metrics match CloudKitClient; the
+    requests go through an AsyncConnectionPool and AsyncRateLimiters, so a
+    client belongs to the event loop it is first used on. Use it as an async
+    context manager, or call close(), to drop its idle connections.
+    """
+
+    limiter_class = AsyncRateLimiter
+
+    def __init__(self, container: str, key_id: str, key_file: str, environment: str = "production",
+                 max_per_host: int = 100, max_concurrency: int = 64):
+        super().__init__(container, key_id, key_file, environment, max_concurrency)
+        self.pool = AsyncConnectionPool(max_per_host)
+
+    async def __aenter__(self) -> "AsyncCloudKitClient":
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+
+    async def _make_request(self, endpoint: str, data: dict) -> dict:
+        """Make authenticated request to CloudKit API, retrying when throttled"""
+        url, path, body, stage = _encode(endpoint, self.base_url, data)
+        return await self._limiter(endpoint).call(self._post, url, path, body, stage)
+
+    async def _post(self, url: str, path: str, body: bytes, stage: str) -> dict:
+        with _api_call(stage) as call:
+            response = await self.pool.request('POST', url, body=body, headers=self._headers(path, body))
+            call.bytes = len(response)
+        return _decode(response)
+
+    async def query_records(self, record_type: str, continuation_marker: Optional[str] = None,
+                            modified_since: Optional[int] = None, desired_keys: Optional[List[str]] = None,
+                            results_limit: int = QUERY_RESULTS_LIMIT) -> dict:
+        """Query one page of records of a given type; see CloudKitClient.query_records"""
+        return await self._make_request("/records/query", _query_body(
+            record_type, continuation_marker, modified_since, desired_keys, results_limit))
+
+    async def lookup_records(self, record_names: List[str], desired_keys: Optional[List[str]] = None) -> List[dict]:
+        """Fetch records by name in the order given; the LOOKUP_BATCH_LIMIT batches are sent concurrently"""
+        results = await asyncio.gather(*(
+            self._make_request("/records/lookup", data) for data in _lookup_bodies(record_names, desired_keys)
+        ))
+        return [record for result in results for record in result.get("records", [])]
+
+    async def iter_pages(self, record_type: str, continuation_marker: Optional[str] = None,
+                         modified_since: Optional[int] = None,
+                         desired_keys: Optional[List[str]] = None,
+                         results_limit: int = QUERY_RESULTS_LIMIT) -> AsyncIterator[Tuple[List[dict], Optional[str]]]:
+        """Yield (records, next_marker) for each page, fetching the next page while the caller works
+
+        Falls back to a full scan if CloudKit rejects the `modified_since`
+        filter, like CloudKitClient.iter_pages.
+        """
+        cursor = _PageCursor(record_type, continuation_marker, modified_since, desired_keys, results_limit)
+        pending = asyncio.ensure_future(self.query_records(*cursor.query_args()))
+        try:
+            while pending is not None:
+                try:
+                    result = await pending
+                except urllib.error.HTTPError as e:
+                    if not cursor.fall_back(e):
+                        raise
+                    result = await self.query_records(*cursor.query_args())
+                records = cursor.advance(result)
+                pending = asyncio.ensure_future(self.query_records(*cursor.query_args())) if cursor.marker else None
+
+                yield records, cursor.marker
+        finally:
+            # Abandoned iteration: don't leave a page fetch running
+            if pending is not None:
+                pending.cancel()
+
+    async def iter_records(self, record_type: str, desired_keys: Optional[List[str]] = None) -> AsyncIterator[dict]:
+        """Yield records of a type page by page as they arrive"""
+        async for records, _ in self.iter_pages(record_type, desired_keys=desired_keys):
+            for record in records:
+                yield record
+
+    async def fetch_all_records(self, record_type: str, desired_keys: Optional[List[str]] = None) -> List[dict]:
+        """Fetch all records of a type, handling pagination"""
+        return [record async for record in self.iter_records(record_type, desired_keys)]
+
+    async def download_asset(self, url: str) -> bytes:
+        """Download an asset from its CloudKit downloadURL; the URL is pre-signed, so the request isn't"""
+        with metrics.timer("asset_download") as call:
+            data = await self.pool.request('GET', url, headers={'User-Agent': 'Mozilla/5.0'})
+            call.bytes = len(data)
+        return data
+
+    def query_records_sync(self, *args, **kwargs) -> dict:
+        return _run(self.query_records(*args, **kwargs))
+
+    def lookup_records_sync(self, *args, **kwargs) -> List[dict]:
+        return _run(self.lookup_records(*args, **kwargs))
+
+    def fetch_all_records_sync(self, *args, **kwargs) -> List[dict]:
+        return _run(self.fetch_all_records(*args, **kwargs))
+
+    def iter_records_sync(self, record_type: str, desired_keys: Optional[List[str]] = None) -> Iterator[dict]:
+        """Yield records of a type as their pages arrive; the next page is fetched meanwhile"""
+        pages = self.iter_pages(record_type, desired_keys=desired_keys)
+        try:
+            while True:
+                page = _run(_next_page(pages))
+                if page is None:
+                    return
+                yield from page[0]
+        finally:
+            # Cancels the prefetch of an abandoned iteration
+            _run(pages.aclose())
+
+    def download_asset_sync(self, url: str) -> bytes:
+        return _run(self.download_asset(url))
+
+
+# (records, next_marker) of one query page
+Page = Tuple[List[dict], Optional[str]]
+
+
+async def _next_page(pages: AsyncIterator[Page]) -> Optional[Page]:
+    """The next page of an iter_pages iterator, or None once it is exhausted"""
+    try:
+        return await pages.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+_sync_loop: Optional[asyncio.AbstractEventLoop] = None
+_sync_loop_lock = threading.Lock()
+
+
+def _run(coroutine):
+    """Run a coroutine on the process's sync-wrapper event loop and wait for its result
+
+    The loop runs forever in its own thread, so a client's connections and
+    limiters, which belong to the loop they were first used on, stay valid
+    between calls. Wrappers may be called from any number of threads at
+    once; their coroutines run concurrently on that loop. Calling one from a
+    coroutine works but blocks the caller's loop until it returns, so async
+    code should await the coroutine methods instead. A client is used either
+    through its sync wrappers or from one event loop of its own, not both.
+    """
+    global _sync_loop
+    with _sync_loop_lock:
+        if _sync_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="cloudkit-sync", daemon=True).start()
+            _sync_loop = loop
+    return asyncio.run_coroutine_threadsafe(coroutine, _sync_loop).result()
@@ -16,6 +16,18 @@ python3 cloudkit_to_firebase.py \
   --key-id YOUR_KEY_ID \
   --key-file /path/to/eckey.pem \
   --service-account /path/to/firebase-sa.json
+
+Progress is journaled to a local checkpoint file; after a crash, rerun the
+same command with --resume to skip the work that was already committed.
+During cutover, run with --incremental to only migrate records that changed
+since the last successful sync.
+
+Record types are independent, so up to --parallel-types of them migrate at
+once, largest first (as ranked by a short keys-only probe query).
+
+With --export-spool DIR, records are only fetched and written to a local
+spool (see spool.py) that import_to_firebase.py --spool can replay into
+Firestore any number of times; no Firebase credentials are needed.
 """
 
 import argparse
@@ -23,21 +35,27 @@ import json
 import os
 import sys
 import time
-import base64
-import hashlib
-import urllib.request
-import urllib.parse
-from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
 from pathlib import Path
-from typing import Optional, List, Dict, Any
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import ec
-from cryptography.hazmat.backends import default_backend
+from typing import Optional, List, Dict, Any, Callable, NamedTuple
+
+from asset_transfer import (
+    DEFAULT_CACHE_CONTROL, PUBLIC_MODES, ContentAddressedUploader, detect_extension, upload_policy
+)
+from checkpoint import CheckpointStore, PageCheckpointer, asset_checksum, parse_since
+from cloudkit_client import CloudKitClient
+from firestore_writer import BatchWriter, MAX_BATCH_WRITES
+from http_pool import shared_pool
+from metrics import metrics
+from rate_limit import storage_limiter
+from record_schema import COLLECTION_MAPPING, SchemaConverters
+from spool import DEFAULT_CHUNK_RECORDS, SpoolWriter
 
 # CloudKit configuration
 CLOUDKIT_CONTAINER = "iCloud.krishmittal.HouseRizz-iOS"
 CLOUDKIT_ENVIRONMENT = "production"
-CLOUDKIT_API_VERSION = "1"
 
 # Record types to migrate (from CloudKit schema)
 RECORD_TYPES = [
@@ -54,111 +72,16 @@ RECORD_TYPES = [
     "Items"  # Legacy - may have data
 ]
 
-# Collection name mapping (CloudKit → Firestore)
-COLLECTION_MAPPING = {
-    "Products": "products",
-    "Orders": "orders",
-    "ProductCategory": "productCategories",
-    "City": "cities",
-    "AddBanner": "addBanners",
-    "AIVibe": "aiVibes",
-    "DesignImageResult": "aiImageResults",
-    "API": "apis",
-    "Users": "users",
-    "SignedInUsers": "signedInUsers",
-    "Items": "items"
-}
-
-
-class CloudKitClient:
-    """CloudKit Web Services API client with server-to-server auth"""
-    
-    def __init__(self, container: str, key_id: str, key_file: str, environment: str = "production"):
-        self.container = container
-        self.key_id = key_id
-        self.environment = environment
-        self.base_url = f"https://api.apple-cloudkit.com/database/{CLOUDKIT_API_VERSION}/{container}/{environment}/public"
-        
-        # Load private key
-        with open(key_file, 'rb') as f:
-            self.private_key = serialization.load_pem_private_key(
-                f.read(),
-                password=None,
-                backend=default_backend()
-            )
-    
-    def _sign_request(self, date: str, body: str, path: str) -> str:
-        """Create ECDSA signature for request"""
-        body_hash = base64.b64encode(hashlib.sha256(body.encode('utf-8')).digest()).decode('utf-8')
-        message = f"{date}:{body_hash}:{path}"
-        
-        signature = self.private_key.sign(
-            message.encode('utf-8'),
-            ec.ECDSA(hashes.SHA256())
-        )
-        return base64.b64encode(signature).decode('utf-8')
-    
-    def _make_request(self, endpoint: str, data: dict) -> dict:
-        """Make authenticated request to CloudKit API"""
-        url = f"{self.base_url}{endpoint}"
-        path = urllib.parse.urlparse(url).path
-        body = json.dumps(data)
-        date = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
-        signature = self._sign_request(date, body, path)
-        
-        headers = {
-            'Content-Type': 'application/json',
-            'X-Apple-CloudKit-Request-KeyID': self.key_id,
-            'X-Apple-CloudKit-Request-ISO8601Date': date,
-            'X-Apple-CloudKit-Request-SignatureV1': signature,
-        }
-        
-        req = urllib.request.Request(url, data=body.encode('utf-8'), headers=headers, method='POST')
-        
-        try:
-            with urllib.request.urlopen(req) as response:
-                return json.loads(response.read().decode('utf-8'))
-        except urllib.error.HTTPError as e:
-            error_body = e.read().decode('utf-8')
-            print(f"   ❌ CloudKit API Error: {e.code}")
-            print(f"      {error_body}")
-            raise
-    
-    def query_records(self, record_type: str, continuation_marker: Optional[str] = None) -> dict:
-        """Query all records of a given type"""
-        data = {
-            "query": {
-                "recordType": record_type
-            },
-            "resultsLimit": 200
-        }
-        
-        if continuation_marker:
-            data["continuationMarker"] = continuation_marker
-        
-        return self._make_request("/records/query", data)
-    
-    def fetch_all_records(self, record_type: str) -> List[dict]:
-        """Fetch all records of a type, handling pagination"""
-        all_records = []
-        continuation_marker = None
-        
-        while True:
-            result = self.query_records(record_type, continuation_marker)
-            records = result.get("records", [])
-            all_records.extend(records)
-            
-            continuation_marker = result.get("continuationMarker")
-            if not continuation_marker:
-                break
-        
-        return all_records
+# Pages read per record type when ranking types by size
+PROBE_PAGES = 5
 
 
 class FirebaseClient:
     """Firebase Firestore and Storage client"""
     
-    def __init__(self, service_account_path: str, bucket_name: str):
+    def __init__(self, service_account_path: str, bucket_name: str, batch_size: int = MAX_BATCH_WRITES,
+                 store: Optional[CheckpointStore] = None, reuse_assets: bool = False,
+                 content_addressed: bool = False):
         from google.cloud import firestore
         from google.cloud import storage
         from google.oauth2 import service_account
@@ -167,111 +90,319 @@ class FirebaseClient:
         self.db = firestore.Client(credentials=credentials, project=credentials.project_id)
         storage_client = storage.Client(credentials=credentials, project=credentials.project_id)
         self.bucket = storage_client.bucket(bucket_name)
+        self.writer = BatchWriter(self.db, batch_size=batch_size)
+        self.converters = SchemaConverters.load()
+        
+        # Journal of migrated assets; with reuse_assets, unchanged files are not transferred again
+        self.store = store
+        self.reuse_assets = reuse_assets
+        
+        # Content-addressed mode stores each distinct file once (needs the store's content index)
+        self.content_uploader = None
+        if content_addressed and store:
+            self.content_uploader = ContentAddressedUploader(store, self._put_blob)
+    
+    def _put_blob(self, blob_path: str, data: bytes) -> str:
+        # Content type, cache-control and ACL go out with the upload itself
+        return upload_policy.upload(self.bucket.blob(blob_path), data)
     
     def upload_asset(self, url: str, record_name: str, field_name: str) -> str:
         """Download asset from CloudKit and upload to Firebase Storage"""
         try:
-            with urllib.request.urlopen(url) as response:
-                data = response.read()
-            
-            # Detect file extension
-            ext = "bin"
-            if len(data) >= 4:
-                if data[:3] == b'\xff\xd8\xff':
-                    ext = "jpg"
-                elif data[:4] == b'\x89PNG':
-                    ext = "png"
-                elif data[:4] == b'PK\x03\x04':
-                    ext = "usdz"
+            with metrics.timer("asset_download") as call:
+                data = shared_pool.request('GET', url)
+                call.bytes = len(data)
             
-            blob_path = f"migrated/{record_name}/{field_name}.{ext}"
-            blob = self.bucket.blob(blob_path)
-            blob.upload_from_string(data)
-            blob.make_public()
+            if self.content_uploader:
+                return self.content_uploader(record_name, field_name, data)
             
-            return blob.public_url
+            blob_path = f"migrated/{record_name}/{field_name}.{detect_extension(data)}"
+            return self._put_blob(blob_path, data)
         except Exception as e:
             print(f"      ⚠️ Failed to upload asset: {e}")
             return url
     
-    def import_record(self, record: dict, collection_name: str, dry_run: bool):
-        """Import a CloudKit record into Firestore"""
-        record_name = record.get("recordName", "")
-        fields = record.get("fields", {})
+    def _convert_asset(self, record: dict, field_name: str, value: dict, dry_run: bool) -> str:
+        """Return the Storage URL of an asset field, transferring it if needed"""
+        download_url = value.get("downloadURL", "")
+        migrated_url = None
+        if self.store and self.reuse_assets:
+            migrated_url = self.store.migrated_asset(record, field_name)
+        if self.content_uploader and not migrated_url:
+            # Same CloudKit fileChecksum as a stored blob: no download needed
+            migrated_url = self.store.checksum_url(asset_checksum(record, field_name))
         
-        doc_data = {"id": record_name}
+        if migrated_url:
+            return migrated_url
+        if not download_url or dry_run:
+            return download_url
         
-        for field_name, field_value in fields.items():
-            value_type = field_value.get("type", "")
-            value = field_value.get("value")
-            
-            if value_type == "STRING":
-                doc_data[field_name] = value
-            elif value_type == "INT64":
-                doc_data[field_name] = int(value)
-            elif value_type == "DOUBLE":
-                doc_data[field_name] = float(value)
-            elif value_type == "TIMESTAMP":
-                doc_data[field_name] = datetime.fromtimestamp(value / 1000)
-            elif value_type == "ASSET":
-                download_url = value.get("downloadURL", "")
-                if download_url and not dry_run:
-                    doc_data[field_name] = self.upload_asset(download_url, record_name, field_name)
-                else:
-                    doc_data[field_name] = download_url
-            elif value_type == "REFERENCE":
-                doc_data[field_name] = value.get("recordName", "")
-            else:
-                doc_data[field_name] = value
+        public_url = self.upload_asset(download_url, record.get("recordName", ""), field_name)
+        if self.store and public_url != download_url:
+            self.store.mark_asset(record, field_name, public_url)
+            if self.content_uploader:
+                self.store.save_checksum(asset_checksum(record, field_name), public_url)
+        return public_url
+    
+    def import_record(self, record: dict, collection_name: str, dry_run: bool,
+                      on_commit: Optional[Callable[[bool], None]] = None, writer: Optional[BatchWriter] = None):
+        """Import a CloudKit record into Firestore (through `writer`, by default the client's own)"""
+        record_name = record.get("recordName", "")
+        doc_data = self.converters.convert(record, partial(self._convert_asset, dry_run=dry_run))
         
         if dry_run:
             print(f"      [DRY RUN] Would create: {collection_name}/{record_name}")
         else:
-            self.db.collection(collection_name).document(record_name).set(doc_data)
-            print(f"      ✅ Created: {collection_name}/{record_name}")
+            # Committed in batches; failures are reported per batch by the writer
+            (writer or self.writer).set(collection_name, record_name, doc_data, on_commit)
+
+
+def document_committed(store: CheckpointStore, collection_name: str, record: dict,
+                       page_done: Callable[[bool], None], ok: bool):
+    """Journal a committed document and release its slot in the page checkpoint"""
+    if ok:
+        store.mark_document(collection_name, record)
+    page_done(ok)
+
+
+class TypeOutcome(NamedTuple):
+    """Result of migrating one record type"""
+    record_type: str
+    migrated: int
+    failed: int
+    skipped: int
+    complete: bool
+    seconds: float
+    error: Optional[str] = None
+
+
+def rank_record_types(ck: CloudKitClient, record_types: List[str], modified_since: Dict[str, Optional[int]]) -> List[str]:
+    """Order record types largest first, using a bounded keys-only probe of each"""
+    sizes = {}
+    for record_type in record_types:
+        try:
+            count, complete = ck.probe_count(record_type, PROBE_PAGES, modified_since.get(record_type))
+        except Exception as e:
+            print(f"   ⚠️ Probe of {record_type} failed ({e}); scheduling it first")
+            sizes[record_type] = float("inf")
+            continue
+        sizes[record_type] = count
+        print(f"   {record_type}: {count if complete else f'{count}+'} records")
+    # sorted() is stable, so equally sized types keep their RECORD_TYPES order
+    return sorted(record_types, key=lambda record_type: -sizes[record_type])
+
+
+def migrate_record_type(ck: CloudKitClient, fb: FirebaseClient, store: CheckpointStore, record_type: str,
+                        args, modified_since: Optional[int], skip_unchanged: bool, run_started: int) -> TypeOutcome:
+    """Migrate every record of one type; safe to run for several types at once"""
+    collection_name = COLLECTION_MAPPING.get(record_type, record_type.lower())
+    started = time.monotonic()
+    start_marker = store.marker(record_type) if args.resume else None
+    print(f"📋 [{record_type}] Migrating → {collection_name}..." + (" (resuming)" if start_marker else ""))
+    if modified_since:
+        print(f"   [{record_type}] Changes since {datetime.fromtimestamp(modified_since / 1000)}")
+    
+    checkpointer = PageCheckpointer(store, record_type)
+    migrated = 0
+    skipped = 0
+    scanned = False
+    error = None
+    # A writer per type, so each type's write failures are reported on their own
+    with BatchWriter(fb.db, batch_size=args.batch_size) as writer:
+        try:
+            # Records stream in page by page while the next page is prefetched
+            for records, next_marker in ck.iter_pages(record_type, start_marker, modified_since):
+                page = checkpointer.begin_page(next_marker)
+                for record in records:
+                    # Unchanged etag: already written by an earlier or interrupted run
+                    if skip_unchanged and store.document_done(collection_name, record):
+                        skipped += 1
+                        continue
+                    # Dry runs commit nothing, so there is nothing to wait for
+                    on_commit = None if args.dry_run else partial(
+                        document_committed, store, collection_name, record, checkpointer.track(page))
+                    fb.import_record(record, collection_name, args.dry_run, on_commit, writer)
+                    metrics.add_records(record_type)
+                    migrated += 1
+                checkpointer.end_page(page)
+            scanned = True
+        except Exception as e:
+            error = str(e)
+            print(f"   ❌ [{record_type}] Error after {migrated} records: {e}")
+        
+        # Commit whatever is still buffered for this record type
+        failed = writer.flush(wait=True)
+    
+    complete = scanned and checkpointer.finished
+    if complete and not args.dry_run:
+        store.mark_complete(record_type)
+        store.save_sync(record_type, run_started)
+    outcome = TypeOutcome(record_type, migrated, len(failed), skipped, complete, time.monotonic() - started, error)
+    print(f"   {'✅' if complete else '⚠️'} [{record_type}] Migrated {migrated - len(failed)}/{migrated} records "
+          f"({skipped} unchanged, {len(failed)} failed) in {outcome.seconds:.1f}s")
+    return outcome
+
+
+def export_record_type(ck: CloudKitClient, spool: SpoolWriter, record_type: str,
+                       modified_since: Optional[int]) -> TypeOutcome:
+    """Fetch every record of one type into the spool"""
+    started = time.monotonic()
+    writer = spool.writer(record_type)
+    print(f"📤 [{record_type}] Exporting...")
+    exported = 0
+    error = None
+    try:
+        for records, _ in ck.iter_pages(record_type, None, modified_since):
+            with metrics.timer("spool_write", items=len(records)):
+                for record in records:
+                    writer.write(record)
+            exported += len(records)
+            metrics.add_records(record_type, len(records))
+    except Exception as e:
+        error = str(e)
+        print(f"   ❌ [{record_type}] Error after {exported} records: {e}")
+    
+    spool.finish_type(record_type, error is None)
+    outcome = TypeOutcome(record_type, exported, 0, 0, error is None, time.monotonic() - started, error)
+    print(f"   {'✅' if outcome.complete else '⚠️'} [{record_type}] Exported {exported} records "
+          f"in {len(writer.chunks)} chunks in {outcome.seconds:.1f}s")
+    return outcome
+
+
+def export_spool(ck: CloudKitClient, args):
+    """--export-spool: fetch all record types into a local spool instead of Firestore"""
+    spool = SpoolWriter(args.export_spool, args.spool_chunk_records, container=CLOUDKIT_CONTAINER,
+                        environment=CLOUDKIT_ENVIRONMENT, modified_since=args.since)
+    print(f"📤 Exporting {len(RECORD_TYPES)} record types to {args.export_spool}, "
+          f"{args.parallel_types} at a time\n")
+    metrics.start_reporter(args.progress_interval)
+    with ThreadPoolExecutor(max(1, args.parallel_types), thread_name_prefix="record-type") as scheduler:
+        outcomes = list(scheduler.map(lambda record_type: export_record_type(ck, spool, record_type, args.since),
+                                      RECORD_TYPES))
+    spool.close()
+    metrics.stop_reporter()
+    
+    print("\n📊 Record types:")
+    for outcome in outcomes:
+        status = "complete" if outcome.complete else f"incomplete ({outcome.error})"
+        print(f"   {outcome.record_type}: {outcome.migrated} records, {outcome.seconds:.1f}s, {status}")
+    print(metrics.progress_line())
+    if args.metrics_out:
+        metrics.write_summary(args.metrics_out)
+    print(f"🔌 HTTP: {shared_pool.stats.summary()}")
+    print(f"🔏 Signing: {ck.signer.stats.summary()}")
+    for limiter in ck.limiters.values():
+        print(f"🚦 {limiter.summary()}")
+    print(f"🎉 Export complete: {sum(outcome.migrated for outcome in outcomes)} records in {args.export_spool}")
 
 
 def main():
     parser = argparse.ArgumentParser(description="Migrate CloudKit to Firebase")
     parser.add_argument("--key-id", required=True, help="CloudKit Server-to-Server Key ID")
     parser.add_argument("--key-file", required=True, help="Path to CloudKit private key (.pem)")
-    parser.add_argument("--service-account", required=True, help="Path to Firebase service account JSON")
+    parser.add_argument("--service-account", help="Path to Firebase service account JSON (not needed with --export-spool)")
     parser.add_argument("--bucket", default="houserizz-481012.appspot.com", help="Firebase Storage bucket")
     parser.add_argument("--dry-run", action="store_true", help="Preview without making changes")
+    parser.add_argument("--max-connections-per-host", type=int, default=10, help="Keep-alive connections kept per host")
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_WRITES, help="Firestore writes per batch commit")
+    parser.add_argument("--checkpoint", default="cloudkit_to_firebase.checkpoint.sqlite", help="Checkpoint database path")
+    parser.add_argument("--resume", action="store_true", help="Resume from the checkpoint, skipping committed work")
+    parser.add_argument("--incremental", action="store_true", help="Only migrate records changed since the last successful sync")
+    parser.add_argument("--since", type=parse_since, help="Only migrate records modified after this time (ISO8601 or ms)")
+    parser.add_argument("--content-addressed", action="store_true", help="Store blobs by content hash, uploading shared assets once")
+    parser.add_argument("--public-mode", choices=PUBLIC_MODES, default="acl",
+                        help="acl: public-read ACL set in the upload; bucket: bucket-level public access, no object ACL; "
+                             "make-public: separate make_public call per object")
+    parser.add_argument("--cache-control", default=DEFAULT_CACHE_CONTROL, help="Cache-Control of uploaded assets")
+    parser.add_argument("--parallel-types", type=int, default=4, help="Record types migrated concurrently")
+    parser.add_argument("--progress-interval", type=float, default=30, help="Seconds between progress lines (0 disables)")
+    parser.add_argument("--metrics-out", help="Write final metrics to this path (.prom for Prometheus text, else JSON)")
+    parser.add_argument("--export-spool", metavar="DIR", help="Only fetch records into a local spool for import_to_firebase.py --spool")
+    parser.add_argument("--spool-chunk-records", type=int, default=DEFAULT_CHUNK_RECORDS, help="Records per spool chunk file")
     args = parser.parse_args()
+    if not args.service_account and not args.export_spool:
+        parser.error("--service-account is required unless --export-spool is given")
     
     print("🚀 CloudKit to Firebase Migration")
     print("==================================")
     print(f"📦 Container: {CLOUDKIT_CONTAINER}")
     print(f"🔑 Key ID: {args.key_id}")
     print(f"🔄 Dry Run: {args.dry_run}")
+    print(f"💾 Checkpoint: {args.checkpoint} (resume: {args.resume}, incremental: {args.incremental})")
     print()
     
     # Initialize clients
+    shared_pool.max_per_host = args.max_connections_per_host
+    upload_policy.public_mode = args.public_mode
+    upload_policy.cache_control = args.cache_control
     print("🔧 Initializing CloudKit client...")
     ck = CloudKitClient(CLOUDKIT_CONTAINER, args.key_id, args.key_file, CLOUDKIT_ENVIRONMENT)
     
+    if args.export_spool:
+        export_spool(ck, args)
+        return
+    
+    # Dry runs never commit anything, so they journal to a throwaway database
+    store = CheckpointStore(":memory:" if args.dry_run else args.checkpoint)
+    if args.incremental and not args.resume:
+        store.reset(keep_manifest=True)
+    elif not args.resume:
+        store.reset()
+    skip_unchanged = args.resume or args.incremental
+    run_started = int(time.time() * 1000)
+    
     print("🔧 Initializing Firebase client...")
-    fb = FirebaseClient(args.service_account, args.bucket)
+    fb = FirebaseClient(args.service_account, args.bucket, args.batch_size, store=store, reuse_assets=skip_unchanged,
+                        content_addressed=args.content_addressed)
     
     print("✅ Clients initialized\n")
     
-    # Migrate each record type
+    # Resumed runs skip types finished earlier
+    record_types = []
     for record_type in RECORD_TYPES:
-        collection_name = COLLECTION_MAPPING.get(record_type, record_type.lower())
-        print(f"📋 Migrating {record_type} → {collection_name}...")
-        
-        try:
-            records = ck.fetch_all_records(record_type)
-            print(f"   Found {len(records)} records")
-            
-            for record in records:
-                fb.import_record(record, collection_name, args.dry_run)
-            
-            print(f"   ✅ Migrated {len(records)} records\n")
-        except Exception as e:
-            print(f"   ❌ Error: {e}\n")
+        if args.resume and store.is_complete(record_type):
+            print(f"⏭️ Skipping {record_type}: completed in a previous run")
+        else:
+            record_types.append(record_type)
+    modified_since = {
+        record_type: args.since or (store.last_sync(record_type) if args.incremental else None)
+        for record_type in record_types
+    }
+    
+    # Largest types start first so the run takes about as long as the biggest one
+    if args.parallel_types > 1 and len(record_types) > 1:
+        print("🔍 Probing record type sizes...")
+        record_types = rank_record_types(ck, record_types, modified_since)
+    print(f"\n⚙️ Migrating {len(record_types)} record types, {args.parallel_types} at a time\n")
+    metrics.start_reporter(args.progress_interval)
+    
+    with ThreadPoolExecutor(max(1, args.parallel_types), thread_name_prefix="record-type") as scheduler:
+        futures = [
+            scheduler.submit(migrate_record_type, ck, fb, store, record_type, args,
+                             modified_since[record_type], skip_unchanged, run_started)
+            for record_type in record_types
+        ]
+        outcomes = [future.result() for future in futures]
+    
+    print("\n📊 Record types:")
+    for outcome in outcomes:
+        status = "complete" if outcome.complete else f"incomplete ({outcome.error or 'failed writes'})"
+        print(f"   {outcome.record_type}: {outcome.migrated - outcome.failed}/{outcome.migrated} written, "
+              f"{outcome.skipped} unchanged, {outcome.seconds:.1f}s, {status}")
     
+    fb.writer.close()
+    store.close()
+    metrics.stop_reporter()
+    print(metrics.progress_line())
+    if args.metrics_out:
+        metrics.write_summary(args.metrics_out)
+    if fb.content_uploader:
+        print(f"♻️ Deduplicated {fb.content_uploader.deduplicated} assets "
+              f"({fb.content_uploader.deduplicated_bytes} bytes not uploaded)")
+    print(f"🔌 HTTP: {shared_pool.stats.summary()}")
+    print(f"🔏 Signing: {ck.signer.stats.summary()}")
+    for limiter in [*ck.limiters.values(), storage_limiter]:
+        print(f"🚦 {limiter.summary()}")
     print("🎉 Migration complete!")
 
 
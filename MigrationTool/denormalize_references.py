@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Reference denormalization pass
+
+The converters store a REFERENCE field as the bare recordName of its target,
+so the app needs one more Firestore read per reference to show, say, an
+order with its product. This pass resolves every reference once, after the
+records and assets have been migrated:
+
+1. Scan the spool (or Dashboard export) once: index recordName → collections
+   across all record types and collect every REFERENCE / REFERENCE_LIST field.
+2. Stream each referenced collection once, fetching only the denormalized
+   fields (--fields), and keep the referenced documents.
+3. Join in memory and write `<field>_ref` (a map, or a list of maps for
+   REFERENCE_LIST) holding the target's id, collection and denormalized
+   fields into each referencing document, with batched merge writes.
+
+References whose target record is missing from the input, or whose target
+document is missing from Firestore, are reported as dangling and skipped. A
+reference only carries a recordName, so a target found in several
+collections resolves to the first of them (in input order) whose document
+exists.
+
+Usage:
+python3 denormalize_references.py --spool ./spool --service-account ./service-account.json
+"""
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+from google.cloud import firestore
+from google.oauth2 import service_account
+
+import json_stream
+import spool
+from firestore_writer import BatchWriter, MAX_BATCH_WRITES
+from metrics import metrics
+from record_schema import COLLECTION_MAPPING
+
+# Fields copied from a referenced document by default; missing ones are skipped
+DEFAULT_FIELDS = "name,price,imageURL_thumb,imageURL1_thumb"
+
+# Dangling references printed per field; --report-out gets all of them
+REPORT_SAMPLES = 5
+
+
+class Reference(NamedTuple):
+    """A REFERENCE or REFERENCE_LIST field of one record"""
+    collection: str
+    record_name: str
+    field_name: str
+    targets: List[str]
+    is_list: bool
+
+
+def collection_for(record_type: str) -> str:
+    return COLLECTION_MAPPING.get(record_type, record_type.lower())
+
+
+def record_references(record: dict) -> Iterator[Reference]:
+    collection = collection_for(record.get("recordType", "Unknown"))
+    for field_name, field in record.get("fields", {}).items():
+        value_type = field.get("type")
+        value = field.get("value")
+        if value_type == "REFERENCE" and isinstance(value, dict):
+            yield Reference(collection, record["recordName"], field_name, [value.get("recordName", "")], False)
+        elif value_type == "REFERENCE_LIST" and isinstance(value, list):
+            targets = [item.get("recordName", "") for item in value if isinstance(item, dict)]
+            yield Reference(collection, record["recordName"], field_name, targets, True)
+
+
+class ReferenceIndex:
+    """recordName → collections holding it for every input record, plus every reference found"""
+
+    def __init__(self):
+        self.records = 0
+        self.collections: Dict[str, List[str]] = {}
+        self.references: List[Reference] = []
+
+    def add(self, record: dict):
+        record_name = record.get("recordName")
+        if not record_name:
+            return
+        self.records += 1
+        collections = self.collections.setdefault(record_name, [])
+        collection = collection_for(record.get("recordType", "Unknown"))
+        if collection not in collections:
+            collections.append(collection)
+        self.references.extend(record_references(record))
+
+    def targets_by_collection(self) -> Dict[str, Set[str]]:
+        """The referenced record names that exist in the input, grouped by collection"""
+        targets: Dict[str, Set[str]] = {}
+        for reference in self.references:
+            for target in reference.targets:
+                for collection in self.collections.get(target, ()):
+                    targets.setdefault(collection, set()).add(target)
+        return targets
+
+
+# (collection, document id) → denormalized fields
+Documents = Dict[Tuple[str, str], dict]
+
+
+def load_documents(db, collection: str, wanted: Set[str], fields: List[str]) -> Documents:
+    """One streamed scan of a collection, keeping the referenced documents' denormalized fields"""
+    documents = {}
+    with metrics.timer("firestore_scan") as call:
+        # A field mask keeps the scan to the denormalized fields (and the document ids)
+        for snapshot in db.collection(collection).select(fields).stream():
+            call.items += 1
+            if snapshot.id in wanted:
+                documents[(collection, snapshot.id)] = snapshot.to_dict() or {}
+    return documents
+
+
+def resolve(index: ReferenceIndex, documents: Documents, target: str) -> Tuple[Optional[str], str]:
+    """(collection, "") of a reference target's document, or (None, what is missing)"""
+    collections = index.collections.get(target)
+    if not collections:
+        return None, "record"
+    for collection in collections:
+        if (collection, target) in documents:
+            return collection, ""
+    return None, "document"
+
+
+def embedded(target: str, collection: str, document: dict, fields: List[str]) -> dict:
+    value = {"id": target, "collection": collection}
+    value.update((field, document[field]) for field in fields if field in document)
+    return value
+
+
+def input_records(args) -> Iterable[dict]:
+    if args.spool:
+        return spool.SpoolReader(args.spool).iter_records()
+    return (
+        record
+        for json_file in sorted(Path(args.data_dir).glob("*.json"))
+        for record in json_stream.iter_records(json_file)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed referenced documents into referencing ones")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--spool", help="Spool directory written by cloudkit_to_firebase.py --export-spool")
+    source.add_argument("--data-dir", help="Directory containing CloudKit exported JSON files")
+    parser.add_argument("--service-account", required=True, help="Path to GCP service account JSON")
+    parser.add_argument("--fields", default=DEFAULT_FIELDS, help="Comma-separated fields copied from referenced documents")
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_WRITES, help="Firestore writes per batch commit")
+    parser.add_argument("--dry-run", action="store_true", help="Resolve and report without writing")
+    parser.add_argument("--report-out", help="Write every dangling reference to this JSON file")
+    parser.add_argument("--metrics-out", help="Write final metrics to this path (.prom for Prometheus text, else JSON)")
+    args = parser.parse_args()
+    fields = [field for field in args.fields.split(",") if field]
+
+    print("🔗 Reference Denormalization")
+    print("=" * 30)
+    print(f"📋 Fields: {', '.join(fields) or '(ids only)'}")
+    print(f"🔄 Dry run: {args.dry_run}\n")
+
+    if not os.path.exists(args.service_account):
+        print(f"❌ Service account file not found: {args.service_account}")
+        sys.exit(1)
+
+    print("🔍 Indexing records...")
+    index = ReferenceIndex()
+    try:
+        for record in input_records(args):
+            index.add(record)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(f"   {index.records} records, {len(index.references)} reference fields\n")
+    if not index.references:
+        print("🎉 No references to resolve")
+        return
+
+    credentials = service_account.Credentials.from_service_account_file(args.service_account)
+    db = firestore.Client(credentials=credentials, project=credentials.project_id)
+    targets = index.targets_by_collection()
+    documents: Documents = {}
+    for collection, wanted in sorted(targets.items()):
+        print(f"📥 Loading {len(wanted)} referenced documents from {collection}...")
+        documents.update(load_documents(db, collection, wanted, fields))
+
+    # The join: every reference resolves against the in-memory documents
+    updates: Dict[tuple, dict] = {}
+    dangling: Dict[tuple, List[dict]] = {}
+    for reference in index.references:
+        resolved = []
+        for target in reference.targets:
+            collection, missing = resolve(index, documents, target)
+            if collection is None:
+                dangling.setdefault((reference.collection, reference.field_name), []).append(
+                    {"document": f"{reference.collection}/{reference.record_name}", "target": target,
+                     "missing": missing})
+                continue
+            resolved.append(embedded(target, collection, documents[(collection, target)], fields))
+        if reference.is_list:
+            value = resolved
+        elif resolved:
+            value = resolved[0]
+        else:
+            continue
+        updates.setdefault((reference.collection, reference.record_name), {})[f"{reference.field_name}_ref"] = value
+
+    print(f"\n🧩 {len(updates)} documents to update")
+    if not args.dry_run:
+        with BatchWriter(db, batch_size=args.batch_size) as writer:
+            for (collection, record_name), data in updates.items():
+                writer.set(collection, record_name, data, merge=True)
+            failed = writer.flush(wait=True)
+        print(f"   ✅ {len(updates) - len(failed)} written, {len(failed)} failed")
+
+    total_dangling = sum(len(entries) for entries in dangling.values())
+    print(f"\n🔗 Dangling references: {total_dangling}")
+    for (collection, field_name), entries in sorted(dangling.items()):
+        print(f"   ⚠️ {collection}.{field_name}: {len(entries)}")
+        for entry in entries[:REPORT_SAMPLES]:
+            print(f"      {entry['document']} → {entry['target']} (no such {entry['missing']})")
+    if args.report_out:
+        with open(args.report_out, "w") as f:
+            json.dump([entry for entries in dangling.values() for entry in entries], f, indent=2)
+        print(f"📝 Dangling references written to {args.report_out}")
+
+    print(metrics.progress_line())
+    if args.metrics_out:
+        metrics.write_summary(args.metrics_out)
+    print("🎉 Denormalization complete!")
+
+
+if __name__ == "__main__":
+    main()
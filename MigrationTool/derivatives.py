@@ -0,0 +1,105 @@
+"""
+Resized image derivatives generated while assets are migrated
+
+For every JPEG or PNG asset, smaller re-encoded copies (a thumbnail and a
+medium size) are rendered in a process pool, so decoding and resizing run on
+all cores beside the network transfers. They are uploaded next to the
+original and their URLs land in the same Firestore update as the original's,
+under `<field>_<name>` (e.g. `imageURL1_thumb`).
+
+Needs Pillow, which is optional: `available()` tells the scripts whether the
+stage can be enabled.
+"""
+
+import io
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from asset_transfer import detect_extension
+from metrics import metrics
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Derivative name -> longest edge in pixels; images are never upscaled
+DERIVATIVE_SIZES = {
+    "thumb": 256,
+    "medium": 1024,
+}
+
+JPEG_QUALITY = 80
+
+# (name -> (extension, bytes), seconds spent rendering)
+Rendered = Tuple[Dict[str, Tuple[str, bytes]], float]
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def render(data: bytes) -> Rendered:
+    """Decode an image once and encode each derivative; runs in a worker process"""
+    start = time.perf_counter()
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    # Transparency needs PNG; everything else is re-encoded as progressive JPEG
+    keep_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if keep_alpha else "RGB")
+
+    derivatives = {}
+    for name, edge in DERIVATIVE_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail((edge, edge), Image.LANCZOS)
+        out = io.BytesIO()
+        if keep_alpha:
+            resized.save(out, "PNG", optimize=True)
+            derivatives[name] = ("png", out.getvalue())
+        else:
+            resized.save(out, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+            derivatives[name] = ("jpg", out.getvalue())
+    return derivatives, time.perf_counter() - start
+
+
+class DerivativeRenderer:
+    """Renders derivatives of downloaded images on a process pool"""
+
+    def __init__(self, workers: Optional[int] = None):
+        # Spawned rather than forked: the parent runs transfer and reporter threads
+        self._pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        self._lock = threading.Lock()
+        self.rendered = 0
+        self.failed = 0
+
+    def submit(self, data: bytes) -> Optional[Future]:
+        """Start rendering the derivatives of an asset; None if it is not a JPEG or PNG"""
+        if detect_extension(data) not in ("jpg", "png"):
+            return None
+        return self._pool.submit(render, data)
+
+    def result(self, future: Future) -> Dict[str, Tuple[str, bytes]]:
+        """Wait for a submitted render; an undecodable image yields no derivatives"""
+        try:
+            derivatives, seconds = future.result()
+        except Exception as e:
+            self.record_failure()
+            print(f"      ⚠️ Could not render derivatives: {e}")
+            return {}
+        with self._lock:
+            self.rendered += 1
+        metrics.observe("image_resize", seconds, sum(len(body) for _, body in derivatives.values()),
+                        items=len(derivatives))
+        return derivatives
+
+    def record_failure(self):
+        """Count an asset whose derivatives could not be rendered; called from transfer threads"""
+        with self._lock:
+            self.failed += 1
+        metrics.observe("image_resize", 0.0, ok=False)
+
+    def close(self):
+        self._pool.shutdown()
@@ -0,0 +1,142 @@
+"""
+Batched Firestore writer
+
+Groups document writes into Firestore batch commits of up to 500 writes and
+keeps several commits in flight at once instead of paying one blocking round
+trip per document. A batch is flushed when it is full, when its oldest write
+has waited longer than the flush interval, and whenever the caller asks
+(typically at the end of each record type).
+"""
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import metrics
+
+# (collection, document_id, data, on_commit, merge)
+_Write = Tuple[str, str, Dict[str, Any], Optional[Callable[[bool], None]], bool]
+
+# Firestore rejects batches with more writes than this
+MAX_BATCH_WRITES = 500
+
+
+class BatchWriter:
+    """Buffers set() calls and commits them as parallel Firestore batches"""
+
+    def __init__(self, db, batch_size: int = MAX_BATCH_WRITES, flush_interval: float = 2.0, max_in_flight: int = 4):
+        self.db = db
+        self.batch_size = min(batch_size, MAX_BATCH_WRITES)
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: List[_Write] = []
+        self._pending_since = 0.0
+        self._in_flight: List[Future] = []
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._commit_pool = ThreadPoolExecutor(max_in_flight, thread_name_prefix="firestore-commit")
+
+        self.committed = 0
+        self.failures: List[Tuple[str, Exception]] = []
+
+        # Flushes a partly filled batch when the producer stalls (e.g. on a CloudKit page)
+        self._closed = threading.Event()
+        self._timer = threading.Thread(target=self._flush_periodically, name="firestore-flush", daemon=True)
+        self._timer.start()
+
+    def __enter__(self) -> "BatchWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def set(self, collection: str, document_id: str, data: Dict[str, Any],
+            on_commit: Optional[Callable[[bool], None]] = None, merge: bool = False):
+        """Queue a document write; blocks while all commit slots are busy
+
+        `on_commit(ok)` is called from a commit thread once the write's batch
+        has succeeded or failed. With merge=True only the given fields are
+        written and the rest of the document is kept.
+        """
+        with self._lock:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending.append((collection, document_id, data, on_commit, merge))
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self, wait: bool = False) -> List[Tuple[str, Exception]]:
+        """Commit the pending writes; with wait=True also wait for every in-flight batch
+
+        Returns the documents whose batch failed since the last waited flush.
+        """
+        # Serialized so a waiting flush also sees a batch the timer just took
+        with self._flush_lock:
+            with self._lock:
+                writes, self._pending = self._pending, []
+            if writes:
+                self._slots.acquire()
+                future = self._commit_pool.submit(self._commit, writes)
+                with self._lock:
+                    self._in_flight.append(future)
+
+            if not wait:
+                return []
+
+            with self._lock:
+                in_flight, self._in_flight = self._in_flight, []
+        failures = []
+        for future in in_flight:
+            failures.extend(future.result())
+        return failures
+
+    def close(self):
+        self._closed.set()
+        self._timer.join()
+        self.flush(wait=True)
+        self._commit_pool.shutdown()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval / 2):
+            with self._lock:
+                stale = self._pending and time.monotonic() - self._pending_since >= self.flush_interval
+            if stale:
+                self.flush()
+
+    def _commit(self, writes: List[_Write]) -> List[Tuple[str, Exception]]:
+        """Commit one batch; a failed batch is atomic, so every document in it failed"""
+        try:
+            with metrics.timer("firestore_commit", items=len(writes)):
+                batch = self.db.batch()
+                for collection, document_id, data, _, merge in writes:
+                    batch.set(self.db.collection(collection).document(document_id), data, merge=merge)
+                batch.commit()
+        except Exception as e:
+            paths = [f"{collection}/{document_id}" for collection, document_id, _, _, _ in writes]
+            print(f"      ❌ Batch of {len(writes)} writes failed: {e}")
+            print(f"         Documents: {', '.join(paths)}")
+            failures = [(path, e) for path in paths]
+            with self._lock:
+                self.failures.extend(failures)
+            self._notify(writes, ok=False)
+            return failures
+        finally:
+            self._slots.release()
+
+        with self._lock:
+            self.committed += len(writes)
+        print(f"      ✅ Committed batch of {len(writes)} documents")
+        self._notify(writes, ok=True)
+        return []
+
+    def _notify(self, writes: List[_Write], ok: bool):
+        for collection, document_id, _, on_commit, _ in writes:
+            if on_commit is None:
+                continue
+            try:
+                on_commit(ok)
+            except Exception as e:
+                print(f"      ⚠️ Commit callback failed for {collection}/{document_id}: {e}")
@@ -0,0 +1,177 @@
+"""
+Keep-alive HTTP connection pool shared by every outbound call of the migration tools
+
+urllib.request opens a fresh TCP + TLS connection for every request. The
+migration makes thousands of small CloudKit page, lookup and asset requests,
+so handshakes dominate. This pool keeps idle HTTP/1.1 connections per host,
+caps the number of open connections per host, and is safe to use from
+multiple threads. Reuse is counted so the gain can be measured.
+"""
+
+import http.client
+import io
+import ssl
+import threading
+import urllib.error
+import urllib.parse
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+# Errors raised when the server silently closed an idle keep-alive connection
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+_HostKey = Tuple[str, str, int]
+
+
+class PoolStats:
+    """Counts of opened versus reused connections"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.requests = 0
+
+    def record(self, reused: bool):
+        with self._lock:
+            self.requests += 1
+            if reused:
+                self.reused_connections += 1
+            else:
+                self.new_connections += 1
+
+    def summary(self) -> str:
+        reuse_rate = self.reused_connections / self.requests * 100 if self.requests else 0.0
+        return (f"{self.requests} requests, {self.new_connections} new connections, "
+                f"{self.reused_connections} reused ({reuse_rate:.0f}%)")
+
+
+class ConnectionPool:
+    """Thread-safe pool of persistent HTTP(S) connections keyed by host"""
+
+    def __init__(self, max_per_host: int = 10, timeout: float = 30):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.stats = PoolStats()
+        self._ssl_context = ssl.create_default_context()
+        self._available = threading.Condition()
+        self._idle: Dict[_HostKey, List[http.client.HTTPConnection]] = {}
+        self._open: Dict[_HostKey, int] = {}
+
+    def _host_key(self, parsed: urllib.parse.ParseResult) -> _HostKey:
+        default_port = 443 if parsed.scheme == "https" else 80
+        return (parsed.scheme, parsed.hostname or "", parsed.port or default_port)
+
+    def _checkout(self, key: _HostKey) -> Tuple[http.client.HTTPConnection, bool]:
+        """Return an idle connection for the host, or a new one once under the cap"""
+        with self._available:
+            while True:
+                idle = self._idle.get(key)
+                if idle:
+                    return idle.pop(), True
+                if self._open.get(key, 0) < self.max_per_host:
+                    self._open[key] = self._open.get(key, 0) + 1
+                    break
+                self._available.wait()
+
+        scheme, host, port = key
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        return conn, False
+
+    def _release(self, key: _HostKey, conn: http.client.HTTPConnection, reusable: bool):
+        with self._available:
+            if reusable:
+                self._idle.setdefault(key, []).append(conn)
+            else:
+                conn.close()
+                self._open[key] -= 1
+            self._available.notify()
+
+    def _send(self, key: _HostKey, method: str, target: str, body: Optional[bytes], headers: Dict[str, str]):
+        conn, reused = self._checkout(key)
+        try:
+            conn.request(method, target, body=body, headers=headers)
+            response = conn.getresponse()
+        except STALE_CONNECTION_ERRORS:
+            self._release(key, conn, reusable=False)
+            if not reused:
+                raise
+            # The idle connection had been dropped by the server; retry once on a fresh one
+            return self._send(key, method, target, body, headers)
+        except Exception:
+            self._release(key, conn, reusable=False)
+            raise
+        self.stats.record(reused)
+        return conn, response
+
+    @contextmanager
+    def open(self, method: str, url: str, body: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None):
+        """Send a request and yield the http.client response
+
+        Redirects are followed, and HTTP error statuses raise
+        urllib.error.HTTPError just like urllib.request.urlopen. The
+        connection goes back to the pool if the body was read to the end.
+        """
+        headers = dict(headers or {})
+
+        for _ in range(MAX_REDIRECTS + 1):
+            parsed = urllib.parse.urlparse(url)
+            key = self._host_key(parsed)
+            target = parsed.path or "/"
+            if parsed.query:
+                target += f"?{parsed.query}"
+
+            conn, response = self._send(key, method, target, body, headers)
+            location = response.getheader("Location")
+
+            if response.status in REDIRECT_CODES and location:
+                response.read()
+                self._release(key, conn, reusable=not response.will_close)
+                url = urllib.parse.urljoin(url, location)
+                if response.status == 303:
+                    method, body = "GET", None
+                continue
+
+            if response.status >= 400:
+                error_body = response.read()
+                self._release(key, conn, reusable=not response.will_close)
+                raise urllib.error.HTTPError(url, response.status, response.reason,
+                                             response.headers, io.BytesIO(error_body))
+
+            try:
+                yield response
+            finally:
+                finished = response.isclosed()
+                self._release(key, conn, reusable=finished and not response.will_close)
+            return
+
+        raise urllib.error.URLError(f"Too many redirects for {url}")
+
+    def request(self, method: str, url: str, body: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None) -> bytes:
+        """Send a request and return the full response body"""
+        with self.open(method, url, body=body, headers=headers) as response:
+            return response.read()
+
+    def close(self):
+        """Close every idle connection"""
+        with self._available:
+            for key, idle in self._idle.items():
+                for conn in idle:
+                    conn.close()
+                self._open[key] -= len(idle)
+            self._idle.clear()
+
+
+# Process-wide pool; scripts may adjust max_per_host before making requests
+shared_pool = ConnectionPool()
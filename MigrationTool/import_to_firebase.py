@@ -9,37 +9,59 @@ Usage:
 1. Export records from CloudKit Dashboard (https://icloud.developer.apple.com/)
 2. Save the exported JSON files in a folder
 3. Run: python3 import_to_firebase.py --data-dir ./cloudkit_export --service-account ./service-account.json
+
+With --workers N, export files are split into chunks of records that are
+decoded, converted and written by N worker processes, each with its own
+Firestore and Storage clients.
+
+With --spool DIR instead of --data-dir, the records come from a spool written
+by cloudkit_to_firebase.py --export-spool; workers then read its chunk files
+themselves.
 """
 
 import argparse
 import json
+import multiprocessing
 import os
 import sys
 import base64
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
-from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, Tuple
 from google.cloud import firestore
 from google.cloud import storage
 from google.oauth2 import service_account
 
-# Collection name mapping
-COLLECTION_MAPPING = {
-    "HRProduct": "products",
-    "HROrder": "orders",
-    "HRProductCategory": "productCategories",
-    "HRCity": "cities",
-    "HRAddBanner": "addBanners",
-    "HRAIVibe": "aiVibes",
-    "HRAIImageResult": "aiImageResults",
-    "HRAPI": "apis"
-}
+import json_stream
+import spool
+from asset_transfer import DEFAULT_CACHE_CONTROL, PUBLIC_MODES, detect_extension, upload_policy
+from firestore_writer import BatchWriter, MAX_BATCH_WRITES
+from http_pool import shared_pool
+from metrics import metrics
+from rate_limit import storage_limiter
+from record_schema import COLLECTION_MAPPING, SchemaConverters
+
+# Field converters compiled from cloudkit-production.ckdb
+CONVERTERS = SchemaConverters.load()
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Import CloudKit data to Firebase")
-    parser.add_argument("--data-dir", required=True, help="Directory containing CloudKit exported JSON files")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--data-dir", help="Directory containing CloudKit exported JSON files")
+    source.add_argument("--spool", help="Spool directory written by cloudkit_to_firebase.py --export-spool")
     parser.add_argument("--service-account", required=True, help="Path to GCP service account JSON")
     parser.add_argument("--bucket", default="houserizz-481012.appspot.com", help="Firebase Storage bucket")
     parser.add_argument("--dry-run", action="store_true", help="Preview without uploading")
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_WRITES, help="Firestore writes per batch commit")
+    parser.add_argument("--mmap", action="store_true", help="Memory-map export files while streaming them")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes importing chunks of records")
+    parser.add_argument("--chunk-size", type=int, default=MAX_BATCH_WRITES, help="Records per worker task")
+    parser.add_argument("--public-mode", choices=PUBLIC_MODES, default="acl",
+                        help="acl: public-read ACL set in the upload; bucket: bucket-level public access, no object ACL; "
+                             "make-public: separate make_public call per object")
+    parser.add_argument("--cache-control", default=DEFAULT_CACHE_CONTROL, help="Cache-Control of uploaded assets")
+    parser.add_argument("--progress-interval", type=float, default=30, help="Seconds between progress lines (0 disables)")
+    parser.add_argument("--metrics-out", help="Write final metrics to this path (.prom for Prometheus text, else JSON)")
     return parser.parse_args()
 
 def init_firebase(service_account_path: str, bucket_name: str):
@@ -50,40 +72,41 @@ def init_firebase(service_account_path: str, bucket_name: str):
     bucket = storage_client.bucket(bucket_name)
     return db, bucket
 
+class ImportStats:
+    """Per-type record counts and error totals; picklable so workers can return it"""
+
+    def __init__(self):
+        self.type_counts: Dict[str, int] = {}
+        self.errors = 0
+        self.failed_writes = 0
+        # Stage metrics gathered in a worker process, merged by the parent
+        self.stages = {}
+
+    @property
+    def records(self) -> int:
+        return sum(self.type_counts.values())
+
+    def merge(self, other: "ImportStats"):
+        for record_type, count in other.type_counts.items():
+            self.type_counts[record_type] = self.type_counts.get(record_type, 0) + count
+        self.errors += other.errors
+        self.failed_writes += other.failed_writes
+
+    def report(self):
+        for record_type, count in self.type_counts.items():
+            collection_name = COLLECTION_MAPPING.get(record_type, record_type.lower())
+            print(f"   ✅ Processed {count} {record_type} records → {collection_name}")
+        if self.errors:
+            print(f"   ❌ {self.errors} records failed to convert")
+        if self.failed_writes:
+            print(f"   ⚠️ {self.failed_writes} documents failed to write")
+
 def convert_cloudkit_record(record: dict, bucket, dry_run: bool) -> dict:
     """Convert CloudKit record format to Firestore document format"""
-    fields = record.get("fields", {})
-    doc_data = {
-        "id": record.get("recordName", "")
-    }
-    
-    for field_name, field_value in fields.items():
-        value_type = field_value.get("type", "")
-        value = field_value.get("value")
-        
-        if value_type == "STRING":
-            doc_data[field_name] = value
-        elif value_type == "INT64":
-            doc_data[field_name] = int(value)
-        elif value_type == "DOUBLE":
-            doc_data[field_name] = float(value)
-        elif value_type == "TIMESTAMP":
-            doc_data[field_name] = datetime.fromtimestamp(value / 1000)
-        elif value_type == "ASSET":
-            # Handle asset upload
-            asset_url = upload_asset(value, record.get("recordName", ""), field_name, bucket, dry_run)
-            doc_data[field_name] = asset_url
-        elif value_type == "REFERENCE":
-            doc_data[field_name] = value.get("recordName", "")
-        elif value_type == "LOCATION":
-            doc_data[field_name] = {
-                "latitude": value.get("latitude"),
-                "longitude": value.get("longitude")
-            }
-        else:
-            doc_data[field_name] = value
+    def convert_asset(record: dict, field_name: str, value: dict) -> str:
+        return upload_asset(value, record.get("recordName", ""), field_name, bucket, dry_run)
     
-    return doc_data
+    return CONVERTERS.convert(record, convert_asset)
 
 def upload_asset(asset_info: dict, record_id: str, field_name: str, bucket, dry_run: bool) -> str:
     """Upload asset to Firebase Storage and return download URL"""
@@ -98,82 +121,174 @@ def upload_asset(asset_info: dict, record_id: str, field_name: str, bucket, dry_
         return ""
     
     try:
-        import urllib.request
-        
-        # Download asset
-        with urllib.request.urlopen(download_url) as response:
-            data = response.read()
+        # Download asset over a pooled keep-alive connection
+        with metrics.timer("asset_download") as call:
+            data = shared_pool.request('GET', download_url)
+            call.bytes = len(data)
         
-        # Detect file extension
-        ext = "bin"
-        if len(data) >= 4:
-            if data[:3] == b'\xff\xd8\xff':
-                ext = "jpg"
-            elif data[:4] == b'\x89PNG':
-                ext = "png"
-            elif data[:4] == b'PK\x03\x04':
-                ext = "usdz"
-        
-        # Upload to Firebase Storage
-        blob_path = f"migrated/{record_id}/{field_name}.{ext}"
-        blob = bucket.blob(blob_path)
-        blob.upload_from_string(data)
-        blob.make_public()
+        # Upload to Firebase Storage; content type, cache-control and ACL go in the same request
+        blob_path = f"migrated/{record_id}/{field_name}.{detect_extension(data)}"
+        public_url = upload_policy.upload(bucket.blob(blob_path), data)
         
         print(f"      📤 Uploaded: {blob_path}")
-        return blob.public_url
+        return public_url
     except Exception as e:
         print(f"      ⚠️ Failed to upload asset {field_name}: {e}")
         return download_url or ""
 
-def import_records(json_file: Path, db, bucket, dry_run: bool):
-    """Import records from a JSON file"""
-    print(f"\n📂 Processing: {json_file.name}")
+def import_record(record: dict, writer: BatchWriter, bucket, dry_run: bool, stats: ImportStats):
+    """Convert one exported record and queue its document write"""
+    # Record type is detected per record, so mixed-type exports work too
+    record_type = record.get("recordType", "Unknown")
+    collection_name = COLLECTION_MAPPING.get(record_type, record_type.lower())
+    stats.type_counts[record_type] = stats.type_counts.get(record_type, 0) + 1
+    metrics.add_records(record_type)
     
-    with open(json_file, 'r') as f:
-        data = json.load(f)
+    record_name = record.get("recordName", "unknown")
+    try:
+        doc_data = convert_cloudkit_record(record, bucket, dry_run)
+        
+        if dry_run:
+            print(f"   [DRY RUN] Would create: {collection_name}/{record_name}")
+        else:
+            writer.set(collection_name, record_name, doc_data)
+    except Exception as e:
+        stats.errors += 1
+        print(f"   ❌ Error processing {record_name}: {e}")
+
+def import_stream(records: Iterable[dict], writer: BatchWriter, bucket, dry_run: bool) -> ImportStats:
+    """Import records one at a time, then commit whatever is still buffered"""
+    stats = ImportStats()
     
-    records = data.get("records", [])
-    if not records:
+    for record in records:
+        import_record(record, writer, bucket, dry_run, stats)
+    
+    if not stats.type_counts:
         print("   No records found")
-        return
+        return stats
     
-    # Determine record type from first record
-    record_type = records[0].get("recordType", "Unknown")
-    collection_name = COLLECTION_MAPPING.get(record_type, record_type.lower())
+    # Commit the rest of this source before moving on
+    stats.failed_writes += len(writer.flush(wait=True))
+    stats.report()
+    return stats
+
+def import_records(json_file: Path, writer: BatchWriter, bucket, dry_run: bool, use_mmap: bool = False) -> ImportStats:
+    """Import records from a JSON file, streaming them one at a time"""
+    print(f"\n📂 Processing: {json_file.name}")
+    return import_stream(json_stream.iter_records(json_file, use_mmap=use_mmap), writer, bucket, dry_run)
+
+# Per-process state of --workers mode, set up by _init_worker
+_worker = {}
+
+def _init_worker(service_account_path: str, bucket_name: str, batch_size: int, dry_run: bool,
+                 public_mode: str, cache_control: str):
+    upload_policy.public_mode = public_mode
+    upload_policy.cache_control = cache_control
+    db, bucket = init_firebase(service_account_path, bucket_name)
+    _worker["db"] = db
+    _worker["bucket"] = bucket
+    _worker["batch_size"] = batch_size
+    _worker["dry_run"] = dry_run
+
+def _import_chunk(chunk: str) -> ImportStats:
+    """Worker task: decode, convert and commit one chunk of records"""
+    return _import_batch(json.loads(chunk))
+
+def _import_spool_chunk(path: str) -> ImportStats:
+    """Worker task: read, convert and commit one spool chunk file"""
+    return _import_batch(spool.read_chunk(path))
+
+def _import_batch(records: Iterable[dict]) -> ImportStats:
+    stats = ImportStats()
+    # One writer per chunk, closed even if the chunk fails, so no flush timer outlives its task
+    writer = BatchWriter(_worker["db"], batch_size=_worker["batch_size"])
+    try:
+        for record in records:
+            import_record(record, writer, _worker["bucket"], _worker["dry_run"], stats)
+        # A chunk only counts as done once its documents are committed
+        stats.failed_writes += len(writer.flush(wait=True))
+    finally:
+        writer.close()
+    stats.stages = metrics.drain_stages()
+    return stats
+
+# (label, worker function, its argument)
+ImportTask = Tuple[str, Callable[..., ImportStats], object]
+
+def export_file_tasks(json_files: Iterable[Path], args) -> Iterator[ImportTask]:
+    for json_file in json_files:
+        print(f"\n📂 Queueing: {json_file.name}")
+        # Only element boundaries are found here; decoding happens in the workers
+        for chunk in json_stream.iter_raw_batches(json_file, args.chunk_size, use_mmap=args.mmap):
+            yield json_file.name, _import_chunk, chunk
+
+def spool_tasks(reader: spool.SpoolReader) -> Iterator[ImportTask]:
+    # Workers read and decompress the chunk files themselves
+    for path in reader.chunks():
+        yield str(Path(path).relative_to(reader.directory)), _import_spool_chunk, path
+
+def import_parallel(tasks: Iterable[ImportTask], args) -> ImportStats:
+    """Import chunks of records spread over a process pool"""
+    total = ImportStats()
+    max_pending = 2 * args.workers
+    pending = {}
     
-    print(f"   Record type: {record_type} → Collection: {collection_name}")
-    print(f"   Found {len(records)} records")
+    def collect(done):
+        for future in done:
+            label = pending.pop(future)
+            try:
+                stats = future.result()
+            except Exception as e:
+                print(f"   ❌ Chunk of {label} failed: {e}")
+                total.errors += 1
+                continue
+            total.merge(stats)
+            metrics.merge_stages(stats.stages)
+            for record_type, count in stats.type_counts.items():
+                metrics.add_records(record_type, count)
+            print(f"   📦 {label}: +{stats.records} records ({total.records} total, "
+                  f"{total.errors + total.failed_writes} errors)")
     
-    for record in records:
-        record_name = record.get("recordName", "unknown")
-        try:
-            doc_data = convert_cloudkit_record(record, bucket, dry_run)
-            
-            if dry_run:
-                print(f"   [DRY RUN] Would create: {collection_name}/{record_name}")
-            else:
-                db.collection(collection_name).document(record_name).set(doc_data)
-                print(f"   ✅ Created: {collection_name}/{record_name}")
-        except Exception as e:
-            print(f"   ❌ Error processing {record_name}: {e}")
+    # Spawned rather than forked: the parent already runs the progress reporter thread
+    with ProcessPoolExecutor(
+        args.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(args.service_account, args.bucket, args.batch_size, args.dry_run, args.public_mode,
+                  args.cache_control)
+    ) as pool:
+        for label, task, payload in tasks:
+            # Bounds the chunks held in memory while workers catch up
+            while len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending[pool.submit(task, payload)] = label
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
     
-    print(f"   ✅ Processed {len(records)} {record_type} records")
+    return total
 
 def main():
     args = parse_args()
     
     print("🚀 CloudKit to Firebase Import Script")
     print("=====================================")
-    print(f"📁 Data directory: {args.data_dir}")
+    print(f"📁 Data directory: {args.data_dir}" if args.data_dir else f"📼 Spool: {args.spool}")
     print(f"🔑 Service account: {args.service_account}")
     print(f"🪣 Storage bucket: {args.bucket}")
     print(f"🔄 Dry run: {args.dry_run}")
     print()
     
     # Validate paths
-    data_dir = Path(args.data_dir)
-    if not data_dir.exists():
+    reader = None
+    if args.spool:
+        try:
+            reader = spool.SpoolReader(args.spool)
+        except (OSError, ValueError) as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+    elif not Path(args.data_dir).exists():
         print(f"❌ Data directory not found: {args.data_dir}")
         sys.exit(1)
     
@@ -183,22 +298,52 @@ def main():
     
     # Initialize Firebase
     print("🔧 Initializing Firebase...")
+    upload_policy.public_mode = args.public_mode
+    upload_policy.cache_control = args.cache_control
     db, bucket = init_firebase(args.service_account, args.bucket)
     print("✅ Firebase initialized")
     
-    # Find all JSON files
-    json_files = list(data_dir.glob("*.json"))
-    if not json_files:
-        print(f"❌ No JSON files found in {args.data_dir}")
-        sys.exit(1)
-    
-    print(f"\n📋 Found {len(json_files)} JSON files to import")
+    if reader:
+        for record_type, entry in reader.record_types.items():
+            flag = "" if entry["complete"] else " (export incomplete)"
+            print(f"   {record_type}: {entry['records']} records in {len(entry['chunks'])} chunks{flag}")
+        source = f"{len(reader.record_types)} spooled record types"
+        tasks = spool_tasks(reader)
+    else:
+        # Find all JSON files
+        json_files = list(Path(args.data_dir).glob("*.json"))
+        if not json_files:
+            print(f"❌ No JSON files found in {args.data_dir}")
+            sys.exit(1)
+        print(f"\n📋 Found {len(json_files)} JSON files to import")
+        source = f"{len(json_files)} files"
+        tasks = export_file_tasks(json_files, args)
+    metrics.start_reporter(args.progress_interval)
     
-    # Import each file
-    for json_file in json_files:
-        import_records(json_file, db, bucket, args.dry_run)
+    if args.workers > 1:
+        print(f"⚙️ Importing with {args.workers} worker processes")
+        total = import_parallel(tasks, args)
+    else:
+        # Import each file or spooled record type
+        total = ImportStats()
+        with BatchWriter(db, batch_size=args.batch_size) as writer:
+            if reader:
+                for record_type in reader.record_types:
+                    print(f"\n📼 Replaying: {record_type}")
+                    total.merge(import_stream(reader.iter_records(record_type), writer, bucket, args.dry_run))
+            else:
+                for json_file in json_files:
+                    total.merge(import_records(json_file, writer, bucket, args.dry_run, args.mmap))
+        print(f"\n🔌 HTTP: {shared_pool.stats.summary()}")
+        print(f"🚦 {storage_limiter.summary()}")
     
-    print("\n🎉 Import complete!")
+    print(f"\n📊 Summary: {total.records} records from {source}")
+    total.report()
+    metrics.stop_reporter()
+    print(metrics.progress_line())
+    if args.metrics_out:
+        metrics.write_summary(args.metrics_out)
+    print("🎉 Import complete!")
 
 if __name__ == "__main__":
     main()
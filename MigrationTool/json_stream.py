@@ -0,0 +1,226 @@
+"""
+Incremental JSON array reader for large CloudKit Dashboard exports
+
+json.load needs the whole export in memory before the first record can be
+converted. iter_records() instead scans the file in fixed-size chunks and
+yields each element of the top-level "records" array as soon as it has been
+read, decoding every element with the C-accelerated json decoder. Memory
+stays at roughly one chunk plus the largest single record, whatever the size
+of the export. The source can be a regular file or a memory-mapped one.
+
+iter_raw_batches() slices out the raw text of runs of elements, so that
+decoding and everything after it can be spread across worker processes. The
+element ends come from the same C decoder: a per-character scan in Python
+is several times slower than decoding and would cap the workers.
+"""
+
+import codecs
+import json
+import mmap
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, BinaryIO, Iterator, Tuple
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+WHITESPACE = " \t\n\r"
+
+_decoder = json.JSONDecoder()
+
+
+class _Buffer:
+    """Sliding text window over a binary stream"""
+
+    def __init__(self, stream: BinaryIO, chunk_size: int):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+        # While set, the window keeps the text from here on instead of from `pos`
+        self.mark = None
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+
+    def fill(self, size: int = 0) -> bool:
+        """Append at least one more chunk; False once the stream is exhausted"""
+        if self.eof:
+            return False
+        data = self.stream.read(max(size, self.chunk_size))
+        if not data:
+            self.eof = True
+            self.text += self._utf8.decode(b"", final=True)
+            return False
+        # Drop what has already been consumed (or lies before the mark) before growing the window
+        keep = self.pos if self.mark is None else self.mark
+        self.text = self.text[keep:] + self._utf8.decode(data)
+        self.pos -= keep
+        if self.mark is not None:
+            self.mark = 0
+        return True
+
+    def peek(self) -> str:
+        """Next non-whitespace character, or "" at end of input"""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos}, found {found!r}")
+        self.pos += 1
+
+    def decode_value(self) -> Any:
+        """Decode the JSON value at the cursor, reading more input until it is complete"""
+        value, end = self._decode()
+        self.pos = end
+        return value
+
+    def scan_value(self) -> str:
+        """Return the raw text of the JSON value at the cursor
+
+        The value is decoded to find where it ends; the decoded object is
+        dropped and the text is passed on for a worker to decode.
+        """
+        _, end = self._decode()
+        text = self.text[self.pos:end]
+        self.pos = end
+        return text
+
+    def decode_raw(self, count: int) -> Tuple[str, bool]:
+        """Return the raw text of up to `count` array elements and whether more follow
+
+        The cursor must be at an element. The text is one slice of the window,
+        separators included, and the cursor ends past the trailing ',' or ']'.
+        """
+        self.peek()
+        self.mark = self.pos
+        try:
+            for _ in range(count):
+                _, self.pos = self._decode()
+                separator = self.peek()
+                end = self.pos
+                self.pos += 1
+                if separator == "]":
+                    return self.text[self.mark:end], False
+                if separator != ",":
+                    raise ValueError(f"Expected ',' or ']' in array, found {separator!r}")
+            return self.text[self.mark:end], True
+        finally:
+            self.mark = None
+
+    def _decode(self) -> Tuple[Any, int]:
+        """Decode the value at the cursor, filling the window until it is complete
+
+        Returns the value and its end offset; the cursor stays at its start.
+        """
+        self.peek()
+        want = self.chunk_size
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                # Most likely truncated by the window; grow geometrically so
+                # a huge element isn't re-parsed once per chunk
+                if not self.fill(want):
+                    raise
+                want *= 2
+                continue
+            # A number at the window edge may decode early ("12" of "1234", "1" of "1.5")
+            if not self.eof and (end == len(self.text) or self._cut_number(value, end)) and self.fill():
+                continue
+            return value, end
+
+    def _cut_number(self, value: Any, end: int) -> bool:
+        """True if a decoded number is followed by what looks like its own truncated tail"""
+        return (isinstance(value, (int, float)) and not isinstance(value, bool)
+                and end >= len(self.text) - 2 and self.text[end] in ".eE")
+
+
+def _seek_array(buffer: _Buffer, key: str) -> bool:
+    """Move the cursor just past the opening '[' of the wanted array"""
+    first = buffer.peek()
+
+    if first == "{":
+        buffer.expect("{")
+        while True:
+            if buffer.peek() == "}":
+                return False
+            name = buffer.decode_value()
+            buffer.expect(":")
+            if name == key and buffer.peek() == "[":
+                break
+            buffer.decode_value()  # not the array we want; skip it
+            if buffer.peek() == ",":
+                buffer.pos += 1
+    elif first != "[":
+        if first == "":
+            return False
+        raise ValueError(f"Expected a JSON object or array, found {first!r}")
+
+    buffer.expect("[")
+    return True
+
+
+def _iter_elements(buffer: _Buffer, read_element) -> Iterator[Any]:
+    if buffer.peek() == "]":
+        return
+    while True:
+        yield read_element()
+        separator = buffer.peek()
+        buffer.pos += 1
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError(f"Expected ',' or ']' in array, found {separator!r}")
+
+
+def iter_array(stream: BinaryIO, key: str = "records", chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Any]:
+    """Yield the elements of `key`'s array in a top-level object (or of a top-level array)"""
+    buffer = _Buffer(stream, chunk_size)
+    if _seek_array(buffer, key):
+        yield from _iter_elements(buffer, buffer.decode_value)
+
+
+def iter_raw_array(stream: BinaryIO, key: str = "records", chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[str]:
+    """Like iter_array, but yield each element's undecoded JSON text"""
+    buffer = _Buffer(stream, chunk_size)
+    if _seek_array(buffer, key):
+        yield from _iter_elements(buffer, buffer.scan_value)
+
+
+@contextmanager
+def open_export(path: Path, use_mmap: bool = False):
+    """Open an export file as a binary stream, optionally memory-mapped"""
+    with open(path, "rb") as f:
+        if use_mmap and path.stat().st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+        else:
+            yield f
+
+
+def iter_records(path: Path, use_mmap: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[dict]:
+    """Stream the records of a CloudKit Dashboard export one by one"""
+    with open_export(path, use_mmap) as stream:
+        yield from iter_array(stream, "records", chunk_size)
+
+
+def iter_raw_batches(path: Path, batch_size: int, use_mmap: bool = False,
+                     chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[str]:
+    """Yield JSON array texts of up to `batch_size` records each, ready for json.loads
+
+    A batch is one slice of the source text, separators included, so no
+    per-element strings are built.
+    """
+    with open_export(path, use_mmap) as stream:
+        buffer = _Buffer(stream, chunk_size)
+        if not _seek_array(buffer, "records") or buffer.peek() == "]":
+            return
+        more = True
+        while more:
+            text, more = buffer.decode_raw(batch_size)
+            yield "[" + text + "]"
@@ -0,0 +1,239 @@
+"""
+Throughput and latency metrics for the migration scripts
+
+Every stage of a migration (CloudKit paging, asset download, Storage upload,
+make_public, Firestore writes, ...) records its calls here: a count, an error
+count, bytes and items moved, and latency percentiles taken from a bounded
+random sample. Records are also counted per record type to give records/sec.
+
+A background reporter prints a one-line progress summary every few seconds,
+and write_summary() saves everything at the end as JSON or, for a path ending
+in .prom, in the Prometheus text format.
+"""
+
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# Latency samples kept per stage; percentiles are exact below this many calls
+SAMPLE_SIZE = 10000
+
+PERCENTILES = (50, 95, 99)
+
+
+class StageStats:
+    """Counters and a latency sample for one stage"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes = 0
+        self.items = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._samples: List[float] = []
+        self._random = random.Random(0)
+
+    def observe(self, seconds: float, nbytes: int, items: int, ok: bool):
+        self.calls += 1
+        self.errors += not ok
+        self.bytes += nbytes
+        self.items += items
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        # Reservoir sampling keeps a uniform sample of every call so far
+        if len(self._samples) < SAMPLE_SIZE:
+            self._samples.append(seconds)
+        else:
+            slot = self._random.randrange(self.calls)
+            if slot < SAMPLE_SIZE:
+                self._samples[slot] = seconds
+
+    def merge(self, other: "StageStats"):
+        """Fold in the stats of the same stage gathered elsewhere (e.g. a worker process)"""
+        self.calls += other.calls
+        self.errors += other.errors
+        self.bytes += other.bytes
+        self.items += other.items
+        self.total_seconds += other.total_seconds
+        self.max_seconds = max(self.max_seconds, other.max_seconds)
+        samples = self._samples + other._samples
+        if len(samples) > SAMPLE_SIZE:
+            samples = self._random.sample(samples, SAMPLE_SIZE)
+        self._samples = samples
+
+    def percentile(self, p: float) -> float:
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def snapshot(self) -> dict:
+        snapshot = {
+            "calls": self.calls,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "items": self.items,
+            "total_seconds": round(self.total_seconds, 6),
+            "max_seconds": round(self.max_seconds, 6),
+        }
+        for p in PERCENTILES:
+            snapshot[f"p{p}_seconds"] = round(self.percentile(p), 6)
+        return snapshot
+
+
+class _Call:
+    """Handle of a timed call; set bytes or items once they are known"""
+
+    def __init__(self, nbytes: int, items: int):
+        self.bytes = nbytes
+        self.items = items
+
+
+class Metrics:
+    """Thread-safe registry of stage and per-record-type metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self._stages: Dict[str, StageStats] = {}
+        self._records: Dict[str, int] = {}
+        self._first_record: Dict[str, float] = {}
+        self._last_record: Dict[str, float] = {}
+        self._reporter: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def observe(self, stage: str, seconds: float, nbytes: int = 0, items: int = 0, ok: bool = True):
+        """Record one call of a stage"""
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = StageStats()
+            stats.observe(seconds, nbytes, items, ok)
+
+    @contextmanager
+    def timer(self, stage: str, nbytes: int = 0, items: int = 0):
+        """Time the block as one call of `stage`; an exception counts as an error"""
+        call = _Call(nbytes, items)
+        start = time.perf_counter()
+        try:
+            yield call
+        except BaseException:
+            self.observe(stage, time.perf_counter() - start, call.bytes, call.items, ok=False)
+            raise
+        self.observe(stage, time.perf_counter() - start, call.bytes, call.items)
+
+    def drain_stages(self) -> Dict[str, StageStats]:
+        """Hand over the stage stats gathered so far and start afresh"""
+        with self._lock:
+            stages, self._stages = self._stages, {}
+        return stages
+
+    def merge_stages(self, stages: Dict[str, StageStats]):
+        with self._lock:
+            for stage, stats in stages.items():
+                if stage in self._stages:
+                    self._stages[stage].merge(stats)
+                else:
+                    self._stages[stage] = stats
+
+    def add_records(self, record_type: str, count: int = 1):
+        now = time.monotonic()
+        with self._lock:
+            self._records[record_type] = self._records.get(record_type, 0) + count
+            self._first_record.setdefault(record_type, now)
+            self._last_record[record_type] = now
+
+    def records_per_second(self, record_type: str) -> float:
+        with self._lock:
+            elapsed = self._last_record.get(record_type, 0) - self._first_record.get(record_type, 0)
+            count = self._records.get(record_type, 0)
+        return count / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stages = {stage: stats.snapshot() for stage, stats in self._stages.items()}
+            record_types = list(self._records)
+            counts = dict(self._records)
+        return {
+            "elapsed_seconds": round(time.monotonic() - self.started, 3),
+            "stages": stages,
+            "record_types": {
+                record_type: {
+                    "records": counts[record_type],
+                    "records_per_second": round(self.records_per_second(record_type), 3),
+                }
+                for record_type in record_types
+            },
+        }
+
+    def progress_line(self) -> str:
+        snapshot = self.snapshot()
+        parts = [f"⏱️ {snapshot['elapsed_seconds']:.0f}s"]
+        for record_type, stats in snapshot["record_types"].items():
+            parts.append(f"{record_type} {stats['records']} ({stats['records_per_second']:.0f}/s)")
+        for stage, stats in snapshot["stages"].items():
+            parts.append(f"{stage} {stats['calls']} p95 {stats['p95_seconds'] * 1000:.0f}ms"
+                         + (f" {stats['errors']} err" if stats["errors"] else ""))
+        return " | ".join(parts)
+
+    def start_reporter(self, interval: float):
+        """Print a progress line every `interval` seconds until stop_reporter()"""
+        if interval <= 0 or self._reporter is not None:
+            return
+
+        def report():
+            while not self._stopped.wait(interval):
+                print(self.progress_line())
+
+        self._reporter = threading.Thread(target=report, name="metrics-reporter", daemon=True)
+        self._reporter.start()
+
+    def stop_reporter(self):
+        self._stopped.set()
+        if self._reporter is not None:
+            self._reporter.join()
+            self._reporter = None
+
+    def prometheus_text(self, prefix: str = "migration") -> str:
+        snapshot = self.snapshot()
+        stages = snapshot["stages"]
+        record_types = snapshot["record_types"]
+        lines = []
+        # Each metric family's samples must form one group
+        for name, key in (("calls", "calls"), ("errors", "errors"), ("bytes", "bytes"), ("items", "items")):
+            lines.append(f"# TYPE {prefix}_stage_{name}_total counter")
+            for stage, stats in stages.items():
+                lines.append(f'{prefix}_stage_{name}_total{{stage="{stage}"}} {stats[key]}')
+        lines.append(f"# TYPE {prefix}_stage_seconds summary")
+        for stage, stats in stages.items():
+            for p in PERCENTILES:
+                lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="{p / 100}"}} {stats[f"p{p}_seconds"]}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {stats["total_seconds"]}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {stats["calls"]}')
+        lines.append(f"# TYPE {prefix}_records_total counter")
+        for record_type, stats in record_types.items():
+            lines.append(f'{prefix}_records_total{{record_type="{record_type}"}} {stats["records"]}')
+        lines.append(f"# TYPE {prefix}_records_per_second gauge")
+        for record_type, stats in record_types.items():
+            lines.append(f'{prefix}_records_per_second{{record_type="{record_type}"}} {stats["records_per_second"]}')
+        lines.append(f"# TYPE {prefix}_elapsed_seconds gauge")
+        lines.append(f"{prefix}_elapsed_seconds {snapshot['elapsed_seconds']}")
+        return "\n".join(lines) + "\n"
+
+    def write_summary(self, path: str):
+        """Save the metrics as Prometheus text (*.prom) or JSON (anything else)"""
+        with open(path, "w") as f:
+            if path.endswith(".prom"):
+                f.write(self.prometheus_text())
+            else:
+                json.dump(self.snapshot(), f, indent=2)
+                f.write("\n")
+        print(f"📈 Metrics written to {path}")
+
+
+# Process-wide registry shared by every module of a run
+metrics = Metrics()
@@ -4,28 +4,63 @@ Asset Migration Script - Downloads assets from CloudKit and uploads to Firebase
 
 This script fetches all records with ASSET fields from CloudKit, downloads the assets,
 uploads them to Firebase Storage, and updates the Firestore documents with new URLs.
+
+Migrated assets are journaled to a local checkpoint file; rerun with --resume
+after a failure to skip assets that were already transferred. With
+--incremental, only records changed since the last successful sync are
+fetched, and assets whose CloudKit fileChecksum is unchanged are skipped.
+
+With --content-addressed, blobs are stored under the SHA-256 of their bytes so
+imagery shared between products, banners and vibes is uploaded only once.
+
+With --derivatives, thumbnail and medium-size copies of every JPEG and PNG
+are rendered on a process pool (needs Pillow), uploaded next to the original
+and written to the document as `<field>_thumb` / `<field>_medium`. Only assets
+downloaded by this run get them: assets skipped as unchanged (--resume,
+--incremental), found by --skip-existing or known by --content-addressed
+checksum, and large assets streamed in chunks, are not rendered.
+
+With --skip-existing, the migrated/ prefix is listed once up front and assets
+whose blob already exists with CloudKit's size are not transferred again.
+
+Assets larger than one upload chunk (--chunk-size-mb) are piped from the
+download into a resumable upload, so memory per transfer stays at one chunk.
+
+With --dry-run, nothing is downloaded or written and Firestore is never
+contacted: the CloudKit asset metadata (size, fileChecksum) is tallied into
+a plan of asset counts and bytes per record type and field, duplicate bytes
+and an estimated duration at each --plan-concurrency (see transfer_plan.py).
+With --resume, --incremental or --content-addressed the plan reads the
+checkpoint (read-only), so it covers only what that run would still
+transfer, and says so.
+The google-cloud and Pillow imports are deferred until a real run needs them,
+so planning starts quickly.
 """
 
 import argparse
+import contextlib
 import json
 import os
-import base64
-import hashlib
-import urllib.request
-import urllib.parse
+import sys
+import time
 from datetime import datetime, timezone
-from typing import Optional, List, Dict, Any
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import ec
-from cryptography.hazmat.backends import default_backend
-from google.cloud import firestore
-from google.cloud import storage
-from google.oauth2 import service_account
+from functools import partial
+from typing import Optional, List, Dict, Any, Tuple, Callable
+
+from asset_transfer import (
+    DEFAULT_CACHE_CONTROL, DEFAULT_CHUNK_SIZE, PUBLIC_MODES, BlobIndex, ContentAddressedUploader, StreamingUploader,
+    TransferEngine, detect_extension, upload_policy
+)
+from checkpoint import CheckpointStore, PageCheckpointer, asset_checksum, asset_size, parse_since
+from cloudkit_client import CloudKitClient
+from http_pool import shared_pool
+from metrics import metrics
+from rate_limit import storage_limiter
+from transfer_plan import DEFAULT_BANDWIDTH_MBPS, DEFAULT_LATENCY_MS, TransferPlan
 
 # CloudKit configuration
 CLOUDKIT_CONTAINER = "iCloud.krishmittal.HouseRizz-iOS"
 CLOUDKIT_ENVIRONMENT = "production"
-CLOUDKIT_API_VERSION = "1"
 
 # Record types with assets and their asset fields
 ASSET_RECORDS = {
@@ -56,207 +91,382 @@ ASSET_RECORDS = {
 }
 
 
-class CloudKitClient:
-    """CloudKit Web Services API client"""
-    
-    def __init__(self, container: str, key_id: str, key_file: str, environment: str = "production"):
-        self.container = container
-        self.key_id = key_id
-        self.environment = environment
-        self.base_url = f"https://api.apple-cloudkit.com/database/{CLOUDKIT_API_VERSION}/{container}/{environment}/public"
-        
-        with open(key_file, 'rb') as f:
-            self.private_key = serialization.load_pem_private_key(
-                f.read(),
-                password=None,
-                backend=default_backend()
-            )
-    
-    def _sign_request(self, date: str, body: str, path: str) -> str:
-        body_hash = base64.b64encode(hashlib.sha256(body.encode('utf-8')).digest()).decode('utf-8')
-        message = f"{date}:{body_hash}:{path}"
-        signature = self.private_key.sign(
-            message.encode('utf-8'),
-            ec.ECDSA(hashes.SHA256())
-        )
-        return base64.b64encode(signature).decode('utf-8')
+def connect_google(service_account_path: str, bucket_name: str, firestore_client: bool = True):
+    """Return (Firestore client or None, Storage bucket); google-cloud is imported only here"""
+    from google.cloud import firestore
+    from google.cloud import storage
+    from google.oauth2 import service_account
+
+    credentials = service_account.Credentials.from_service_account_file(service_account_path)
+    db = firestore.Client(credentials=credentials, project=credentials.project_id) if firestore_client else None
+    storage_client = storage.Client(credentials=credentials, project=credentials.project_id)
+    return db, storage_client.bucket(bucket_name)
+
+
+def open_asset(url: str):
+    """Open a pooled streaming response for an asset URL"""
+    return shared_pool.open('GET', url, headers={'User-Agent': 'Mozilla/5.0'})
+
+
+def download_asset(url: str) -> bytes:
+    """Download asset from URL"""
+    with metrics.timer("asset_download") as call:
+        with open_asset(url) as response:
+            data = response.read()
+        call.bytes = len(data)
+    return data
+
+
+def collect_assets(record: dict, asset_fields: List[str]) -> List[Tuple[str, str]]:
+    """Return the (field_name, downloadURL) pairs of a record's asset fields"""
+    record_name = record.get("recordName", "")
+    fields = record.get("fields", {})
+    assets = []
     
-    def _make_request(self, endpoint: str, data: dict) -> dict:
-        url = f"{self.base_url}{endpoint}"
-        path = urllib.parse.urlparse(url).path
-        body = json.dumps(data)
-        date = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
-        signature = self._sign_request(date, body, path)
+    for field_name in asset_fields:
+        if field_name not in fields:
+            continue
         
-        headers = {
-            'Content-Type': 'application/json',
-            'X-Apple-CloudKit-Request-KeyID': self.key_id,
-            'X-Apple-CloudKit-Request-ISO8601Date': date,
-            'X-Apple-CloudKit-Request-SignatureV1': signature,
-        }
+        field_data = fields[field_name]
+        field_type = field_data.get("type", "")
         
-        req = urllib.request.Request(url, data=body.encode('utf-8'), headers=headers, method='POST')
+        # CloudKit returns assets as ASSETID type
+        if field_type not in ("ASSET", "ASSETID"):
+            continue
         
-        try:
-            with urllib.request.urlopen(req) as response:
-                return json.loads(response.read().decode('utf-8'))
-        except urllib.error.HTTPError as e:
-            error_body = e.read().decode('utf-8')
-            print(f"   ❌ CloudKit API Error: {e.code} - {error_body}")
-            raise
-    
-    def fetch_all_records(self, record_type: str) -> List[dict]:
-        all_records = []
-        continuation_marker = None
+        asset_value = field_data.get("value", {})
+        download_url = asset_value.get("downloadURL", "")
         
-        while True:
-            data = {
-                "query": {"recordType": record_type},
-                "resultsLimit": 200
-            }
-            if continuation_marker:
-                data["continuationMarker"] = continuation_marker
-            
-            result = self._make_request("/records/query", data)
-            records = result.get("records", [])
-            all_records.extend(records)
-            
-            continuation_marker = result.get("continuationMarker")
-            if not continuation_marker:
-                break
+        if not download_url:
+            print(f"      ⚠️ No downloadURL for {record_name}/{field_name}")
+            continue
         
-        return all_records
+        assets.append((field_name, download_url))
+    
+    return assets
 
 
-def download_asset(url: str) -> bytes:
-    """Download asset from URL"""
-    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-    with urllib.request.urlopen(req, timeout=30) as response:
-        return response.read()
+def put_blob(bucket, blob_path: str, data: bytes) -> str:
+    """Upload bytes to a Storage path and return the public URL"""
+    # Content type, cache-control and ACL go out with the upload itself
+    public_url = upload_policy.upload(bucket.blob(blob_path), data)
+    print(f"      ✅ {len(data)} bytes → {blob_path}")
+    return public_url
 
 
-def detect_extension(data: bytes) -> str:
-    """Detect file extension from magic bytes"""
-    if len(data) >= 4:
-        if data[:3] == b'\xff\xd8\xff':
-            return "jpg"
-        elif data[:4] == b'\x89PNG':
-            return "png"
-        elif data[:4] == b'PK\x03\x04':
-            return "usdz"
-        elif data[:4] == b'GIF8':
-            return "gif"
-    return "bin"
+def upload_asset(bucket, record_name: str, field_name: str, data: bytes) -> str:
+    """Upload asset bytes to Firebase Storage and return the public URL"""
+    blob_path = f"migrated/{record_name}/{field_name}.{detect_extension(data)}"
+    return put_blob(bucket, blob_path, data)
+
+
+def update_document(db, collection: str, record_name: str, updates: Dict[str, str]):
+    """Point the Firestore document at the migrated assets once they are all done"""
+    if not updates:
+        return
+    with metrics.timer("firestore_update", items=len(updates)):
+        db.collection(collection).document(record_name).update(updates)
+    print(f"      📝 Updated {collection}/{record_name}: {len(updates)} fields")
+
+
+def finish_record(db, collection: str, store: CheckpointStore, content_addressed: bool, record: dict,
+                  page_done: Callable[[bool], None], record_name: str, updates: Dict[str, str],
+                  failures: Dict[str, Exception]):
+    """Update the document, then journal its assets and release its page checkpoint slot"""
+    try:
+        update_document(db, collection, record_name, updates)
+    except Exception:
+        page_done(False)
+        raise
+    for field_name, public_url in updates.items():
+        # Derivative fields (<field>_thumb, ...) have no CloudKit asset to journal
+        if field_name not in record.get("fields", {}):
+            continue
+        store.mark_asset(record, field_name, public_url)
+        # Per-record paths can be overwritten later, so only content addresses are indexed
+        if content_addressed:
+            store.save_checksum(asset_checksum(record, field_name), public_url)
+    page_done(not failures)
+
+
+def plan_window(args, checkpoint_read: bool) -> str:
+    """Which records a dry run planned, as printed and written with the plan"""
+    if args.since:
+        since = datetime.fromtimestamp(args.since / 1000, timezone.utc).isoformat(timespec="seconds")
+        window = f"records modified since {since}"
+    elif args.incremental and checkpoint_read:
+        window = f"records changed since each type's last sync in {args.checkpoint}"
+    else:
+        window = "all records"
+    if args.resume and checkpoint_read:
+        window += f", minus the work already journaled in {args.checkpoint}"
+    elif (args.resume or args.incremental or args.content_addressed) and not checkpoint_read:
+        window += f" ({args.checkpoint} not found)"
+    return window
 
 
 def main():
     parser = argparse.ArgumentParser(description="Migrate CloudKit assets to Firebase Storage")
     parser.add_argument("--key-id", required=True, help="CloudKit Key ID")
     parser.add_argument("--key-file", required=True, help="CloudKit private key (.pem)")
-    parser.add_argument("--service-account", required=True, help="Firebase service account JSON")
+    parser.add_argument("--service-account", help="Firebase service account JSON (not needed with --dry-run)")
     parser.add_argument("--bucket", default="houserizz-481012.appspot.com", help="Storage bucket")
-    parser.add_argument("--dry-run", action="store_true", help="Preview only")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Plan only: tally asset counts, bytes and estimated duration from CloudKit metadata")
+    parser.add_argument("--plan-concurrency", default=None,
+                        help="Comma-separated concurrencies to estimate the duration at (default: around --download-workers)")
+    parser.add_argument("--bandwidth-mbps", type=float, default=DEFAULT_BANDWIDTH_MBPS,
+                        help="Link bandwidth assumed by the --dry-run estimate")
+    parser.add_argument("--latency-ms", type=float, default=DEFAULT_LATENCY_MS,
+                        help="Per-transfer round trip assumed by the --dry-run estimate")
+    parser.add_argument("--plan-out", help="Write the --dry-run plan to this JSON file")
+    parser.add_argument("--download-workers", type=int, default=8, help="Concurrent asset downloads")
+    parser.add_argument("--upload-workers", type=int, default=8, help="Concurrent Storage uploads")
+    parser.add_argument("--per-host-limit", type=int, default=6, help="Concurrent requests per download host")
+    parser.add_argument("--max-connections-per-host", type=int, default=10, help="Keep-alive connections kept per host")
+    parser.add_argument("--checkpoint", default="migrate_assets.checkpoint.sqlite", help="Checkpoint database path")
+    parser.add_argument("--resume", action="store_true", help="Resume from the checkpoint, skipping migrated assets")
+    parser.add_argument("--incremental", action="store_true", help="Only migrate assets changed since the last successful sync")
+    parser.add_argument("--since", type=parse_since, help="Only migrate records modified after this time (ISO8601 or ms)")
+    parser.add_argument("--content-addressed", action="store_true", help="Store blobs by content hash, uploading shared assets once")
+    parser.add_argument("--derivatives", action="store_true",
+                        help="Also upload thumbnail and medium-size copies of JPEG/PNG assets downloaded by "
+                             "this run; skipped and streamed assets get none (needs Pillow)")
+    parser.add_argument("--derivative-workers", type=int, default=os.cpu_count(),
+                        help="Processes rendering derivatives")
+    parser.add_argument("--skip-existing", action="store_true",
+                        help="List migrated/ once and skip assets whose blob already exists with the same size")
+    parser.add_argument("--chunk-size-mb", type=int, default=DEFAULT_CHUNK_SIZE // (1024 * 1024),
+                        help="Upload chunk size; larger assets are streamed instead of buffered")
+    parser.add_argument("--public-mode", choices=PUBLIC_MODES, default="acl",
+                        help="acl: public-read ACL set in the upload; bucket: bucket-level public access, no object ACL; "
+                             "make-public: separate make_public call per object")
+    parser.add_argument("--cache-control", default=DEFAULT_CACHE_CONTROL, help="Cache-Control of uploaded assets")
+    parser.add_argument("--progress-interval", type=float, default=30, help="Seconds between progress lines (0 disables)")
+    parser.add_argument("--metrics-out", help="Write final metrics to this path (.prom for Prometheus text, else JSON)")
     args = parser.parse_args()
+    if not args.service_account and not (args.dry_run and not args.skip_existing):
+        parser.error("--service-account is required unless --dry-run is given without --skip-existing")
+    if args.plan_concurrency:
+        plan_concurrency = [int(level) for level in args.plan_concurrency.split(",")]
+    else:
+        plan_concurrency = sorted({max(1, args.download_workers // 2), args.download_workers,
+                                   args.download_workers * 2, args.download_workers * 4})
     
     print("🖼️ CloudKit Assets to Firebase Storage Migration")
     print("=" * 50)
     print(f"📦 Container: {CLOUDKIT_CONTAINER}")
-    print(f"🔄 Dry Run: {args.dry_run}\n")
+    print(f"🔄 Dry Run: {args.dry_run}")
+    print(f"💾 Checkpoint: {args.checkpoint} (resume: {args.resume}, incremental: {args.incremental})")
+    print(f"⚡ Workers: {args.download_workers} downloads, {args.upload_workers} uploads, {args.per_host_limit} per host\n")
+    
+    renderer = None
+    if args.derivatives and not args.dry_run:
+        import derivatives
+        if not derivatives.available():
+            print("❌ --derivatives needs Pillow: pip install Pillow")
+            sys.exit(1)
+        renderer = derivatives.DerivativeRenderer(args.derivative_workers)
     
     # Initialize clients
     print("🔧 Initializing...")
+    shared_pool.max_per_host = args.max_connections_per_host
+    upload_policy.public_mode = args.public_mode
+    upload_policy.cache_control = args.cache_control
     ck = CloudKitClient(CLOUDKIT_CONTAINER, args.key_id, args.key_file, CLOUDKIT_ENVIRONMENT)
     
-    credentials = service_account.Credentials.from_service_account_file(args.service_account)
-    db = firestore.Client(credentials=credentials, project=credentials.project_id)
-    storage_client = storage.Client(credentials=credentials, project=credentials.project_id)
-    bucket = storage_client.bucket(args.bucket)
+    # A plan touches Storage only to list existing blobs, and Firestore never
+    db = bucket = None
+    if not args.dry_run or args.skip_existing:
+        db, bucket = connect_google(args.service_account, args.bucket, firestore_client=not args.dry_run)
+    
+    skip_unchanged = args.resume or args.incremental
+    if args.dry_run:
+        # A plan reads the real checkpoint, so --resume/--incremental price only what is left
+        # and --content-addressed leaves out stored checksums; page progress goes to a throwaway database
+        planning_checkpoint = (skip_unchanged or args.content_addressed) and os.path.exists(args.checkpoint)
+        store = CheckpointStore(args.checkpoint, read_only=True) if planning_checkpoint else CheckpointStore()
+        page_store = CheckpointStore()
+    else:
+        store = page_store = CheckpointStore(args.checkpoint)
+        if args.incremental and not args.resume:
+            store.reset(keep_manifest=True)
+        elif not args.resume:
+            store.reset()
+    run_started = int(time.time() * 1000)
+    
+    content_uploader = None
+    upload = partial(upload_asset, bucket)
+    if args.content_addressed:
+        content_uploader = ContentAddressedUploader(store, partial(put_blob, bucket))
+        upload = content_uploader
+    
+    streamer = StreamingUploader(
+        bucket,
+        open_asset,
+        chunk_size=args.chunk_size_mb * 1024 * 1024,
+        content_store=store if args.content_addressed else None
+    )
+    
+    # A plan transfers nothing, so it gets no transfer pools
+    engine = None
+    if not args.dry_run:
+        engine = TransferEngine(
+            download_asset,
+            upload,
+            download_workers=args.download_workers,
+            upload_workers=args.upload_workers,
+            per_host_limit=args.per_host_limit,
+            stream=streamer,
+            derivatives=renderer
+        )
+    plan = TransferPlan()
+    
+    # Read-only, so dry runs list too and show what would be skipped
+    blob_index = None
+    if args.skip_existing:
+        print("🔎 Listing existing blobs under migrated/...")
+        blob_index = BlobIndex.list(bucket)
+        print(f"   {len(blob_index)} blobs found")
     
     print("✅ Initialized\n")
+    metrics.start_reporter(args.progress_interval)
     
     total_assets = 0
-    uploaded_assets = 0
+    skipped_assets = 0
+    known_checksum_assets = 0
+    existing_assets = 0
+    type_checkpointers = []
     
-    for record_type, config in ASSET_RECORDS.items():
-        collection = config["collection"]
-        asset_fields = config["asset_fields"]
-        
-        print(f"📋 Processing {record_type} → {collection}...")
-        
-        try:
-            records = ck.fetch_all_records(record_type)
-            print(f"   Found {len(records)} records")
+    with engine or contextlib.nullcontext():
+        for record_type, config in ASSET_RECORDS.items():
+            collection = config["collection"]
+            asset_fields = config["asset_fields"]
             
-            for record in records:
-                record_name = record.get("recordName", "")
-                fields = record.get("fields", {})
-                updates = {}
-                
-                for field_name in asset_fields:
-                    if field_name not in fields:
-                        continue
-                    
-                    field_data = fields[field_name]
-                    field_type = field_data.get("type", "")
-                    
-                    # CloudKit returns assets as ASSETID type
-                    if field_type not in ("ASSET", "ASSETID"):
-                        continue
-                    
-                    asset_value = field_data.get("value", {})
-                    download_url = asset_value.get("downloadURL", "")
-                    
-                    if not download_url:
-                        print(f"      ⚠️ No downloadURL for {record_name}/{field_name}")
-                        continue
-                    
-                    total_assets += 1
-                    
-                    if args.dry_run:
-                        print(f"      [DRY] Would download: {field_name} from {download_url[:60]}...")
-                        continue
-                    
-                    try:
-                        # Download from CloudKit
-                        data = download_asset(download_url)
-                        ext = detect_extension(data)
-                        
-                        # Upload to Firebase Storage
-                        blob_path = f"migrated/{record_name}/{field_name}.{ext}"
-                        blob = bucket.blob(blob_path)
+            if args.resume and store.is_complete(record_type):
+                print(f"⏭️ Skipping {record_type}: completed in a previous run\n")
+                continue
+            
+            start_marker = store.marker(record_type) if args.resume else None
+            modified_since = args.since or (store.last_sync(record_type) if args.incremental else None)
+            print(f"📋 Processing {record_type} → {collection}..." + (" (resuming)" if start_marker else ""))
+            
+            checkpointer = PageCheckpointer(page_store, record_type)
+            record_count = 0
+            try:
+                # Asset transfers for one page start while the next page is fetched;
+                # only the asset fields are requested
+                for records, next_marker in ck.iter_pages(record_type, start_marker, modified_since,
+                                                          desired_keys=asset_fields):
+                    page = checkpointer.begin_page(next_marker)
+                    for record in records:
+                        record_count += 1
+                        metrics.add_records(record_type)
+                        record_name = record.get("recordName", "")
+                        assets = collect_assets(record, asset_fields)
+                        total_assets += len(assets)
                         
-                        content_type = {
-                            "jpg": "image/jpeg",
-                            "png": "image/png",
-                            "usdz": "model/vnd.usdz+zip",
-                            "gif": "image/gif"
-                        }.get(ext, "application/octet-stream")
+                        if skip_unchanged:
+                            # Same fileChecksum (or etag) as the copy already in Storage
+                            pending = [(field_name, url) for field_name, url in assets
+                                       if not store.migrated_asset(record, field_name)]
+                            skipped_assets += len(assets) - len(pending)
+                            assets = pending
                         
-                        blob.upload_from_string(data, content_type=content_type)
-                        blob.make_public()
+                        # Already in Storage with CloudKit's size: only the document is updated
+                        resolved = {}
+                        if blob_index is not None:
+                            for field_name, _ in assets:
+                                blob = blob_index.find(record_name, field_name, asset_size(record, field_name))
+                                if blob:
+                                    resolved[field_name] = bucket.blob(blob.name).public_url
+                            assets = [(field_name, url) for field_name, url in assets if field_name not in resolved]
+                            existing_assets += len(resolved)
                         
-                        # Get public URL
-                        public_url = blob.public_url
-                        updates[field_name] = public_url
-                        uploaded_assets += 1
+                        # A fileChecksum we've already stored needs neither download nor upload
+                        if args.content_addressed:
+                            for field_name, _ in assets:
+                                public_url = store.checksum_url(asset_checksum(record, field_name))
+                                if public_url:
+                                    resolved[field_name] = public_url
+                            pending = [(field_name, url) for field_name, url in assets if field_name not in resolved]
+                            known_checksum_assets += len(assets) - len(pending)
+                            assets = pending
                         
-                        print(f"      ✅ {field_name}: {len(data)} bytes → {blob_path}")
+                        if args.dry_run:
+                            for field_name, _ in assets:
+                                plan.add(record_type, field_name, asset_size(record, field_name),
+                                         asset_checksum(record, field_name))
+                            continue
+                        if not assets and not resolved:
+                            continue
                         
-                    except Exception as e:
-                        print(f"      ❌ Failed {field_name}: {e}")
+                        # Transfers overlap across records; the document is updated
+                        # once all of this record's assets have landed.
+                        on_complete = partial(finish_record, db, collection, store, args.content_addressed,
+                                              record, checkpointer.track(page))
+                        engine.submit_record(record_name, assets, on_complete, resolved)
+                    checkpointer.end_page(page)
                 
-                # Update Firestore document
-                if updates and not args.dry_run:
-                    db.collection(collection).document(record_name).update(updates)
-                    print(f"      📝 Updated doc: {len(updates)} fields")
-            
-            print(f"   ✅ Done\n")
-            
-        except Exception as e:
-            print(f"   ❌ Error: {e}\n")
+                # Completion is known only once the queued transfers have drained
+                type_checkpointers.append((record_type, checkpointer))
+                print(f"   ✅ Queued {record_count} records\n")
+                
+            except Exception as e:
+                print(f"   ❌ Error: {e}\n")
+        
+        if engine:
+            print("⏳ Waiting for in-flight transfers...")
+    
+    for record_type, checkpointer in type_checkpointers:
+        if checkpointer.finished and not args.dry_run:
+            store.mark_complete(record_type)
+            store.save_sync(record_type, run_started)
+    store.close()
+    if page_store is not store:
+        page_store.close()
+    metrics.stop_reporter()
     
     print("=" * 50)
-    print(f"📊 Summary: {uploaded_assets}/{total_assets} assets uploaded")
+    if args.dry_run:
+        plan.report(plan_window(args, planning_checkpoint), plan_concurrency, args.bandwidth_mbps, args.latency_ms)
+        if skipped_assets:
+            print(f"\n⏭️ Not counted: {skipped_assets} unchanged assets migrated in a previous run")
+        if existing_assets:
+            print(f"\n⏭️ Not counted: {existing_assets} assets already in Storage with the same size")
+        if known_checksum_assets:
+            print(f"\n⏭️ Not counted: {known_checksum_assets} assets whose fileChecksum is already stored")
+        if args.plan_out:
+            plan.write(args.plan_out, plan_window(args, planning_checkpoint), plan_concurrency, args.bandwidth_mbps, args.latency_ms)
+            print(f"📝 Plan written to {args.plan_out}")
+        print(f"🔏 Signing: {ck.signer.stats.summary()}")
+        print(metrics.progress_line())
+        if args.metrics_out:
+            metrics.write_summary(args.metrics_out)
+        return
+    
+    print(f"📊 Summary: {engine.uploaded_assets}/{total_assets} assets uploaded ({engine.uploaded_bytes} bytes)")
+    if skipped_assets:
+        print(f"⏭️ Skipped {skipped_assets} unchanged assets migrated in a previous run")
+    if existing_assets:
+        print(f"⏭️ Skipped {existing_assets} assets already in Storage with the same size")
+    if engine.derivatives:
+        print(f"🖼️ Derivatives: {engine.uploaded_derivatives} uploaded from {engine.derivatives.rendered} images "
+              f"({engine.derivatives.failed} could not be decoded)")
+    if streamer.streamed:
+        print(f"🌊 Streamed {streamer.streamed} large assets in {args.chunk_size_mb} MB chunks")
+    if content_uploader:
+        deduplicated = content_uploader.deduplicated + streamer.deduplicated
+        deduplicated_bytes = content_uploader.deduplicated_bytes + streamer.deduplicated_bytes
+        print(f"♻️ Deduplicated: {known_checksum_assets} by checksum (no download), "
+              f"{deduplicated} by content hash ({deduplicated_bytes} bytes not stored again)")
+    print(f"🔌 HTTP: {shared_pool.stats.summary()}")
+    print(f"🔏 Signing: {ck.signer.stats.summary()}")
+    for limiter in [*ck.limiters.values(), storage_limiter]:
+        print(f"🚦 {limiter.summary()}")
+    print(metrics.progress_line())
+    if args.metrics_out:
+        metrics.write_summary(args.metrics_out)
     print("🎉 Asset migration complete!")
 
 
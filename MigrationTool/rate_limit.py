@@ -0,0 +1,270 @@
+"""
+Adaptive rate limiting and retries for CloudKit and Cloud Storage calls
+
+Each RateLimiter combines three controls:
+
+- a token bucket capping the request rate of one endpoint,
+- an AIMD concurrency window: halved whenever the service throttles us,
+  grown by one slot per window of successful calls while it is healthy,
+- retries with exponential backoff and full jitter, honouring the delay the
+  service asks for (CloudKit's `retryAfter`, HTTP Retry-After).
+
+AsyncRateLimiter applies the same policy to coroutines, waiting with
+asyncio.sleep instead of blocking a thread.
+
+Throttling (HTTP 429/503, CloudKit THROTTLED / TRY_AGAIN_LATER / ZONE_BUSY)
+and transient failures (5xx, dropped connections) are retried; anything else
+is raised straight away.
+"""
+
+import asyncio
+import http.client
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Optional, Tuple
+
+THROTTLE_STATUSES = (429, 503)
+TRANSIENT_STATUSES = (500, 502, 504)
+
+
+class Throttled(Exception):
+    """The service asked us to slow down; `retry_after` is its requested delay in seconds"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def classify(exc: Exception) -> Tuple[bool, bool, Optional[float]]:
+    """Return (retryable, throttled, retry_after) for an exception raised by a call"""
+    if isinstance(exc, Throttled):
+        return True, True, exc.retry_after
+    # urllib's HTTPError and google.api_core exceptions both carry the HTTP status
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        if code in THROTTLE_STATUSES:
+            return True, True, _retry_after_header(exc)
+        return code in TRANSIENT_STATUSES, False, None
+    if isinstance(exc, (OSError, http.client.HTTPException)) and not isinstance(exc, FileNotFoundError):
+        return True, False, None
+    return False, False, None
+
+
+def _retry_after_header(exc: Exception) -> Optional[float]:
+    headers = getattr(exc, "headers", None)
+    value = headers.get("Retry-After") if headers is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, in bursts of up to `burst`
+
+    `clock` returns the current time in seconds; tests substitute their own.
+    """
+
+    def __init__(self, rate: float, burst: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """Take a token and return 0, or return how long to wait for one"""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class AIMDWindow:
+    """Concurrency limit that halves on throttling and grows by one per healthy window"""
+
+    def __init__(self, initial: int, maximum: int, minimum: int = 1):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self._active = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def success(self):
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.maximum:
+                self._successes = 0
+                self.limit += 1
+                self._cond.notify_all()
+
+    def throttled(self):
+        with self._cond:
+            self._successes = 0
+            self.limit = max(self.minimum, self.limit // 2)
+
+
+class AsyncAIMDWindow(AIMDWindow):
+    """AIMDWindow whose slots are awaited by coroutines of one event loop"""
+
+    def __init__(self, initial: int, maximum: int, minimum: int = 1):
+        super().__init__(initial, maximum, minimum)
+        self._waiters = asyncio.Condition()
+        self._wakeups = set()
+
+    def success(self):
+        limit = self.limit
+        super().success()
+        if self.limit > limit:
+            # A wider window admits parked coroutines now, not at the next release.
+            # notify_all() needs the condition's lock, which can only be awaited.
+            wakeup = asyncio.ensure_future(self._notify())
+            self._wakeups.add(wakeup)
+            wakeup.add_done_callback(self._wakeups.discard)
+
+    async def _notify(self):
+        async with self._waiters:
+            self._waiters.notify_all()
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self._waiters:
+            await self._waiters.wait_for(lambda: self._active < self.limit)
+            self._active += 1
+        try:
+            yield
+        finally:
+            async with self._waiters:
+                self._active -= 1
+                self._waiters.notify_all()
+
+
+class RateLimiter:
+    """Runs calls to one endpoint under a token bucket, an AIMD window and a retry policy"""
+
+    def __init__(self, name: str, rate: float, burst: Optional[float] = None, concurrency: int = 4,
+                 max_concurrency: int = 32, max_attempts: int = 8, base_delay: float = 0.5,
+                 max_delay: float = 60.0):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst or rate)
+        self.window = AIMDWindow(concurrency, max_concurrency)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self._retry_reported = False
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Delay before retry number `attempt` (0-based): full jitter, at least retry_after"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Call fn, retrying throttled and transient failures; the last error is raised"""
+        for attempt in range(self.max_attempts):
+            self.bucket.acquire()
+            try:
+                with self.window.slot():
+                    result = fn(*args, **kwargs)
+            except Exception as e:
+                time.sleep(self._failed(e, attempt))
+                continue
+            self._succeeded()
+            return result
+
+    def _failed(self, e: Exception, attempt: int) -> float:
+        """Account for a failed attempt; returns the delay before retrying, or re-raises"""
+        retryable, throttled, retry_after = classify(e)
+        if throttled:
+            self.window.throttled()
+        with self._lock:
+            self.throttled += throttled
+            if not retryable or attempt + 1 == self.max_attempts:
+                self.failures += 1
+                raise e
+            self.retries += 1
+            # Only the first retry is printed: under heavy throttling one line per
+            # retry would flood the output, and summary() has the counts
+            report, self._retry_reported = not self._retry_reported, True
+        delay = self.backoff(attempt, retry_after)
+        if report:
+            print(f"      🚦 {self.name}: {'throttled' if throttled else e}; retrying in {delay:.1f}s "
+                  f"(further retries are counted in the summary)")
+        return delay
+
+    def _succeeded(self):
+        self.window.success()
+        with self._lock:
+            self.calls += 1
+
+    def summary(self) -> str:
+        return (f"{self.name}: {self.calls} calls, {self.retries} retries, {self.throttled} throttled, "
+                f"{self.failures} failed, concurrency {self.window.limit}")
+
+
+class AsyncRateLimiter(RateLimiter):
+    """RateLimiter for coroutine functions, used from one event loop"""
+
+    def __init__(self, name: str, rate: float, burst: Optional[float] = None, concurrency: int = 4,
+                 max_concurrency: int = 32, **kwargs):
+        super().__init__(name, rate, burst, concurrency, max_concurrency, **kwargs)
+        self.window = AsyncAIMDWindow(concurrency, max_concurrency)
+
+    async def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Await fn, retrying throttled and transient failures; the last error is raised"""
+        for attempt in range(self.max_attempts):
+            await self.bucket.acquire_async()
+            try:
+                async with self.window.slot():
+                    result = await fn(*args, **kwargs)
+            except Exception as e:
+                await asyncio.sleep(self._failed(e, attempt))
+                continue
+            self._succeeded()
+            return result
+
+
+# Process-wide limiter for Cloud Storage uploads
+storage_limiter = RateLimiter("storage", rate=200, burst=50, concurrency=8, max_concurrency=64)
@@ -0,0 +1,173 @@
+"""
+Record converters compiled from the CloudKit schema
+
+cloudkit-production.ckdb declares every record type and the type of each of
+its fields. SchemaConverters turns that into one precomputed converter per
+record type: a field → conversion function table, so converting a record is a
+dictionary lookup per field instead of a walk down a chain of type checks.
+Both migration scripts convert records through this module, so CloudKit
+values map to the same Firestore values whichever path imported them.
+
+Field types cannot change once a schema is deployed to production, so the
+table is trusted as is. Fields that are missing from the schema, and record
+types outside it, fall back to a lookup on the type CloudKit sent with the
+value.
+"""
+
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+SCHEMA_PATH = Path(__file__).with_name("cloudkit-production.ckdb")
+
+# Firestore collection of each record type: legacy HR* export names and the
+# record type names of the CloudKit schema. Other types go to record_type.lower().
+COLLECTION_MAPPING = {
+    "HRProduct": "products",
+    "HROrder": "orders",
+    "HRProductCategory": "productCategories",
+    "HRCity": "cities",
+    "HRAddBanner": "addBanners",
+    "HRAIVibe": "aiVibes",
+    "HRAIImageResult": "aiImageResults",
+    "HRAPI": "apis",
+    "Products": "products",
+    "Orders": "orders",
+    "ProductCategory": "productCategories",
+    "City": "cities",
+    "AddBanner": "addBanners",
+    "AIVibe": "aiVibes",
+    "DesignImageResult": "aiImageResults",
+    "API": "apis",
+    "Users": "users",
+    "SignedInUsers": "signedInUsers",
+    "Items": "items"
+}
+
+# (record, field_name, asset_value) -> stored URL
+AssetHandler = Callable[[dict, str, Any], str]
+
+_RECORD_TYPE = re.compile(r"RECORD TYPE (\w+) \((.*?)\);", re.S)
+_FIELD = re.compile(r'^\s*"?(\w+)"?\s+([A-Z0-9_]+(?:<[A-Z0-9_]+>)?)', re.M)
+
+
+def _reference(value: dict) -> str:
+    return value.get("recordName", "")
+
+
+def _timestamp(value: int) -> datetime:
+    return datetime.fromtimestamp(value / 1000)
+
+
+def _location(value: dict) -> dict:
+    return {
+        "latitude": value.get("latitude"),
+        "longitude": value.get("longitude")
+    }
+
+
+def _identity(value: Any) -> Any:
+    return value
+
+
+# CloudKit value type → Firestore value (ASSET is handled by the caller)
+VALUE_CONVERTERS: Dict[str, Callable[[Any], Any]] = {
+    "STRING": _identity,
+    "INT64": int,
+    "DOUBLE": float,
+    "TIMESTAMP": _timestamp,
+    "REFERENCE": _reference,
+    "LOCATION": _location,
+}
+
+
+def _list_converter(item_converter: Callable[[Any], Any]) -> Callable[[list], list]:
+    def convert(values: list) -> list:
+        return [item_converter(value) for value in values]
+    return convert
+
+
+def value_converter(value_type: str) -> Callable[[Any], Any]:
+    """Conversion function for a wire value type such as "INT64" or "STRING_LIST" """
+    if value_type.endswith("_LIST"):
+        item_converter = VALUE_CONVERTERS.get(value_type[:-len("_LIST")])
+        return _list_converter(item_converter) if item_converter else _identity
+    return VALUE_CONVERTERS.get(value_type, _identity)
+
+
+def parse_schema(text: str) -> Dict[str, Dict[str, str]]:
+    """Map each RECORD TYPE of a .ckdb schema to its {field: wire type}
+
+    Schema types are given as they appear on the wire, so `LIST<INT64>`
+    becomes "INT64_LIST". System fields (___etag, ___modTime, ...) are left
+    out since they never appear in a record's fields.
+    """
+    schema = {}
+    for record_type, body in _RECORD_TYPE.findall(text):
+        fields = {}
+        for name, field_type in _FIELD.findall(body):
+            if name == "GRANT" or name.startswith("___"):
+                continue
+            if field_type.startswith("LIST<"):
+                field_type = f"{field_type[5:-1]}_LIST"
+            fields[name] = field_type
+        schema[record_type] = fields
+    return schema
+
+
+# Table entry of fields whose value is stored as is
+_COPY = None
+# Table lookup result of fields outside the schema (and of assets)
+_MISSING = object()
+
+
+class RecordConverter:
+    """Converts records of one record type into Firestore documents"""
+
+    def __init__(self, fields: Dict[str, str]):
+        self.fields = fields
+        # field → converter, precomputed once per record type; assets stay out
+        # of the table because they need the record and the caller's upload logic
+        self._table: Dict[str, Optional[Callable[[Any], Any]]] = {
+            name: _COPY if value_type == "STRING" else value_converter(value_type)
+            for name, value_type in fields.items() if value_type != "ASSET"
+        }
+
+    def __call__(self, record: dict, convert_asset: AssetHandler) -> dict:
+        doc_data = {"id": record.get("recordName", "")}
+        table = self._table
+        for field_name, field_value in record.get("fields", {}).items():
+            converter = table.get(field_name, _MISSING)
+            if converter is _COPY:
+                doc_data[field_name] = field_value.get("value")
+            elif converter is not _MISSING:
+                doc_data[field_name] = converter(field_value.get("value"))
+            elif field_value.get("type") == "ASSET":
+                doc_data[field_name] = convert_asset(record, field_name, field_value.get("value"))
+            else:
+                doc_data[field_name] = value_converter(field_value.get("type", ""))(field_value.get("value"))
+        return doc_data
+
+
+class SchemaConverters:
+    """Compiled converters for every record type of a schema"""
+
+    def __init__(self, schema: Dict[str, Dict[str, str]]):
+        self.schema = schema
+        self._converters = {record_type: RecordConverter(fields) for record_type, fields in schema.items()}
+        # Record types outside the schema only use the wire-type fallback
+        self._generic = RecordConverter({})
+
+    @classmethod
+    def load(cls, path: Optional[Path] = None) -> "SchemaConverters":
+        """Compile the converters of a .ckdb schema file (the bundled one by default)"""
+        return cls(parse_schema(Path(path or SCHEMA_PATH).read_text()))
+
+    def for_type(self, record_type: str) -> RecordConverter:
+        return self._converters.get(record_type, self._generic)
+
+    def convert(self, record: dict, convert_asset: AssetHandler) -> dict:
+        """Convert a CloudKit record into Firestore document data"""
+        converter = self._converters.get(record.get("recordType", ""), self._generic)
+        return converter(record, convert_asset)
@@ -0,0 +1,162 @@
+"""
+On-disk spool of CloudKit records
+
+`cloudkit_to_firebase.py --export-spool DIR` fetches every record type once
+and writes the raw CloudKit records here; `import_to_firebase.py --spool DIR`
+replays them into Firestore as often as needed, without CloudKit latency or
+throttling.
+
+Layout:
+
+    DIR/index.json                          record types, counts and chunk list
+    DIR/<RecordType>/00000.jsonl.gz         one record per line, gzip-compressed
+    DIR/<RecordType>/00001.jsonl.gz         ...
+
+Chunks hold at most `chunk_records` records, so they can be handed to worker
+processes as independent units. The index is written last; a spool without
+one was interrupted and is refused by SpoolReader.
+"""
+
+import gzip
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+SPOOL_VERSION = 1
+INDEX_FILE = "index.json"
+DEFAULT_CHUNK_RECORDS = 5000
+# Fast compression: the spool is written once per export and read many times
+COMPRESS_LEVEL = 3
+
+
+def read_chunk(path: str) -> Iterator[dict]:
+    """Records of one chunk file, in order"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+class _TypeWriter:
+    """Chunked output of one record type; used by one thread at a time"""
+
+    def __init__(self, directory: Path, chunk_records: int):
+        self.directory = directory
+        self.chunk_records = chunk_records
+        self.records = 0
+        self.chunks: List[dict] = []
+        self._file = None
+        self._in_chunk = 0
+        directory.mkdir(parents=True, exist_ok=True)
+
+    def write(self, record: dict):
+        if self._file is None:
+            name = f"{len(self.chunks):05d}.jsonl.gz"
+            self.chunks.append({"file": name, "records": 0})
+            self._file = gzip.open(self.directory / name, "wt", encoding="utf-8", compresslevel=COMPRESS_LEVEL)
+        self._file.write(json.dumps(record, separators=(",", ":")))
+        self._file.write("\n")
+        self._in_chunk += 1
+        self.records += 1
+        if self._in_chunk >= self.chunk_records:
+            self._close_chunk()
+
+    def _close_chunk(self):
+        if self._file is not None:
+            self._file.close()
+            self.chunks[-1]["records"] = self._in_chunk
+            self._file = None
+            self._in_chunk = 0
+
+    def close(self):
+        self._close_chunk()
+
+
+class SpoolWriter:
+    """Writes a spool; each record type gets its own writer so types can be exported concurrently"""
+
+    def __init__(self, directory: str, chunk_records: int = DEFAULT_CHUNK_RECORDS, **metadata):
+        self.directory = Path(directory)
+        self.chunk_records = chunk_records
+        self.metadata = metadata
+        self._lock = threading.Lock()
+        self._types: Dict[str, _TypeWriter] = {}
+        self._complete: Dict[str, bool] = {}
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # A stale index would describe chunks that are about to be overwritten
+        index_path = self.directory / INDEX_FILE
+        if index_path.exists():
+            index_path.unlink()
+
+    def writer(self, record_type: str) -> _TypeWriter:
+        with self._lock:
+            if record_type not in self._types:
+                self._types[record_type] = _TypeWriter(self.directory / record_type, self.chunk_records)
+            return self._types[record_type]
+
+    def finish_type(self, record_type: str, complete: bool):
+        """Close a record type's last chunk; incomplete types are flagged in the index"""
+        self.writer(record_type).close()
+        with self._lock:
+            self._complete[record_type] = complete
+
+    def close(self):
+        """Write the index, which makes the spool readable"""
+        with self._lock:
+            types = dict(self._types)
+        record_types = {}
+        for record_type, type_writer in types.items():
+            type_writer.close()
+            record_types[record_type] = {
+                "records": type_writer.records,
+                "complete": self._complete.get(record_type, False),
+                "chunks": type_writer.chunks,
+            }
+        index = {
+            "version": SPOOL_VERSION,
+            "created_at": int(time.time() * 1000),
+            **self.metadata,
+            "record_types": record_types,
+        }
+        tmp_path = self.directory / (INDEX_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(index, f, indent=2)
+            f.write("\n")
+        os.replace(tmp_path, self.directory / INDEX_FILE)
+
+
+class SpoolReader:
+    """Reads a finished spool"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        index_path = self.directory / INDEX_FILE
+        if not index_path.exists():
+            raise FileNotFoundError(f"{index_path} not found: not a spool, or its export did not finish")
+        with open(index_path) as f:
+            self.index = json.load(f)
+        if self.index.get("version") != SPOOL_VERSION:
+            raise ValueError(f"Unsupported spool version {self.index.get('version')}")
+
+    @property
+    def record_types(self) -> Dict[str, dict]:
+        return self.index["record_types"]
+
+    @property
+    def records(self) -> int:
+        return sum(entry["records"] for entry in self.record_types.values())
+
+    def chunks(self, record_type: Optional[str] = None) -> List[str]:
+        """Paths of the chunk files of one record type, or of all of them"""
+        record_types = [record_type] if record_type else list(self.record_types)
+        return [
+            str(self.directory / name / chunk["file"])
+            for name in record_types
+            for chunk in self.record_types[name]["chunks"]
+        ]
+
+    def iter_records(self, record_type: Optional[str] = None) -> Iterator[dict]:
+        for path in self.chunks(record_type):
+            yield from read_chunk(path)
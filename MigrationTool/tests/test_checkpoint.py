@@ -0,0 +1,122 @@
+"""
+Unit tests of checkpoint.py: the resume marker and the sync manifest
+
+Run from MigrationTool/: python3 -m pytest tests
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from checkpoint import CheckpointStore, PageCheckpointer  # noqa: E402
+
+
+def asset_record(record_name: str, etag: str, checksum=None) -> dict:
+    value = {"downloadURL": f"https://cvws.icloud-content.com/{record_name}", "size": 10}
+    if checksum:
+        value["fileChecksum"] = checksum
+    return {
+        "recordName": record_name,
+        "recordChangeTag": etag,
+        "modified": {"timestamp": 1700000000000},
+        "fields": {"image": {"type": "ASSETID", "value": value}},
+    }
+
+
+class PageCheckpointerTest(unittest.TestCase):
+    def setUp(self):
+        self.store = CheckpointStore()
+        self.checkpointer = PageCheckpointer(self.store, "Products")
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_marker_waits_for_earlier_pages(self):
+        first = self.checkpointer.begin_page("marker-1")
+        first_done = self.checkpointer.track(first)
+        self.checkpointer.end_page(first)
+        second = self.checkpointer.begin_page("marker-2")
+        second_done = self.checkpointer.track(second)
+        self.checkpointer.end_page(second)
+
+        second_done(True)
+        self.assertIsNone(self.store.marker("Products"))
+        self.assertFalse(self.checkpointer.finished)
+
+        first_done(True)
+        self.assertEqual(self.store.marker("Products"), "marker-2")
+        self.assertTrue(self.checkpointer.finished)
+
+    def test_marker_waits_for_the_page_to_end(self):
+        page = self.checkpointer.begin_page("marker-1")
+        self.checkpointer.track(page)(True)
+        self.assertIsNone(self.store.marker("Products"))
+        self.checkpointer.end_page(page)
+        self.assertEqual(self.store.marker("Products"), "marker-1")
+
+    def test_failed_item_pins_the_marker(self):
+        first = self.checkpointer.begin_page("marker-1")
+        first_done = self.checkpointer.track(first)
+        self.checkpointer.end_page(first)
+        second = self.checkpointer.begin_page("marker-2")
+        failed, succeeded = self.checkpointer.track(second), self.checkpointer.track(second)
+        self.checkpointer.end_page(second)
+        third = self.checkpointer.begin_page("marker-3")
+        self.checkpointer.end_page(third)
+
+        first_done(True)
+        failed(False)
+        succeeded(True)
+        self.assertEqual(self.store.marker("Products"), "marker-1")
+        self.assertFalse(self.checkpointer.finished)
+
+
+class CheckpointStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = CheckpointStore()
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_reset_keep_manifest_keeps_documents_and_assets(self):
+        record = asset_record("product-1", "etag-1", "checksum-1")
+        self.store.save_marker("Products", "marker-1")
+        self.store.mark_complete("Products")
+        self.store.mark_document("products", record)
+        self.store.mark_asset(record, "image", "https://storage/product-1")
+        self.store.save_sync("Products", 1700000000000)
+
+        self.store.reset(keep_manifest=True)
+        self.assertIsNone(self.store.marker("Products"))
+        self.assertFalse(self.store.is_complete("Products"))
+        self.assertTrue(self.store.document_done("products", record))
+        self.assertEqual(self.store.migrated_asset(record, "image"), "https://storage/product-1")
+        self.assertEqual(self.store.last_sync("Products"), 1700000000000)
+
+        self.store.reset()
+        self.assertFalse(self.store.document_done("products", record))
+        self.assertIsNone(self.store.migrated_asset(record, "image"))
+        self.assertIsNone(self.store.last_sync("Products"))
+
+    def test_migrated_asset_compares_checksums_when_both_have_one(self):
+        self.store.mark_asset(asset_record("product-1", "etag-1", "checksum-1"), "image", "https://storage/1")
+
+        # A record edit that leaves the file alone
+        self.assertEqual(self.store.migrated_asset(asset_record("product-1", "etag-2", "checksum-1"), "image"),
+                         "https://storage/1")
+        # A new file under the same etag
+        self.assertIsNone(self.store.migrated_asset(asset_record("product-1", "etag-1", "checksum-2"), "image"))
+
+    def test_migrated_asset_falls_back_to_the_etag(self):
+        self.store.mark_asset(asset_record("product-1", "etag-1"), "image", "https://storage/1")
+
+        self.assertEqual(self.store.migrated_asset(asset_record("product-1", "etag-1", "checksum-1"), "image"),
+                         "https://storage/1")
+        self.assertIsNone(self.store.migrated_asset(asset_record("product-1", "etag-2", "checksum-1"), "image"))
+        self.assertIsNone(self.store.migrated_asset(asset_record("product-2", "etag-1"), "image"))
+
+
+if __name__ == "__main__":
+    unittest.main()
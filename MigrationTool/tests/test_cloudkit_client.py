@@ -0,0 +1,109 @@
+"""
+Tests of cloudkit_client.py: both clients page through the same query the
+same way, against the CloudKit fake of benchmarks/fakes.py
+
+Run from MigrationTool/: python3 -m pytest tests
+"""
+
+import asyncio
+import io
+import sys
+import tempfile
+import unittest
+import unittest.mock
+import urllib.error
+from pathlib import Path
+
+MIGRATION_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(MIGRATION_DIR / "benchmarks"))
+sys.path.insert(0, str(MIGRATION_DIR))
+
+import cloudkit_client  # noqa: E402
+from bench_migration import write_key  # noqa: E402
+from fakes import FakeCloudKitServer, generate_catalog  # noqa: E402
+from record_schema import SchemaConverters  # noqa: E402
+
+RECORDS = 450
+
+
+class CloudKitClientTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.key_file = str(Path(cls.tmp.name) / "key.pem")
+        write_key(Path(cls.key_file))
+        cls.catalog = generate_catalog(SchemaConverters.load().schema, RECORDS, asset_size=16)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        self.server = FakeCloudKitServer(self.catalog).__enter__()
+        patch = unittest.mock.patch.object(cloudkit_client, "CLOUDKIT_API_HOST", self.server.url)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.addCleanup(self.server.__exit__, None, None, None)
+
+    def names(self, records) -> list:
+        return [record["recordName"] for record in records]
+
+    def test_clients_return_the_same_pages(self):
+        blocking = cloudkit_client.CloudKitClient("container", "key", self.key_file)
+        pages = [(self.names(records), marker) for records, marker in blocking.iter_pages("Products")]
+
+        async def async_pages():
+            async with cloudkit_client.AsyncCloudKitClient("container", "key", self.key_file) as client:
+                return [(self.names(records), marker) async for records, marker in client.iter_pages("Products")]
+
+        self.assertEqual(asyncio.run(async_pages()), pages)
+        self.assertEqual(len(pages), 3)
+        self.assertIsNone(pages[-1][1])
+        self.assertEqual(sum(len(names) for names, _ in pages), RECORDS)
+
+    def test_iter_records_sync(self):
+        client = cloudkit_client.AsyncCloudKitClient("container", "key", self.key_file)
+        names = self.names(client.iter_records_sync("Products", desired_keys=[]))
+        self.assertEqual(names, self.names(self.catalog["Products"]))
+
+        # Abandoning the iteration midway must not break the next one
+        records = client.iter_records_sync("Orders")
+        self.assertEqual([next(records)["recordName"] for _ in range(3)],
+                         self.names(self.catalog["Orders"][:3]))
+        records.close()
+        self.assertEqual(len(client.fetch_all_records_sync("Orders")), RECORDS)
+
+    def test_rejected_modtime_filter_falls_back_to_a_full_scan(self):
+        blocking = cloudkit_client.CloudKitClient("container", "key", self.key_file)
+        query_records = blocking.query_records
+
+        def query(record_type, marker, modified_since, *args):
+            if modified_since is not None:
+                raise urllib.error.HTTPError("url", 400, "BAD_REQUEST", {}, io.BytesIO())
+            return query_records(record_type, marker, modified_since, *args)
+
+        blocking.query_records = query
+        with unittest.mock.patch("builtins.print"):
+            names = [name for records, _ in blocking.iter_pages("City", modified_since=1)
+                     for name in self.names(records)]
+        self.assertEqual(names, self.names(self.catalog["City"]))
+
+        async def async_names():
+            async with cloudkit_client.AsyncCloudKitClient("container", "key", self.key_file) as client:
+                query_records = client.query_records
+
+                async def query(record_type, marker, modified_since, *args):
+                    if modified_since is not None:
+                        raise urllib.error.HTTPError("url", 400, "BAD_REQUEST", {}, io.BytesIO())
+                    return await query_records(record_type, marker, modified_since, *args)
+
+                client.query_records = query
+                return [name async for records, _ in client.iter_pages("City", modified_since=1)
+                        for name in self.names(records)]
+
+        with unittest.mock.patch("builtins.print"):
+            self.assertEqual(asyncio.run(async_names()), names)
+
+
+if __name__ == "__main__":
+    unittest.main()
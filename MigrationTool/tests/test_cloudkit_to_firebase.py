@@ -0,0 +1,86 @@
+"""
+End-to-end checks of cloudkit_to_firebase.py against the local fakes of benchmarks/fakes.py
+
+Run from MigrationTool/: python3 -m pytest tests
+"""
+
+import contextlib
+import io
+import re
+import sys
+import tempfile
+import unittest
+import unittest.mock
+from pathlib import Path
+from typing import List, Tuple
+
+MIGRATION_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(MIGRATION_DIR / "benchmarks"))
+sys.path.insert(0, str(MIGRATION_DIR))
+
+from fakes import FakeCloudKitServer, generate_catalog, install_fake_google  # noqa: E402
+
+backend = install_fake_google()
+
+import cloudkit_client  # noqa: E402
+import cloudkit_to_firebase  # noqa: E402
+from bench_migration import write_key  # noqa: E402
+from record_schema import SchemaConverters  # noqa: E402
+
+
+def run_migration(catalog: dict, *args: str) -> str:
+    """Run cloudkit_to_firebase.main() against a fake CloudKit server; returns its output"""
+    with tempfile.TemporaryDirectory() as tmp, FakeCloudKitServer(catalog) as server:
+        write_key(Path(tmp) / "key.pem")
+        argv = ["cloudkit_to_firebase.py", "--progress-interval", "0",
+                "--key-id", "test", "--key-file", str(Path(tmp) / "key.pem"),
+                "--service-account", str(Path(tmp) / "sa.json"),
+                "--checkpoint", str(Path(tmp) / "checkpoint.sqlite"), *args]
+        output = io.StringIO()
+        with unittest.mock.patch.object(cloudkit_client, "CLOUDKIT_API_HOST", server.url), \
+                unittest.mock.patch.object(sys, "argv", argv), contextlib.redirect_stdout(output):
+            cloudkit_to_firebase.main()
+    return output.getvalue()
+
+
+def type_summary(output: str) -> List[str]:
+    """The per-type lines under "📊 Record types:", without their timings"""
+    lines = output.splitlines()
+    summary = lines[lines.index("📊 Record types:") + 1:][:len(cloudkit_to_firebase.RECORD_TYPES)]
+    return [re.sub(r", [0-9.]+s,", ",", line) for line in summary]
+
+
+class DryRunTest(unittest.TestCase):
+    def test_dry_run_reports_every_type_complete(self):
+        catalog = generate_catalog(SchemaConverters.load().schema, 30, asset_size=256)
+        writes = backend.db.writes
+        output = run_migration(catalog, "--dry-run")
+
+        summary = type_summary(output)
+        self.assertEqual(len(summary), len(cloudkit_to_firebase.RECORD_TYPES))
+        for line in summary:
+            self.assertTrue(line.endswith(", complete"), line)
+        self.assertNotIn("⚠️", output)
+        self.assertEqual(backend.db.writes, writes)
+
+
+class ParallelTypesTest(unittest.TestCase):
+    def migrate(self, catalog: dict, parallel_types: int) -> Tuple[List[str], dict]:
+        backend.db.documents.clear()
+        output = run_migration(catalog, "--parallel-types", str(parallel_types))
+        return sorted(type_summary(output)), dict(backend.db.documents)
+
+    def test_parallel_types_match_a_sequential_run(self):
+        catalog = generate_catalog(SchemaConverters.load().schema, 40, asset_size=256)
+        sequential_summary, sequential_documents = self.migrate(catalog, 1)
+        parallel_summary, parallel_documents = self.migrate(catalog, 4)
+
+        self.assertEqual(len(sequential_summary), len(cloudkit_to_firebase.RECORD_TYPES))
+        for line in sequential_summary:
+            self.assertTrue(line.endswith("40/40 written, 0 unchanged, complete"), line)
+        self.assertEqual(parallel_summary, sequential_summary)
+        self.assertEqual(parallel_documents, sequential_documents)
+
+
+if __name__ == "__main__":
+    unittest.main()
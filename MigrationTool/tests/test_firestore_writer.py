@@ -0,0 +1,110 @@
+"""
+Unit tests of firestore_writer.BatchWriter against the in-process Firestore fake
+
+Run from MigrationTool/: python3 -m pytest tests
+"""
+
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+
+MIGRATION_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(MIGRATION_DIR / "benchmarks"))
+sys.path.insert(0, str(MIGRATION_DIR))
+
+from fakes import FakeFirestore  # noqa: E402
+from firestore_writer import MAX_BATCH_WRITES, BatchWriter  # noqa: E402
+
+
+class FailingFirestore(FakeFirestore):
+    """Rejects every commit"""
+
+    def call(self):
+        raise RuntimeError("commit rejected")
+
+
+class ConcurrencyFirestore(FakeFirestore):
+    """Records the most commits that were ever in progress at once"""
+
+    def __init__(self, latency: float):
+        super().__init__(latency)
+        self.active = 0
+        self.peak = 0
+
+    def call(self):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            super().call()
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class Callbacks:
+    """on_commit callbacks that record their results and signal once `expected` have run"""
+
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.results = []
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, ok: bool):
+        with self._lock:
+            self.results.append(ok)
+            if len(self.results) >= self.expected:
+                self.done.set()
+
+
+class BatchWriterTest(unittest.TestCase):
+    def test_full_batch_is_committed_without_a_flush(self):
+        db = FakeFirestore()
+        callbacks = Callbacks(MAX_BATCH_WRITES)
+        with BatchWriter(db, flush_interval=60) as writer:
+            for i in range(MAX_BATCH_WRITES - 1):
+                writer.set("products", f"product-{i}", {"i": i}, callbacks)
+            time.sleep(0.1)
+            self.assertEqual(db.writes, 0)
+
+            writer.set("products", "product-last", {"i": -1}, callbacks)
+            self.assertTrue(callbacks.done.wait(5))
+            self.assertEqual((db.calls, db.writes, writer.committed), (1, MAX_BATCH_WRITES, MAX_BATCH_WRITES))
+            self.assertEqual(callbacks.results, [True] * MAX_BATCH_WRITES)
+
+    def test_partial_batch_is_flushed_by_the_timer(self):
+        db = FakeFirestore()
+        callbacks = Callbacks(3)
+        with BatchWriter(db, flush_interval=0.2) as writer:
+            for i in range(3):
+                writer.set("products", f"product-{i}", {"i": i}, callbacks)
+            self.assertTrue(callbacks.done.wait(5))
+            self.assertEqual((db.calls, db.writes), (1, 3))
+        self.assertEqual(db.documents["products/product-2"], {"i": 2})
+
+    def test_failed_commit_reports_every_document(self):
+        callbacks = Callbacks(3)
+        with BatchWriter(FailingFirestore(), flush_interval=60) as writer:
+            for i in range(3):
+                writer.set("products", f"product-{i}", {"i": i}, callbacks)
+            failures = writer.flush(wait=True)
+
+            self.assertEqual([path for path, _ in failures], [f"products/product-{i}" for i in range(3)])
+            self.assertEqual(writer.failures, failures)
+            self.assertEqual(writer.committed, 0)
+            self.assertEqual(callbacks.results, [False] * 3)
+
+    def test_commits_in_flight_are_capped(self):
+        db = ConcurrencyFirestore(latency=0.05)
+        with BatchWriter(db, batch_size=1, flush_interval=60, max_in_flight=2) as writer:
+            for i in range(8):
+                writer.set("products", f"product-{i}", {"i": i})
+        self.assertEqual(db.writes, 8)
+        self.assertEqual(db.peak, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
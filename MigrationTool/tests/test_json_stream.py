@@ -0,0 +1,98 @@
+"""
+Unit tests of json_stream.py: elements must decode exactly as json.load does
+wherever the read window happens to cut them
+
+Run from MigrationTool/: python3 -m pytest tests
+"""
+
+import io
+import json
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import json_stream  # noqa: E402
+
+RECORD = {
+    "recordName": "product-ü-1",
+    "recordType": "Products",
+    "fields": {
+        "name": {"value": "Chair \"Lounge\" \\ 🪑", "type": "STRING"},
+        "price": {"value": 1234.5, "type": "DOUBLE"},
+        "stock": {"value": -17, "type": "INT64"},
+        "tags": {"value": [], "type": "STRING_LIST"},
+    },
+    "deleted": False,
+    "created": None,
+}
+
+# Every kind of element, each of which a small window can cut anywhere
+ELEMENTS = [RECORD, 0, 7, 1234, -56, 1.5, -0.25, 1e21, 2.5E-3, 6e+2, True, False, None, "", "abé\n",
+            [], {}, [[1, [2]], {"a": {}}], RECORD]
+
+DOCUMENTS = {
+    "compact": json.dumps({"records": ELEMENTS}, separators=(",", ":"), ensure_ascii=False),
+    "indented": json.dumps({"records": ELEMENTS}, indent=4),
+    "spaced": "{ \"records\" :\n[ " + " ,\n\t ".join(json.dumps(e) for e in ELEMENTS) + " \r\n] }\n",
+    "numbers last": json.dumps({"records": [RECORD, 12345]}),
+    "float last": json.dumps({"records": [1.25]}),
+    "other keys first": json.dumps({"schema": {"records": [1]}, "count": 2, "notes": [1, [2]],
+                                    "records": ELEMENTS, "after": [3]}),
+    "top-level array": json.dumps(ELEMENTS),
+    "empty": json.dumps({"records": []}),
+    "empty spaced": "{\"records\": [ \n ] }",
+    "empty top-level array": "[]",
+    "missing": json.dumps({"other": [1, 2]}),
+}
+
+CHUNK_SIZES = [1, 2, 3, 7, 64, json_stream.DEFAULT_CHUNK_SIZE]
+
+
+def expected(document: str) -> list:
+    loaded = json.loads(document)
+    return loaded if isinstance(loaded, list) else loaded.get("records", [])
+
+
+class IterArrayTest(unittest.TestCase):
+    def test_matches_json_load(self):
+        for name, document in DOCUMENTS.items():
+            for chunk_size in CHUNK_SIZES:
+                with self.subTest(document=name, chunk_size=chunk_size):
+                    stream = io.BytesIO(document.encode("utf-8"))
+                    self.assertEqual(list(json_stream.iter_array(stream, chunk_size=chunk_size)),
+                                     expected(document))
+
+    def test_raw_elements_decode_to_the_same_values(self):
+        for name, document in DOCUMENTS.items():
+            for chunk_size in CHUNK_SIZES:
+                with self.subTest(document=name, chunk_size=chunk_size):
+                    stream = io.BytesIO(document.encode("utf-8"))
+                    raw = list(json_stream.iter_raw_array(stream, chunk_size=chunk_size))
+                    self.assertEqual([json.loads(text) for text in raw], expected(document))
+
+    def test_raw_batches_split_the_records(self):
+        document = DOCUMENTS["spaced"]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "export.json"
+            path.write_text(document, encoding="utf-8")
+            for batch_size in (1, 2, 5, len(ELEMENTS), 100):
+                for chunk_size in (1, 7, json_stream.DEFAULT_CHUNK_SIZE):
+                    with self.subTest(batch_size=batch_size, chunk_size=chunk_size):
+                        batches = [json.loads(batch) for batch in
+                                   json_stream.iter_raw_batches(path, batch_size, chunk_size=chunk_size)]
+                        self.assertTrue(all(0 < len(batch) <= batch_size for batch in batches))
+                        self.assertEqual([element for batch in batches for element in batch], ELEMENTS)
+
+    def test_malformed_arrays_raise(self):
+        for document in ['{"records": [1 2]}', '{"records": [1,', '{"records": [{"a": 1]}', '"records"']:
+            for chunk_size in (1, json_stream.DEFAULT_CHUNK_SIZE):
+                with self.subTest(document=document, chunk_size=chunk_size):
+                    with self.assertRaises(ValueError):
+                        list(json_stream.iter_array(io.BytesIO(document.encode()), chunk_size=chunk_size))
+
+
+if __name__ == "__main__":
+    unittest.main()
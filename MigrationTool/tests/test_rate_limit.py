@@ -0,0 +1,171 @@
+"""
+Unit tests of rate_limit.py: token bucket refill, AIMD back-off and recovery,
+and RateLimiter's retries
+
+Run from MigrationTool/: python3 -m pytest tests
+"""
+
+import asyncio
+import contextlib
+import io
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from rate_limit import AIMDWindow, AsyncAIMDWindow, RateLimiter, Throttled, TokenBucket  # noqa: E402
+
+
+class ManualClock:
+    """Starts at 0 and only moves when a test advances it; steps are powers of two so sums are exact"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_refill_at_rate(self):
+        clock = ManualClock()
+        bucket = TokenBucket(rate=8, burst=2, clock=clock)
+
+        self.assertEqual(bucket._take(), 0)
+        self.assertEqual(bucket._take(), 0)
+        self.assertEqual(bucket._take(), 0.125)
+
+        clock.now += 0.0625
+        self.assertEqual(bucket._take(), 0.0625)
+        clock.now += 0.0625
+        self.assertEqual(bucket._take(), 0)
+
+    def test_idle_time_refills_at_most_a_burst(self):
+        clock = ManualClock()
+        bucket = TokenBucket(rate=8, burst=3, clock=clock)
+        for _ in range(3):
+            bucket._take()
+
+        clock.now += 3600
+        self.assertEqual([bucket._take() for _ in range(3)], [0, 0, 0])
+        self.assertEqual(bucket._take(), 0.125)
+
+
+class AIMDWindowTest(unittest.TestCase):
+    def test_throttling_halves_down_to_the_minimum(self):
+        window = AIMDWindow(initial=10, maximum=32, minimum=2)
+        limits = []
+        for _ in range(4):
+            window.throttled()
+            limits.append(window.limit)
+        self.assertEqual(limits, [5, 2, 2, 2])
+
+    def test_one_more_slot_per_window_of_successes(self):
+        window = AIMDWindow(initial=4, maximum=6)
+        for _ in range(3):
+            window.success()
+        self.assertEqual(window.limit, 4)
+        window.success()
+        self.assertEqual(window.limit, 5)
+
+        for _ in range(5 + 6 + 100):
+            window.success()
+        self.assertEqual(window.limit, 6)
+
+    def test_throttling_restarts_the_success_count(self):
+        window = AIMDWindow(initial=8, maximum=32)
+        for _ in range(7):
+            window.success()
+        window.throttled()
+        for _ in range(3):
+            window.success()
+        self.assertEqual(window.limit, 4)
+        window.success()
+        self.assertEqual(window.limit, 5)
+
+
+
+class AsyncAIMDWindowTest(unittest.TestCase):
+    def test_growth_admits_a_parked_coroutine(self):
+        async def scenario() -> bool:
+            window = AsyncAIMDWindow(initial=1, maximum=4)
+            release = asyncio.Event()
+            admitted = asyncio.Event()
+
+            async def holder():
+                async with window.slot():
+                    await release.wait()
+
+            async def waiter():
+                async with window.slot():
+                    admitted.set()
+
+            tasks = [asyncio.ensure_future(holder()), asyncio.ensure_future(waiter())]
+            await asyncio.sleep(0.01)
+            self.assertFalse(admitted.is_set())
+
+            # One success fills a window of 1, so the limit grows to 2 while the holder still runs
+            window.success()
+            try:
+                await asyncio.wait_for(admitted.wait(), 1)
+                return window.limit == 2
+            finally:
+                release.set()
+                await asyncio.gather(*tasks)
+
+        self.assertTrue(asyncio.run(scenario()))
+
+class RateLimiterTest(unittest.TestCase):
+    def limiter(self, **kwargs) -> RateLimiter:
+        return RateLimiter("test", rate=1000, concurrency=8, base_delay=0, **kwargs)
+
+    def test_throttled_calls_are_retried_and_shrink_the_window(self):
+        limiter = self.limiter()
+        outcomes = [Throttled("slow down"), Throttled("slow down"), "ok"]
+
+        def call():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertEqual(limiter.call(call), "ok")
+        self.assertEqual((limiter.calls, limiter.retries, limiter.throttled, limiter.failures), (1, 2, 2, 0))
+        self.assertEqual(limiter.window.limit, 2)
+        # One line for the first retry only; the rest are in the counters
+        self.assertEqual(output.getvalue().count("🚦"), 1)
+
+    def test_gives_up_after_max_attempts(self):
+        limiter = self.limiter(max_attempts=3)
+
+        def call():
+            raise ConnectionResetError("reset")
+
+        with contextlib.redirect_stdout(io.StringIO()), self.assertRaises(ConnectionResetError):
+            limiter.call(call)
+        self.assertEqual((limiter.retries, limiter.failures), (2, 1))
+
+    def test_other_errors_are_not_retried(self):
+        limiter = self.limiter()
+        attempts = []
+
+        def call():
+            attempts.append(1)
+            raise KeyError("missing")
+
+        with self.assertRaises(KeyError):
+            limiter.call(call)
+        self.assertEqual((len(attempts), limiter.retries, limiter.failures), (1, 0, 1))
+
+    def test_backoff_honours_retry_after(self):
+        limiter = RateLimiter("test", rate=1000, base_delay=0.5, max_delay=4)
+        for attempt in range(10):
+            self.assertLessEqual(limiter.backoff(attempt), 4)
+            self.assertGreaterEqual(limiter.backoff(attempt, retry_after=7), 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+"""
+Size and duration plan of an asset migration, built from CloudKit metadata
+
+CloudKit returns each asset's `size` and `fileChecksum` with the record, so
+the whole job can be measured without downloading anything: asset counts
+and bytes per record type and field, bytes shared by assets with the same
+fileChecksum, and an estimated wall-clock time.
+
+The estimate is a two-limit model: a transfer takes at least one request
+round trip (`latency`), of which `concurrency` run at once, and all bytes
+must pass through the link (`bandwidth`). The slower of the two bounds the
+job:
+
+    seconds = max(assets * latency / concurrency, bytes / bandwidth)
+
+It ignores throttling and retries, so treat it as a lower bound.
+"""
+
+import json
+from typing import Dict, List, Optional, Tuple
+
+# Assumed per-transfer round trip (download + upload request) when none is given
+DEFAULT_LATENCY_MS = 250
+
+# Assumed link bandwidth in megabits per second when none is given
+DEFAULT_BANDWIDTH_MBPS = 100
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size:.0f} B"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def format_duration(seconds: float) -> str:
+    seconds = round(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+class FieldPlan:
+    """Assets of one record type's field"""
+
+    def __init__(self):
+        self.assets = 0
+        self.bytes = 0
+        self.unknown_size = 0
+
+
+class TransferPlan:
+    """Tally of the assets a run would transfer"""
+
+    def __init__(self):
+        self.fields: Dict[Tuple[str, str], FieldPlan] = {}
+        self.duplicate_assets = 0
+        self.duplicate_bytes = 0
+        self._checksums = set()
+
+    def add(self, record_type: str, field_name: str, size: Optional[int], checksum: Optional[str]):
+        entry = self.fields.setdefault((record_type, field_name), FieldPlan())
+        entry.assets += 1
+        if size is None:
+            entry.unknown_size += 1
+            return
+        entry.bytes += size
+        if checksum:
+            if checksum in self._checksums:
+                self.duplicate_assets += 1
+                self.duplicate_bytes += size
+            else:
+                self._checksums.add(checksum)
+
+    @property
+    def assets(self) -> int:
+        return sum(entry.assets for entry in self.fields.values())
+
+    @property
+    def bytes(self) -> int:
+        return sum(entry.bytes for entry in self.fields.values())
+
+    @property
+    def unknown_size(self) -> int:
+        return sum(entry.unknown_size for entry in self.fields.values())
+
+    def bounds(self, concurrency: int, bandwidth_mbps: float, latency_ms: float) -> Tuple[float, float]:
+        """(request-bound, bandwidth-bound) seconds; the estimate is the larger"""
+        return (self.assets * latency_ms / 1000 / max(concurrency, 1),
+                self.bytes * 8 / (bandwidth_mbps * 1_000_000))
+
+    def estimate(self, concurrency: int, bandwidth_mbps: float, latency_ms: float) -> float:
+        """Estimated seconds for the whole transfer; see the module docstring"""
+        return max(self.bounds(concurrency, bandwidth_mbps, latency_ms))
+
+    def report(self, window: str, concurrency_levels: List[int], bandwidth_mbps: float, latency_ms: float):
+        print(f"📐 Transfer plan for {window}")
+        width = max([len(f"{record_type}.{field_name}") for record_type, field_name in self.fields] + [5])
+        for (record_type, field_name), entry in self.fields.items():
+            unknown = f"  ({entry.unknown_size} without size)" if entry.unknown_size else ""
+            print(f"   {record_type + '.' + field_name:<{width}} {entry.assets:>9,} assets "
+                  f"{format_bytes(entry.bytes):>10}{unknown}")
+        unknown = f"  ({self.unknown_size} without size)" if self.unknown_size else ""
+        print(f"   {'Total':<{width}} {self.assets:>9,} assets {format_bytes(self.bytes):>10}{unknown}")
+        if self.duplicate_assets:
+            print(f"♻️ Duplicates: {self.duplicate_assets:,} assets, {format_bytes(self.duplicate_bytes)} "
+                  f"repeat an earlier fileChecksum (stored once with --content-addressed)")
+
+        print(f"\n⏱️ Estimate at {bandwidth_mbps:g} Mbit/s and {latency_ms:g} ms per transfer:")
+        for concurrency in concurrency_levels:
+            request_bound, bandwidth_bound = self.bounds(concurrency, bandwidth_mbps, latency_ms)
+            bound = "bandwidth" if bandwidth_bound >= request_bound else "requests"
+            print(f"   {concurrency:>4} concurrent: {format_duration(max(request_bound, bandwidth_bound)):>8} "
+                  f"({bound}-bound)")
+
+    def write(self, path: str, window: str, concurrency_levels: List[int], bandwidth_mbps: float,
+              latency_ms: float):
+        plan = {
+            "window": window,
+            "assets": self.assets,
+            "bytes": self.bytes,
+            "unknown_size": self.unknown_size,
+            "duplicate_assets": self.duplicate_assets,
+            "duplicate_bytes": self.duplicate_bytes,
+            "fields": [
+                {"record_type": record_type, "field": field_name, "assets": entry.assets, "bytes": entry.bytes,
+                 "unknown_size": entry.unknown_size}
+                for (record_type, field_name), entry in self.fields.items()
+            ],
+            "bandwidth_mbps": bandwidth_mbps,
+            "latency_ms": latency_ms,
+            "estimates": {
+                str(concurrency): round(self.estimate(concurrency, bandwidth_mbps, latency_ms), 1)
+                for concurrency in concurrency_levels
+            },
+        }
+        with open(path, "w") as f:
+            json.dump(plan, f, indent=2)
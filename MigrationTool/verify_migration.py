@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Post-migration verification: diff CloudKit against Firestore and Storage
+
+Streams every record type from CloudKit (or a spool), converts each record
+the same way the migration does and compares it with its Firestore document,
+fetched in batched get_all() calls. Documents are compared by a hash of
+their converted fields; only documents whose hash differs are diffed field
+by field. Asset fields must point at a Storage object that exists with
+CloudKit's size, checked against one bulk listing of the migrated/ prefix.
+
+Differences are reported per record type:
+
+- missing_document: no Firestore document for a CloudKit record
+- stale_field:      a field differs from its converted CloudKit value
+- cloudkit_url:     an asset field still holds a CloudKit URL (failed upload)
+- missing_blob:     an asset URL points at no object in the bucket
+- size_mismatch:    the object's size differs from CloudKit's asset size
+
+The exit status is 1 if anything differs, so a cutover can be gated on it.
+
+Usage:
+python3 verify_migration.py --key-id KEY --key-file eckey.pem --service-account sa.json --report-out diff.json
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+from google.cloud import firestore
+from google.cloud import storage
+from google.oauth2 import service_account
+
+import spool
+from asset_transfer import BlobIndex
+from checkpoint import asset_size
+from cloudkit_client import CloudKitClient
+from cloudkit_to_firebase import CLOUDKIT_CONTAINER, CLOUDKIT_ENVIRONMENT, RECORD_TYPES
+from http_pool import shared_pool
+from metrics import metrics
+from record_schema import COLLECTION_MAPPING, SchemaConverters
+
+# Documents per get_all() call
+FETCH_BATCH = 100
+
+# Differences printed per record type and kind; --report-out gets all of them
+REPORT_SAMPLES = 3
+
+# Stands in for asset fields, which are checked against Storage instead
+_ASSET = object()
+
+
+def _normalize(value: Any) -> Any:
+    """Comparable form of a Firestore value; timestamps become epoch milliseconds"""
+    if isinstance(value, datetime):
+        # Firestore stores naive datetimes as UTC
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return round(value.timestamp() * 1000)
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def digest(value: Any) -> str:
+    encoded = json.dumps(_normalize(value), sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+class Report:
+    """Thread-safe tally of checked documents and differences"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checked: Dict[str, int] = {}
+        self.differences: List[dict] = []
+
+    def count(self, record_type: str, documents: int):
+        with self._lock:
+            self.checked[record_type] = self.checked.get(record_type, 0) + documents
+
+    def add(self, record_type: str, kind: str, document: str, field: Optional[str] = None, **detail):
+        with self._lock:
+            self.differences.append({"record_type": record_type, "kind": kind, "document": document,
+                                     "field": field, **detail})
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        kinds: Dict[str, Dict[str, int]] = {}
+        for difference in self.differences:
+            by_kind = kinds.setdefault(difference["record_type"], {})
+            by_kind[difference["kind"]] = by_kind.get(difference["kind"], 0) + 1
+        return kinds
+
+
+class Verifier:
+    """Compares pages of CloudKit records with Firestore and the Storage listing"""
+
+    def __init__(self, db, bucket, blob_index: BlobIndex, report: Report):
+        self.db = db
+        self.blob_index = blob_index
+        self.report = report
+        self.converters = SchemaConverters.load()
+        # public_url is built locally, so a probe name gives the bucket's URL prefix
+        probe = bucket.blob("probe").public_url
+        self.url_prefix = probe[:-len("probe")]
+
+    def fetch(self, collection: str, record_names: List[str]) -> Dict[str, dict]:
+        refs = [self.db.collection(collection).document(record_name) for record_name in record_names]
+        with metrics.timer("firestore_get_all", items=len(refs)):
+            return {snapshot.id: snapshot.to_dict() for snapshot in self.db.get_all(refs) if snapshot.exists}
+
+    def check_page(self, record_type: str, records: List[dict]):
+        collection = COLLECTION_MAPPING.get(record_type, record_type.lower())
+        for start in range(0, len(records), FETCH_BATCH):
+            batch = records[start:start + FETCH_BATCH]
+            documents = self.fetch(collection, [record.get("recordName", "") for record in batch])
+            for record in batch:
+                self.check_record(record_type, collection, record, documents.get(record.get("recordName", "")))
+            self.report.count(record_type, len(batch))
+            metrics.add_records(record_type, len(batch))
+
+    def check_record(self, record_type: str, collection: str, record: dict, document: Optional[dict]):
+        path = f"{collection}/{record.get('recordName', '')}"
+        if document is None:
+            self.report.add(record_type, "missing_document", path)
+            return
+
+        expected = self.converters.convert(record, lambda record, field_name, value: _ASSET)
+        assets = [field_name for field_name, value in expected.items() if value is _ASSET]
+        fields = {field_name: value for field_name, value in expected.items() if value is not _ASSET}
+        actual = {field_name: document.get(field_name) for field_name in fields}
+        if digest(fields) != digest(actual):
+            for field_name, value in fields.items():
+                if digest(value) != digest(actual[field_name]):
+                    self.report.add(record_type, "stale_field", path, field_name,
+                                    expected=_normalize(value), actual=_normalize(actual[field_name]))
+
+        for field_name in assets:
+            self.check_asset(record_type, path, record, field_name, document.get(field_name))
+
+    def check_asset(self, record_type: str, path: str, record: dict, field_name: str, url: Any):
+        if not isinstance(url, str) or not url.startswith(self.url_prefix):
+            self.report.add(record_type, "cloudkit_url", path, field_name, url=url)
+            return
+        blob = self.blob_index.get(urllib.parse.unquote(url[len(self.url_prefix):]))
+        if blob is None:
+            self.report.add(record_type, "missing_blob", path, field_name, url=url)
+            return
+        expected_size = asset_size(record, field_name)
+        if expected_size is not None and blob.size != expected_size:
+            self.report.add(record_type, "size_mismatch", path, field_name, expected=expected_size, actual=blob.size)
+
+
+def cloudkit_pages(ck: CloudKitClient, record_type: str) -> Iterator[List[dict]]:
+    for records, _ in ck.iter_pages(record_type):
+        yield records
+
+
+def spool_pages(reader: spool.SpoolReader, record_type: str) -> Iterator[List[dict]]:
+    for path in reader.chunks(record_type):
+        yield list(spool.read_chunk(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify Firestore and Storage against CloudKit")
+    parser.add_argument("--key-id", help="CloudKit Server-to-Server Key ID")
+    parser.add_argument("--key-file", help="Path to CloudKit private key (.pem)")
+    parser.add_argument("--spool", help="Verify against a spool from --export-spool instead of live CloudKit")
+    parser.add_argument("--service-account", required=True, help="Path to Firebase service account JSON")
+    parser.add_argument("--bucket", default="houserizz-481012.appspot.com", help="Firebase Storage bucket")
+    parser.add_argument("--workers", type=int, default=8, help="Pages verified concurrently")
+    parser.add_argument("--max-connections-per-host", type=int, default=10, help="Keep-alive connections kept per host")
+    parser.add_argument("--report-out", help="Write every difference to this JSON file")
+    parser.add_argument("--progress-interval", type=float, default=30, help="Seconds between progress lines (0 disables)")
+    parser.add_argument("--metrics-out", help="Write final metrics to this path (.prom for Prometheus text, else JSON)")
+    args = parser.parse_args()
+    if not args.spool and not (args.key_id and args.key_file):
+        parser.error("--key-id and --key-file are required unless --spool is given")
+
+    print("🔍 Migration Verification")
+    print("=" * 30)
+    print(f"📦 Source: {args.spool or CLOUDKIT_CONTAINER}")
+    print(f"🪣 Storage bucket: {args.bucket}\n")
+
+    shared_pool.max_per_host = args.max_connections_per_host
+    credentials = service_account.Credentials.from_service_account_file(args.service_account)
+    db = firestore.Client(credentials=credentials, project=credentials.project_id)
+    bucket = storage.Client(credentials=credentials, project=credentials.project_id).bucket(args.bucket)
+
+    if args.spool:
+        reader = spool.SpoolReader(args.spool)
+        record_types = [record_type for record_type in RECORD_TYPES if record_type in reader.record_types]
+        pages = lambda record_type: spool_pages(reader, record_type)
+    else:
+        ck = CloudKitClient(CLOUDKIT_CONTAINER, args.key_id, args.key_file, CLOUDKIT_ENVIRONMENT)
+        record_types = RECORD_TYPES
+        pages = lambda record_type: cloudkit_pages(ck, record_type)
+
+    print("🔎 Listing migrated/ blobs...")
+    blob_index = BlobIndex.list(bucket)
+    print(f"   {len(blob_index)} blobs\n")
+
+    report = Report()
+    verifier = Verifier(db, bucket, blob_index, report)
+    started = time.monotonic()
+    metrics.start_reporter(args.progress_interval)
+
+    # Pages are read one record type at a time and checked on the pool; the
+    # bounded backlog keeps reads from running far ahead of the checks
+    backlog = threading.BoundedSemaphore(2 * args.workers)
+    errors = []
+
+    def check(record_type: str, records: List[dict]):
+        try:
+            verifier.check_page(record_type, records)
+        except Exception as e:
+            errors.append(f"{record_type}: {e}")
+            print(f"   ❌ [{record_type}] Page failed: {e}")
+        finally:
+            backlog.release()
+
+    with ThreadPoolExecutor(args.workers, thread_name_prefix="verify") as pool:
+        for record_type in record_types:
+            print(f"📋 Verifying {record_type}...")
+            try:
+                for records in pages(record_type):
+                    backlog.acquire()
+                    pool.submit(check, record_type, records)
+            except Exception as e:
+                errors.append(f"{record_type}: {e}")
+                print(f"   ❌ [{record_type}] Could not read records: {e}")
+    metrics.stop_reporter()
+
+    print(f"\n📊 Checked {sum(report.checked.values())} documents in {time.monotonic() - started:.1f}s")
+    kinds = report.summary()
+    for record_type in record_types:
+        by_kind = kinds.get(record_type, {})
+        status = ", ".join(f"{count} {kind}" for kind, count in sorted(by_kind.items())) or "✅ in sync"
+        print(f"   {record_type}: {report.checked.get(record_type, 0)} documents, {status}")
+        for kind in sorted(by_kind):
+            samples = [d for d in report.differences if d["record_type"] == record_type and d["kind"] == kind]
+            for difference in samples[:REPORT_SAMPLES]:
+                field = f".{difference['field']}" if difference["field"] else ""
+                print(f"      {kind}: {difference['document']}{field}")
+    if args.report_out:
+        with open(args.report_out, "w") as f:
+            json.dump({"checked": report.checked, "summary": kinds, "errors": errors,
+                       "differences": report.differences}, f, indent=2, default=str)
+        print(f"📝 Diff report written to {args.report_out}")
+    print(metrics.progress_line())
+    if args.metrics_out:
+        metrics.write_summary(args.metrics_out)
+
+    if report.differences or errors:
+        print(f"❌ {len(report.differences)} differences, {len(errors)} errors")
+        sys.exit(1)
+    print("🎉 Firestore and Storage match CloudKit")
+
+
+if __name__ == "__main__":
+    main()